@@ -0,0 +1,448 @@
+import argparse
+import datetime
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# Benchmark sem navegador dos caminhos de dados de recebimento.py.
+# Gera uma base sintética (semente fixa) numa pasta temporária, mede as
+# consultas, a importação do catálogo, a exportação e as páginas (AppTest),
+# grava os resultados em JSON e falha se houver regressão contra uma base.
+#
+#   python benchmark.py --escala media --saida atual.json --baseline base.json
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_SCRIPT = os.path.join(APP_DIR, 'recebimento.py')
+
+ESCALAS = {
+    'pequena': {'produtos': 2_000, 'recebimentos': 20_000, 'auditorias': 1_000, 'fotos': 100, 'conferentes': 10},
+    'media': {'produtos': 20_000, 'recebimentos': 200_000, 'auditorias': 10_000, 'fotos': 500, 'conferentes': 30},
+    'grande': {'produtos': 200_000, 'recebimentos': 1_000_000, 'auditorias': 50_000, 'fotos': 2_000, 'conferentes': 60},
+}
+
+DATA_BASE = datetime.datetime(2025, 1, 1, 6, 0)
+PERIODO_DIAS = 180
+FOTO_BYTES = 20_000
+PROPORCAO_RUIM = 0.05
+SECOES = ['FLV', 'MERCEARIA', 'FRIOS', 'PADARIA', 'ACOUGUE', 'BEBIDAS', 'LIMPEZA', 'HIGIENE']
+PALAVRAS = ['ABACATE', 'BANANA', 'TOMATE', 'ALFACE', 'CEBOLA', 'BATATA', 'MACA', 'UVA', 'LARANJA',
+            'LIMAO', 'MAMAO', 'MELAO', 'CENOURA', 'PEPINO', 'ARROZ', 'FEIJAO', 'LEITE', 'QUEIJO']
+DIAS_SEMANA = ['Segunda-feira', 'Terça-feira', 'Quarta-feira', 'Quinta-feira', 'Sexta-feira', 'Sábado', 'Domingo']
+PAGINAS = ["Recebimento", "Auditoria", "Divergentes", "Relatórios", "Consolidado", "Gestão de Usuários", "Desempenho"]
+# Cópias da base cadastradas como lojas, para o relatório consolidado
+LOJAS = 3
+
+
+# --- Geração da base sintética ---
+def load_app(db_file, pragmas=None):
+    # O módulo lê RECEBIMENTO_DB na importação; roda em modo "bare" (sem servidor)
+    os.environ['RECEBIMENTO_DB'] = db_file
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    spec = importlib.util.spec_from_file_location('recebimento', APP_SCRIPT)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    # Antes do init_db: o pool guarda os PRAGMAs ao ser criado e o journal mode fica gravado no arquivo
+    app.SQLITE_PRAGMAS.update(pragmas or {})
+    app.init_db()
+    return app
+
+def criar_lojas(app, quantidade):
+    arquivos = []
+    origem = sqlite3.connect(app.DB_FILE)
+    try:
+        for i in range(quantidade):
+            arquivo = os.path.join(os.path.dirname(app.DB_FILE), f"loja_{i:02d}.db")
+            destino = sqlite3.connect(arquivo)
+            origem.backup(destino)
+            destino.close()
+            app.save_loja(f"L{i:02d}", f"Loja {i:02d}", os.path.basename(arquivo))
+            arquivos.append(arquivo)
+    finally:
+        origem.close()
+    return arquivos
+
+def _codigo(i):
+    return str(1_000_000 + i)
+
+def _descricao(rng, i):
+    return f"{rng.choice(PALAVRAS)} {rng.choice(PALAVRAS)} {i} {rng.choice(['KG', 'UN', '500G', '1L'])}"
+
+def _momento(i, total):
+    # Registros espalhados no período, em ordem crescente de id (como na loja)
+    return DATA_BASE + datetime.timedelta(minutes=(PERIODO_DIAS * 24 * 60) * i / max(total, 1))
+
+def _datas(momento):
+    return (momento.strftime('%d/%m/%Y %H:%M'), DIAS_SEMANA[momento.weekday()],
+            momento.strftime('%H:%M'), momento.strftime('%Y-%m-%d %H:%M'))
+
+def gerar_base(db_file, escala, seed):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR REPLACE INTO usuarios (id_usuario, nome_usuario, tipo_acesso, senha) VALUES (?, ?, ?, ?)",
+                         [(f"conf{i:03d}", f"Conferente {i}", 'Conferente', '123') for i in range(escala['conferentes'])])
+        conn.executemany("INSERT OR REPLACE INTO produtos VALUES (?, ?, ?)",
+                         ((_codigo(i), _descricao(rng, i), rng.choice(SECOES)) for i in range(escala['produtos'])))
+
+        # Conteúdo opaco: as consultas medidas não decodificam a imagem
+        fotos = [rng.randbytes(FOTO_BYTES) for _ in range(escala['fotos'])]
+        hashes = [f"bench{i:08d}" for i in range(len(fotos))]
+        agora = DATA_BASE.strftime('%d/%m/%Y %H:%M')
+        conn.executemany("""
+            INSERT OR REPLACE INTO fotos (hash, conteudo, mime, tamanho, miniatura, processada, criado_em)
+            VALUES (?, ?, 'image/jpeg', ?, ?, 1, ?)
+        """, [(h, f, len(f), f[:2_000], agora) for h, f in zip(hashes, fotos)])
+
+        # 80% dos recebimentos concentrados em 20% dos produtos
+        quentes = max(1, escala['produtos'] // 5)
+        total = escala['recebimentos']
+
+        def recebimentos():
+            for i in range(total):
+                produto = rng.randrange(quentes) if rng.random() < 0.8 else rng.randrange(escala['produtos'])
+                ruim = rng.random() < PROPORCAO_RUIM
+                data, dia, hora, ts = _datas(_momento(i, total))
+                foto = rng.choice(hashes) if ruim and hashes else None
+                yield (_codigo(produto), float(rng.randint(1, 200)), 'Ruim' if ruim else 'Bom',
+                       data, dia, hora, f"conf{rng.randrange(escala['conferentes']):03d}", ts, foto)
+
+        conn.executemany("""
+            INSERT INTO recebimentos (codigo_produto, quantidade_recebida, condicao_produto, data_recebimento,
+                                      dia_semana, hora_recebimento, conferente, ts_recebimento, foto_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, recebimentos())
+
+        recebidos = conn.execute("SELECT codigo_produto, quantidade_total_recebida FROM recebimentos_totais").fetchall()
+        rng.shuffle(recebidos)
+        total = min(escala['auditorias'], len(recebidos))
+
+        def auditorias():
+            for i, (codigo, recebido) in enumerate(recebidos[:total]):
+                divergencia = 0.0 if rng.random() < 0.6 else float(rng.randint(-20, 20) or 1)
+                status = 'Solucionada' if divergencia == 0 else rng.choice(['Aberta', 'Aberta', 'Em tratamento', 'Solucionada'])
+                data, _, _, ts = _datas(_momento(i, total))
+                yield (codigo, recebido - divergencia, divergencia, data, 'prev1', status, ts)
+
+        conn.executemany("""
+            INSERT INTO auditorias (codigo_produto, quantidade_sistema, quantidade_divergente,
+                                    data_auditoria, auditor, status_divergencia, ts_auditoria)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, auditorias())
+        conn.execute("UPDATE versoes_dados SET versao = versao + 1")
+        conn.commit()
+    finally:
+        conn.close()
+
+def gerar_catalogo(escala, seed):
+    # Planilha no formato da tela de importação, com ~10% de descrições alteradas e ~5% de produtos novos
+    import openpyxl
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Código', 'Descrição', 'Seção'])
+    base = random.Random(0)
+    for i in range(escala['produtos'] + escala['produtos'] // 20):
+        descricao = _descricao(base, i)
+        if rng.random() < 0.1:
+            descricao += ' NOVA'
+        sheet.append([_codigo(i), descricao, rng.choice(SECOES)])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+# --- Medição ---
+def resumir(tempos):
+    ordenados = sorted(tempos)
+    return {
+        'n': len(ordenados),
+        'mediana_ms': round(statistics.median(ordenados) * 1000, 3),
+        'p95_ms': round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))] * 1000, 3),
+        'min_ms': round(ordenados[0] * 1000, 3),
+        'max_ms': round(ordenados[-1] * 1000, 3),
+    }
+
+def medir(fn, repeticoes, preparar=None):
+    tempos = []
+    for i in range(repeticoes):
+        if preparar is not None:
+            preparar(i)
+        inicio = time.perf_counter()
+        fn()
+        tempos.append(time.perf_counter() - inicio)
+    return resumir(tempos)
+
+def medir_dados(app, escala, seed, repeticoes):
+    rng = random.Random(seed + 1)
+    cache = app.get_query_cache(app.DB_FILE)
+    delta = app.get_delta_store(app.DB_FILE)
+    resultados = {}
+    # O import do pandas (adiado pelo app) não deve entrar na primeira medição
+    app.pd.DataFrame()
+
+    # Sem cache: cada repetição mede a ida ao SQLite
+    def sem_cache(_):
+        cache.clear()
+        delta.clear()
+
+    fim = _momento(escala['recebimentos'], escala['recebimentos']).date()
+    inicio_30d = fim - datetime.timedelta(days=30)
+    conferente = 'conf000'
+
+    resultados['product_index_load'] = medir(app.get_product_index, repeticoes, lambda _: app._load_product_index.clear())
+    codigos = [_codigo(rng.randrange(escala['produtos'])) for _ in range(1_000)]
+    tempos = []
+    for codigo in codigos:
+        inicio = time.perf_counter()
+        app.get_product_info(codigo)
+        tempos.append(time.perf_counter() - inicio)
+    resultados['get_product_info'] = resumir(tempos)
+    resultados['search_products_by_prefix'] = medir(lambda: app.search_products_by_prefix('10001'), repeticoes)
+    resultados['search_products_termo_comum'] = medir(lambda: app.search_products('banana'), repeticoes)
+    resultados['search_products_dois_termos'] = medir(lambda: app.search_products('tomate kg'), repeticoes)
+    resultados['search_products_prefixo'] = medir(lambda: app.search_products('ceb fl'), repeticoes)
+
+    consultas = {
+        'get_consolidated_recebimentos': app.get_consolidated_recebimentos,
+        'get_historico_recebimentos': app.get_historico_recebimentos,
+        'get_historico_recebimentos_profundo': lambda: app.get_historico_recebimentos(before_id=escala['recebimentos'] // 10),
+        'get_pendentes_auditoria': app.get_pendentes_auditoria,
+        'get_pendentes_auditoria_busca': lambda: app.get_pendentes_auditoria(busca='ABACATE'),
+        'count_pendentes_auditoria': app.count_pendentes_auditoria,
+        'get_auditorias_historico': app.get_auditorias_historico,
+        'get_auditorias_historico_30d': lambda: app.get_auditorias_historico(inicio_30d, fim),
+        'get_divergencias': app.get_divergencias,
+        'get_divergencias_aberta_30d': lambda: app.get_divergencias('Aberta', inicio_30d, fim),
+        'get_divergencias_date_range': app.get_divergencias_date_range,
+        'get_recebimentos_relatorio': app.get_recebimentos_relatorio,
+        'get_recebimentos_relatorio_conferente_30d': lambda: app.get_recebimentos_relatorio(conferente, inicio_30d, fim),
+        'get_conferentes': app.get_conferentes,
+        'get_resumo_recebimentos_dia': lambda: app.get_resumo_recebimentos('dia'),
+        'get_resumo_recebimentos_conferente': lambda: app.get_resumo_recebimentos('conferente'),
+        'get_resumo_recebimentos_secao_30d': lambda: app.get_resumo_recebimentos('secao', None, inicio_30d, fim),
+    }
+    for nome, fn in consultas.items():
+        resultados[nome] = medir(fn, repeticoes, sem_cache)
+    app.get_consolidated_recebimentos()
+    resultados['get_consolidated_recebimentos_cache'] = medir(app.get_consolidated_recebimentos, repeticoes)
+
+    # Atualização incremental: uma gravação entre as leituras, que releem só o delta
+    def novo_recebimento(_):
+        data, dia, hora, _ts = _datas(datetime.datetime.now())
+        app.save_reception({'codigo_produto': _codigo(rng.randrange(escala['produtos'])), 'quantidade_recebida': 1.0,
+                            'condicao_produto': 'Bom', 'data_recebimento': data, 'dia_semana': dia,
+                            'hora_recebimento': hora, 'foto_evidencia': None, 'conferente': conferente})
+
+    pendentes = app.get_divergencias()['id_auditoria'].tolist()
+
+    def nova_alteracao(i):
+        app.update_status_divergencia(pendentes[i % len(pendentes)], app.STATUS_PENDENTES[i % 2])
+
+    app.get_recebimentos_relatorio()
+    resultados['get_recebimentos_relatorio_delta'] = medir(app.get_recebimentos_relatorio, repeticoes, novo_recebimento)
+    if pendentes:
+        resultados['get_divergencias_delta'] = medir(app.get_divergencias, repeticoes, nova_alteracao)
+
+    # Consolidado: cada loja responde pelo seu resumo diário, em paralelo
+    bancos = [app.DB_FILE] + criar_lojas(app, LOJAS)
+
+    def sem_cache_lojas(_):
+        for db_file in bancos:
+            app.get_query_cache(db_file).clear()
+
+    resultados['get_consolidado_recebimentos'] = medir(lambda: app.get_consolidado_recebimentos('dia'), repeticoes, sem_cache_lojas)
+    resultados['get_consolidado_recebimentos_cache'] = medir(lambda: app.get_consolidado_recebimentos('dia'), repeticoes)
+
+    def sem_cache_exportacao(_):
+        app.export_recebimentos.clear()
+
+    resultados['export_xlsx_30d'] = medir(lambda: app.export_recebimentos('xlsx', None, inicio_30d, fim), repeticoes, sem_cache_exportacao)
+    resultados['export_csv_total'] = medir(lambda: app.export_recebimentos('csv'), repeticoes, sem_cache_exportacao)
+
+    # Duas versões do catálogo alternadas, para cada importação ter alterações reais
+    catalogos = [gerar_catalogo(escala, seed + 10), gerar_catalogo(escala, seed + 11)]
+    atual = {}
+
+    def novo_catalogo(i):
+        atual['conteudo'] = catalogos[i % 2]
+        # Sem o registro, o hash do arquivo não é reconhecido como já importado
+        with app.get_db_connection() as conn:
+            conn.execute("DELETE FROM importacoes_catalogo")
+
+    resultados['import_catalogo'] = medir(lambda: app.import_catalogo('catalogo.xlsx', atual['conteudo']), repeticoes, novo_catalogo)
+    return resultados
+
+def medir_memoria(app):
+    # Tamanho (deep) dos maiores frames com e sem os tipos compactos
+    consultas = {
+        'get_recebimentos_relatorio': app.get_recebimentos_relatorio,
+        'get_auditorias_historico': app.get_auditorias_historico,
+        'get_divergencias': app.get_divergencias,
+        'get_pendentes_auditoria_todos': lambda: app.get_pendentes_auditoria(limit=-1),
+        'get_historico_recebimentos': app.get_historico_recebimentos,
+    }
+    original = app.TIPOS_COMPACTOS
+    resultados = {}
+    for nome, fn in consultas.items():
+        tamanhos = {}
+        for compactos in (False, True):
+            app.TIPOS_COMPACTOS = compactos
+            app.get_query_cache(app.DB_FILE).clear()
+            app.get_delta_store(app.DB_FILE).clear()
+            df = fn()
+            tamanhos[compactos] = df.memory_usage(index=True, deep=True).sum() / 1024 / 1024
+        resultados[nome] = {
+            'linhas': len(df),
+            'mb_sem_tipos': round(tamanhos[False], 2),
+            'mb': round(tamanhos[True], 2),
+            'fracao': round(tamanhos[True] / tamanhos[False], 3) if tamanhos[False] else None,
+        }
+    app.TIPOS_COMPACTOS = original
+    return resultados
+
+def medir_paginas(app, repeticoes):
+    from streamlit.testing.v1 import AppTest
+
+    resultados = {}
+    delta = app.get_delta_store(app.DB_FILE)
+
+    def nova_sessao():
+        at = AppTest.from_file(APP_SCRIPT, default_timeout=600)
+        at.session_state['logged_in'] = True
+        at.session_state['user_role'] = 'Gestor'
+        at.session_state['user_id'] = 'admin'
+        return at
+
+    def login():
+        at = AppTest.from_file(APP_SCRIPT, default_timeout=600).run()
+        if at.exception:
+            raise RuntimeError(f"Página de login falhou: {at.exception}")
+
+    resultados['pagina_login'] = medir(login, repeticoes)
+    for pagina in PAGINAS:
+        tempos = {'frio': [], 'quente': []}
+        for _ in range(repeticoes):
+            at = nova_sessao().run()
+            at.sidebar.radio[0].set_value(pagina)
+            for db_file in [app.DB_FILE] + [app._caminho_loja(loja[2]) for loja in app.get_lojas()]:
+                app.get_query_cache(db_file).clear()
+            delta.clear()
+            for estado in ('frio', 'quente'):
+                inicio = time.perf_counter()
+                at.run()
+                tempos[estado].append(time.perf_counter() - inicio)
+                if at.exception:
+                    raise RuntimeError(f"Página {pagina} falhou: {at.exception}")
+        resultados[f"pagina_{pagina}"] = resumir(tempos['frio'])
+        resultados[f"pagina_{pagina}_cache"] = resumir(tempos['quente'])
+    return resultados
+
+
+# --- Comparação com a base de referência ---
+def comparar(resultados, baseline, limite, piso_ms):
+    regressoes = []
+    for nome, atual in resultados.items():
+        anterior = baseline.get('resultados', {}).get(nome)
+        if anterior is None:
+            continue
+        razao = atual['mediana_ms'] / anterior['mediana_ms'] if anterior['mediana_ms'] else float('inf')
+        # O piso absoluto evita falsos alarmes em medições de poucos milissegundos
+        if razao > 1 + limite and atual['mediana_ms'] - anterior['mediana_ms'] > piso_ms:
+            regressoes.append({
+                'nome': nome,
+                'anterior_ms': anterior['mediana_ms'],
+                'atual_ms': atual['mediana_ms'],
+                'razao': round(razao, 2),
+            })
+    return regressoes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sintético de recebimento.py")
+    parser.add_argument('--escala', choices=ESCALAS, default='pequena')
+    parser.add_argument('--produtos', type=int, help="sobrescreve a quantidade da escala")
+    parser.add_argument('--recebimentos', type=int, help="sobrescreve a quantidade da escala")
+    parser.add_argument('--auditorias', type=int, help="sobrescreve a quantidade da escala")
+    parser.add_argument('--fotos', type=int, help="sobrescreve a quantidade da escala")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--saida', help="arquivo JSON de resultados (padrão: stdout)")
+    parser.add_argument('--baseline', help="JSON de uma execução anterior para detectar regressões")
+    parser.add_argument('--limite', type=float, default=0.25, help="regressão tolerada na mediana (0.25 = 25%%)")
+    parser.add_argument('--piso-ms', type=float, default=5.0, help="diferença mínima, em ms, para contar como regressão")
+    parser.add_argument('--sem-paginas', action='store_true', help="não mede as páginas via AppTest")
+    parser.add_argument('--manter-base', action='store_true', help="não apaga a base temporária ao final")
+    args = parser.parse_args(argv)
+
+    escala = dict(ESCALAS[args.escala])
+    for chave in ('produtos', 'recebimentos', 'auditorias', 'fotos'):
+        if getattr(args, chave) is not None:
+            escala[chave] = getattr(args, chave)
+
+    pasta = tempfile.mkdtemp(prefix='bench_recebimento_')
+    db_file = os.path.join(pasta, 'gestao_recebimentos.db')
+    # A página usa caminhos relativos (logo.png)
+    os.chdir(APP_DIR)
+    try:
+        app = load_app(db_file)
+        inicio = time.perf_counter()
+        gerar_base(db_file, escala, args.seed)
+        geracao = time.perf_counter() - inicio
+        print(f"Base gerada em {geracao:.1f} s: {db_file}", file=sys.stderr)
+
+        resultados = medir_dados(app, escala, args.seed, args.repeticoes)
+        if not args.sem_paginas:
+            resultados.update(medir_paginas(app, args.repeticoes))
+
+        relatorio = {
+            'meta': {
+                'escala': args.escala,
+                'quantidades': escala,
+                'seed': args.seed,
+                'repeticoes': args.repeticoes,
+                'geracao_s': round(geracao, 2),
+                'tamanho_base_mb': round(os.path.getsize(db_file) / 1024 / 1024, 1),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'executado_em': datetime.datetime.now().isoformat(timespec='seconds'),
+            },
+            'resultados': resultados,
+            'memoria': medir_memoria(app),
+            'regressoes': [],
+        }
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if baseline.get('meta', {}).get('quantidades') != escala:
+                print("Aviso: a baseline foi gerada em outra escala", file=sys.stderr)
+            relatorio['regressoes'] = comparar(resultados, baseline, args.limite, args.piso_ms)
+
+        saida = json.dumps(relatorio, ensure_ascii=False, indent=2)
+        if args.saida:
+            with open(args.saida, 'w', encoding='utf-8') as f:
+                f.write(saida)
+        else:
+            print(saida)
+
+        for regressao in relatorio['regressoes']:
+            print(f"REGRESSÃO {regressao['nome']}: {regressao['anterior_ms']} ms -> {regressao['atual_ms']} ms "
+                  f"({regressao['razao']}x)", file=sys.stderr)
+        return 1 if relatorio['regressoes'] else 0
+    finally:
+        if args.manter_base:
+            print(f"Base mantida em {pasta}", file=sys.stderr)
+        else:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
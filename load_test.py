@@ -0,0 +1,349 @@
+import argparse
+import collections
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmark
+
+# Teste de carga: quantos conferentes simultâneos um gestao_recebimentos.db aguenta.
+# N workers (threads ou processos) repetem uma mistura realista de operações
+# contra cópias da mesma base sintética, em cada combinação de journal mode e
+# estratégia de commit, e relatam vazão, latências p50/p95/p99 e locks.
+#
+#   python load_test.py --workers 4,8,16 --duracao 20 --modo processos
+
+MIX_PADRAO = 'recebimento=50,consulta=35,auditoria=10,status=5'
+ESTRATEGIAS = ('direto', 'write_behind', 'lote')
+PROPORCAO_RUIM = 0.05
+
+
+# --- Preparação ---
+def parse_mix(texto):
+    mix = {}
+    for parte in texto.split(','):
+        nome, peso = parte.split('=')
+        mix[nome.strip()] = float(peso)
+    desconhecidas = set(mix) - set(OPERACOES)
+    if desconhecidas:
+        raise ValueError(f"Operações desconhecidas no mix: {', '.join(sorted(desconhecidas))}")
+    return mix
+
+def preparar_base(pasta, escala, seed):
+    # Base semente: gerada uma vez e copiada para cada configuração
+    db_file = os.path.join(pasta, 'semente.db')
+    app = benchmark.load_app(db_file)
+    benchmark.gerar_base(db_file, escala, seed)
+    app.get_connection_pool(db_file).close_all()
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        codigos = [row[0] for row in conn.execute("SELECT codigo_produto FROM produtos ORDER BY random() LIMIT 5000")]
+        divergencias = [row[0] for row in conn.execute(
+            "SELECT id_auditoria FROM auditorias WHERE quantidade_divergente != 0 ORDER BY random() LIMIT 5000")]
+    finally:
+        conn.close()
+    return db_file, codigos, divergencias
+
+def configurar(app, db_file, journal_mode, estrategia, busy_timeout):
+    # Os caches do app são por arquivo de banco: cada configuração usa o seu
+    app.DB_FILE = db_file
+    app.SQLITE_PRAGMAS['journal_mode'] = journal_mode
+    app.SQLITE_PRAGMAS['busy_timeout'] = busy_timeout
+    app.WRITE_BEHIND_ENABLED = estrategia == 'write_behind'
+    app.init_db()
+    # O journal mode fica no arquivo: um pool aberto antes com outro PRAGMA
+    # mediria o modo errado sem aviso
+    with app.get_db_connection() as conn:
+        atual = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if atual.upper() != journal_mode.upper():
+        raise RuntimeError(f"{db_file} está em journal_mode={atual}, esperado {journal_mode}")
+
+def _foto_exemplo():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (120, 160, 60)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+# --- Operações ---
+def _agora(app):
+    now = datetime.datetime.now(app.brasilia_tz)
+    return now, now.strftime('%d/%m/%Y %H:%M')
+
+def op_recebimento(ctx):
+    now, data = _agora(ctx.app)
+    ruim = ctx.rng.random() < PROPORCAO_RUIM
+    reception_data = {
+        'codigo_produto': ctx.rng.choice(ctx.codigos),
+        'quantidade_recebida': float(ctx.rng.randint(1, 200)),
+        'condicao_produto': 'Ruim' if ruim else 'Bom',
+        'data_recebimento': data,
+        'dia_semana': ctx.app.dias_semana.get(now.strftime('%A')),
+        'hora_recebimento': now.strftime('%H:%M'),
+        'foto_evidencia': ctx.foto if ruim else None,
+        'conferente': ctx.conferente,
+    }
+    if ctx.estrategia != 'lote':
+        ctx.app.save_reception(reception_data)
+        return 'save_reception', 1
+    # Modo lote: o conferente acumula itens e grava tudo numa transação
+    ctx.lote.append(reception_data)
+    if len(ctx.lote) < ctx.tamanho_lote:
+        return None
+    itens, ctx.lote = ctx.lote, []
+    ctx.app.save_receptions(itens)
+    return 'save_receptions', len(itens)
+
+def op_consulta(ctx):
+    ctx.app.get_product_info(ctx.rng.choice(ctx.codigos))
+    return 'get_product_info', 0
+
+def op_auditoria(ctx):
+    _, data = _agora(ctx.app)
+    divergencia = float(ctx.rng.randint(-5, 5))
+    ctx.app.save_audit({
+        'codigo_produto': ctx.rng.choice(ctx.codigos),
+        'quantidade_sistema': 100.0,
+        'quantidade_divergente': divergencia,
+        'data_auditoria': data,
+        'auditor': ctx.conferente,
+        'status_divergencia': "Aberta" if divergencia != 0 else "Solucionada",
+    })
+    return 'save_audit', 0
+
+def op_status(ctx):
+    if not ctx.divergencias:
+        return None
+    ctx.app.update_status_divergencia(ctx.rng.choice(ctx.divergencias), ctx.rng.choice(ctx.app.STATUS_DIVERGENCIA))
+    return 'update_status_divergencia', 0
+
+OPERACOES = {
+    'recebimento': op_recebimento,
+    'consulta': op_consulta,
+    'auditoria': op_auditoria,
+    'status': op_status,
+}
+
+def _is_lock_error(erro):
+    mensagem = str(erro).lower()
+    return 'locked' in mensagem or 'busy' in mensagem
+
+def executar_worker(app, worker_id, params, inicio, fim):
+    ctx = argparse.Namespace(
+        app=app,
+        rng=random.Random(params['seed'] * 1000 + worker_id),
+        codigos=params['codigos'],
+        divergencias=params['divergencias'],
+        estrategia=params['estrategia'],
+        tamanho_lote=params['tamanho_lote'],
+        foto=params['foto'],
+        conferente=f"conf{worker_id % 10:03d}",
+        lote=[],
+    )
+    nomes = list(params['mix'])
+    pesos = [params['mix'][nome] for nome in nomes]
+    amostras = []
+    falhas = collections.Counter()
+    pausa = params['pausa_ms'] / 1000
+
+    while time.perf_counter() < inicio:
+        time.sleep(0.001)
+    while time.perf_counter() < fim:
+        operacao = OPERACOES[ctx.rng.choices(nomes, pesos)[0]]
+        t0 = time.perf_counter()
+        try:
+            resultado = operacao(ctx)
+        except sqlite3.OperationalError as erro:
+            falhas['lock_timeout' if _is_lock_error(erro) else 'erro'] += 1
+            ctx.lote = []
+            continue
+        except Exception:
+            falhas['erro'] += 1
+            ctx.lote = []
+            continue
+        if resultado is not None:
+            amostras.append((resultado[0], time.perf_counter() - t0, resultado[1]))
+        if pausa:
+            time.sleep(pausa)
+    return amostras, falhas
+
+def _worker_processo(worker_id, params, barreira, resultados):
+    # Cada processo carrega o app como um servidor Streamlit independente, já
+    # com os PRAGMAs da configuração (o init_db abre o pool do arquivo)
+    app = benchmark.load_app(params['db_file'], {'journal_mode': params['journal_mode'],
+                                                 'busy_timeout': params['busy_timeout']})
+    configurar(app, params['db_file'], params['journal_mode'], params['estrategia'], params['busy_timeout'])
+    barreira.wait()
+    inicio = time.perf_counter()
+    resultados.put((worker_id, executar_worker(app, worker_id, params, inicio, inicio + params['duracao'])))
+
+
+# --- Execução e relatório ---
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] * 1000 if ordenados else 0.0
+
+def _latencias(tempos):
+    ordenados = sorted(tempos)
+    return {
+        'n': len(ordenados),
+        'p50_ms': round(_percentil(ordenados, 0.50), 3),
+        'p95_ms': round(_percentil(ordenados, 0.95), 3),
+        'p99_ms': round(_percentil(ordenados, 0.99), 3),
+        'max_ms': round(ordenados[-1] * 1000, 3) if ordenados else 0.0,
+    }
+
+def _contar_recebimentos(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM recebimentos").fetchone()[0]
+    finally:
+        conn.close()
+
+def rodar_configuracao(app, params, workers, modo):
+    antes = _contar_recebimentos(params['db_file'])
+    if modo == 'threads':
+        configurar(app, params['db_file'], params['journal_mode'], params['estrategia'], params['busy_timeout'])
+        inicio = time.perf_counter() + 0.1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(executar_worker, app, i, params, inicio, inicio + params['duracao'])
+                       for i in range(workers)]
+            saidas = [future.result() for future in futures]
+        app.get_connection_pool(params['db_file']).close_all()
+    else:
+        contexto = multiprocessing.get_context('spawn')
+        barreira = contexto.Barrier(workers)
+        fila = contexto.Queue()
+        processos = [contexto.Process(target=_worker_processo, args=(i, params, barreira, fila)) for i in range(workers)]
+        for processo in processos:
+            processo.start()
+        saidas = [fila.get()[1] for _ in processos]
+        for processo in processos:
+            processo.join()
+
+    por_operacao = collections.defaultdict(list)
+    falhas = collections.Counter()
+    itens = 0
+    for amostras, falhas_worker in saidas:
+        falhas.update(falhas_worker)
+        for nome, segundos, gravados in amostras:
+            por_operacao[nome].append(segundos)
+            itens += gravados
+    operacoes = sum(len(tempos) for tempos in por_operacao.values())
+    gravados_base = _contar_recebimentos(params['db_file']) - antes
+    return {
+        'journal_mode': params['journal_mode'],
+        'estrategia': params['estrategia'],
+        'modo': modo,
+        'workers': workers,
+        'duracao_s': params['duracao'],
+        'operacoes': operacoes,
+        'vazao_ops_s': round(operacoes / params['duracao'], 1),
+        'recebimentos_s': round(itens / params['duracao'], 1),
+        'lock_timeouts': falhas['lock_timeout'],
+        'erros': falhas['erro'],
+        # Conferência: tudo que o worker viu gravado precisa estar na base
+        'consistente': gravados_base == itens,
+        'latencia': _latencias([t for tempos in por_operacao.values() for t in tempos]),
+        'latencia_por_operacao': {nome: _latencias(tempos) for nome, tempos in sorted(por_operacao.items())},
+    }
+
+def imprimir_cabecalho():
+    print(f"{'journal':8} {'estratégia':13} {'workers':>7} {'ops/s':>9} {'receb/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'locks':>6} {'erros':>6}", file=sys.stderr)
+
+def imprimir_linha(r):
+    print(f"{r['journal_mode']:8} {r['estrategia']:13} {r['workers']:>7} {r['vazao_ops_s']:>9} "
+          f"{r['recebimentos_s']:>9} {r['latencia']['p50_ms']:>8} {r['latencia']['p95_ms']:>8} "
+          f"{r['latencia']['p99_ms']:>8} {r['lock_timeouts']:>6} {r['erros']:>6}"
+          f"{'' if r['consistente'] else '  INCONSISTENTE'}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga concorrente de recebimento.py")
+    parser.add_argument('--workers', default='1,4,8', help="lista de quantidades de workers (ex.: 1,4,8,16)")
+    parser.add_argument('--modo', choices=('threads', 'processos'), default='threads')
+    parser.add_argument('--duracao', type=float, default=10.0, help="segundos de carga por configuração")
+    parser.add_argument('--journal-modes', default='WAL,DELETE')
+    parser.add_argument('--estrategias', default=','.join(ESTRATEGIAS))
+    parser.add_argument('--mix', default=MIX_PADRAO, help="pesos das operações")
+    parser.add_argument('--tamanho-lote', type=int, default=20, help="itens por gravação na estratégia lote")
+    parser.add_argument('--busy-timeout', type=int, default=5000, help="busy_timeout em ms")
+    parser.add_argument('--pausa-ms', type=float, default=0.0, help="pausa entre operações de cada worker")
+    parser.add_argument('--escala', choices=benchmark.ESCALAS, default='pequena')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help="arquivo JSON de resultados (padrão: stdout)")
+    args = parser.parse_args(argv)
+
+    estrategias = [e.strip() for e in args.estrategias.split(',')]
+    for estrategia in estrategias:
+        if estrategia not in ESTRATEGIAS:
+            parser.error(f"estratégia desconhecida: {estrategia}")
+    mix = parse_mix(args.mix)
+
+    pasta = tempfile.mkdtemp(prefix='carga_recebimento_')
+    os.chdir(benchmark.APP_DIR)
+    try:
+        semente, codigos, divergencias = preparar_base(pasta, benchmark.ESCALAS[args.escala], args.seed)
+        # A semente fica em DELETE: as cópias partem de um arquivo sem -wal pendente
+        app = benchmark.load_app(semente, {'journal_mode': 'DELETE'})
+        resultados = []
+        imprimir_cabecalho()
+        for journal_mode in [m.strip().upper() for m in args.journal_modes.split(',')]:
+            for estrategia in estrategias:
+                for workers in [int(w) for w in args.workers.split(',')]:
+                    db_file = os.path.join(pasta, f"carga_{journal_mode}_{estrategia}_{workers}.db")
+                    shutil.copy(semente, db_file)
+                    params = {
+                        'db_file': db_file,
+                        'journal_mode': journal_mode,
+                        'estrategia': estrategia,
+                        'busy_timeout': args.busy_timeout,
+                        'duracao': args.duracao,
+                        'mix': mix,
+                        'tamanho_lote': args.tamanho_lote,
+                        'pausa_ms': args.pausa_ms,
+                        'seed': args.seed,
+                        'codigos': codigos,
+                        'divergencias': divergencias,
+                        'foto': _foto_exemplo(),
+                    }
+                    resultado = rodar_configuracao(app, params, workers, args.modo)
+                    resultados.append(resultado)
+                    imprimir_linha(resultado)
+
+        saida = json.dumps({
+            'meta': {
+                'modo': args.modo,
+                'escala': args.escala,
+                'mix': mix,
+                'busy_timeout': args.busy_timeout,
+                'tamanho_lote': args.tamanho_lote,
+                'sqlite': sqlite3.sqlite_version,
+                'executado_em': datetime.datetime.now().isoformat(timespec='seconds'),
+            },
+            'resultados': resultados,
+        }, ensure_ascii=False, indent=2)
+        if args.saida:
+            with open(args.saida, 'w', encoding='utf-8') as f:
+                f.write(saida)
+        else:
+            print(saida)
+        return 0
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
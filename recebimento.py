@@ -1,13 +1,40 @@
 import streamlit as st
-import pandas as pd
 import datetime
 import io
-import base64
-import locale
-import openpyxl
+import atexit
+import bisect
+import collections
+import csv
+import functools
+import hashlib
+import importlib
+import json
+import logging
 import sqlite3
 import os
+import queue
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 import pytz
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+class _LazyModule:
+    # Adia o import de dependências pesadas (pandas ~0,5 s) até o primeiro uso,
+    # para a tela de login não pagar por elas.
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return getattr(self._modulo, atributo)
+
+pd = _LazyModule('pandas')
 
 # --- Configurações da página (sidebar e estilo) ---
 st.set_page_config(
@@ -52,135 +79,2639 @@ dias_semana = {
     'Sunday': 'Domingo'
 }
 
-# Define o fuso horário de Brasília
-brasilia_tz = pytz.timezone('America/Sao_Paulo')
+# Define o fuso horário de Brasília
+brasilia_tz = pytz.timezone('America/Sao_Paulo')
+
+# --- Instrumentação (SQL e páginas) ---
+# Mede cada comando SQL (execute + leitura das linhas) e cada página, com o
+# tamanho dos DataFrames que a página recebeu.
+# RECEBIMENTO_INSTRUMENTACAO=0 desliga tudo: o pool volta a usar a conexão
+# padrão do sqlite3 e as páginas não são embrulhadas.
+INSTRUMENTACAO_ENABLED = os.environ.get('RECEBIMENTO_INSTRUMENTACAO', '1') != '0'
+SLOW_QUERY_MS = float(os.environ.get('RECEBIMENTO_SLOW_QUERY_MS', '200'))
+METRICAS_MAX_AMOSTRAS = 2000
+METRICAS_MAX_LENTAS = 50
+_SQL_COM_PLANO = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+_SQL_COMENTARIO = re.compile(r'--[^\n]*')
+
+class PerformanceMetrics:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._queries = {}
+            self._query_samples = collections.deque(maxlen=METRICAS_MAX_AMOSTRAS)
+            self._pages = {}
+            self._slow = collections.deque(maxlen=METRICAS_MAX_LENTAS)
+
+    def record_query(self, conn, sql, params, segundos, linhas):
+        ms = segundos * 1000
+        # Chave e texto exibido numa linha só; sem os comentários '--', que
+        # engoliriam o resto do comando
+        chave = ' '.join(_SQL_COMENTARIO.sub(' ', sql).split())
+        with self._lock:
+            agregado = self._queries.setdefault(chave, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0})
+            agregado['count'] += 1
+            agregado['total_ms'] += ms
+            agregado['max_ms'] = max(agregado['max_ms'], ms)
+            agregado['rows'] += linhas
+            self._query_samples.append(ms)
+        if getattr(self._local, 'queries', None) is not None:
+            self._local.queries += 1
+        if ms >= self.slow_query_ms:
+            self._record_slow(conn, sql, chave, params, ms, linhas)
+
+    def _record_slow(self, conn, sql, chave, params, ms, linhas):
+        plano = ''
+        if params is not None and chave.upper().startswith(_SQL_COM_PLANO):
+            try:
+                # Pela classe base: o EXPLAIN não entra nas próprias métricas
+                rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                plano = '\n'.join(row[-1] for row in rows)
+            except sqlite3.Error as e:
+                plano = f"(plano indisponível: {e})"
+        logging.warning("Consulta lenta (%.1f ms, %d linhas): %s\n%s", ms, linhas, chave, plano)
+        with self._lock:
+            self._slow.append({
+                'quando': datetime.datetime.now(brasilia_tz).strftime('%d/%m/%Y %H:%M:%S'),
+                'ms': ms,
+                'rows': linhas,
+                'sql': chave,
+                'plano': plano,
+            })
+
+    def record_frame(self, tamanho):
+        if getattr(self._local, 'bytes', None) is not None:
+            self._local.bytes += tamanho
+
+    @contextmanager
+    def page(self, nome):
+        anterior = (getattr(self._local, 'queries', None), getattr(self._local, 'bytes', None))
+        self._local.queries = 0
+        self._local.bytes = 0
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000
+            consultas, tamanho = self._local.queries, self._local.bytes
+            self._local.queries, self._local.bytes = anterior
+            with self._lock:
+                pagina = self._pages.setdefault(nome, {'samples': collections.deque(maxlen=METRICAS_MAX_AMOSTRAS), 'queries': 0,
+                                                       'bytes': collections.deque(maxlen=METRICAS_MAX_AMOSTRAS)})
+                pagina['samples'].append(ms)
+                pagina['queries'] += consultas
+                pagina['bytes'].append(tamanho)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queries': {sql: dict(agregado) for sql, agregado in self._queries.items()},
+                'query_samples': list(self._query_samples),
+                'pages': {nome: {'samples': list(p['samples']), 'queries': p['queries'], 'bytes': list(p['bytes'])}
+                          for nome, p in self._pages.items()},
+                'slow': list(self._slow),
+            }
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Um registro por comando: [sql, params, segundos, linhas]; fechado quando
+    # as linhas acabam, no próximo execute ou quando o cursor é descartado.
+    _registro = None
+
+    def _iniciar(self, sql, params):
+        self._finalizar()
+        self._registro = [sql, params, 0.0, 0]
+
+    def _medir(self, inicio, linhas=0):
+        if self._registro is not None:
+            self._registro[2] += time.perf_counter() - inicio
+            self._registro[3] += linhas
+
+    def _finalizar(self):
+        registro, self._registro = self._registro, None
+        if registro is None or self.connection.metricas is None:
+            return
+        sql, params, segundos, linhas = registro
+        if linhas == 0 and self.rowcount > 0:
+            linhas = self.rowcount
+        self.connection.metricas.record_query(self.connection, sql, params, segundos, linhas)
+
+    def execute(self, sql, parameters=()):
+        self._iniciar(sql, parameters)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._medir(inicio)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._iniciar(sql, None)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._medir(inicio)
+            self._finalizar()
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        self._medir(inicio, 0 if row is None else 1)
+        if row is None:
+            self._finalizar()
+        return row
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._medir(inicio, len(rows))
+        if not rows:
+            self._finalizar()
+        return rows
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        self._medir(inicio, len(rows))
+        self._finalizar()
+        return rows
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._medir(inicio)
+            self._finalizar()
+            raise
+        self._medir(inicio, 1)
+        return row
+
+    def close(self):
+        self._finalizar()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finalizar()
+        except Exception:
+            pass
+
+class InstrumentedConnection(sqlite3.Connection):
+    metricas = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    # Connection.execute do sqlite3 não passa por cursor(): redireciona
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+@st.cache_resource
+def get_performance_metrics():
+    return PerformanceMetrics()
+
+def instrumented_page(fn):
+    if not INSTRUMENTACAO_ENABLED:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with get_performance_metrics().page(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def contar_memoria(valor):
+    # Soma à página em execução o tamanho do DataFrame entregue a ela
+    if INSTRUMENTACAO_ENABLED and hasattr(valor, 'memory_usage'):
+        get_performance_metrics().record_frame(_approx_size(valor))
+    return valor
+
+# --- Funções do Banco de Dados (SQLite) ---
+# RECEBIMENTO_DB permite apontar para outra base (ex.: benchmark, testes de carga)
+DB_FILE = os.environ.get('RECEBIMENTO_DB', "gestao_recebimentos.db")
+
+# PRAGMAs aplicados uma única vez, na abertura de cada conexão do pool.
+# WAL permite leitores simultâneos a um escritor; busy_timeout faz o SQLite
+# esperar pelo lock em vez de falhar com "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 268435456,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+# Quantas conexões ociosas o pool mantém abertas para reutilização
+POOL_MAX_IDLE = 8
+
+class ConnectionPool:
+    def __init__(self, db_file, pragmas=None, max_idle=POOL_MAX_IDLE, metricas=None):
+        self.db_file = db_file
+        self.pragmas = dict(SQLITE_PRAGMAS if pragmas is None else pragmas)
+        self.max_idle = max_idle
+        self.metricas = metricas
+        self._idle = []
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = 0
+        self._reused = 0
+        self._in_use = 0
+
+    def _connect(self):
+        timeout = self.pragmas.get('busy_timeout', 5000) / 1000
+        if self.metricas is not None:
+            conn = sqlite3.connect(self.db_file, timeout=timeout, check_same_thread=False, factory=InstrumentedConnection)
+            conn.metricas = self.metricas
+        else:
+            conn = sqlite3.connect(self.db_file, timeout=timeout, check_same_thread=False)
+        for pragma, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {valor}")
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self._reused += 1
+            self._in_use += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                raise
+            with self._lock:
+                self._opened += 1
+        return conn
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            # Conexão em estado inválido: descarta em vez de devolver ao pool
+            with self._lock:
+                self._in_use -= 1
+                self._closed += 1
+            conn.close()
+            return
+        with self._lock:
+            self._in_use -= 1
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._closed += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        # Uma transação por bloco: commit ao sair normalmente, rollback em erro
+        conn = self.acquire()
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._closed += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': self._opened - self._closed,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'opened': self._opened,
+                'reused': self._reused,
+            }
+
+# O script é reexecutado a cada interação; o cache_resource mantém um único
+# pool por processo (e por arquivo de banco) entre reruns e sessões.
+@st.cache_resource
+def get_connection_pool(db_file=DB_FILE):
+    return ConnectionPool(db_file, metricas=get_performance_metrics() if INSTRUMENTACAO_ENABLED else None)
+
+def current_db_file():
+    # Banco da loja escolhida no login; fora de uma sessão (threads de fundo,
+    # benchmark, teste de carga) vale o banco principal
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return DB_FILE
+    return st.session_state.get('db_file', DB_FILE)
+
+def get_db_connection(db_file=None):
+    return get_connection_pool(db_file or current_db_file()).connection()
+
+# --- Fila de gravação (write-behind) ---
+# Modo opcional: as gravações entram numa fila em memória e uma única thread
+# escritora as aplica em commits agrupados, sem disputa pelo lock de escrita.
+WRITE_BEHIND_ENABLED = os.environ.get('RECEBIMENTO_WRITE_BEHIND', '0') == '1'
+WRITE_BEHIND_MAX_BATCH = 200
+WRITE_BEHIND_MAX_WAIT_MS = 20
+
+class WriteBehindQueue:
+    def __init__(self, pool, max_batch=WRITE_BEHIND_MAX_BATCH, max_wait_ms=WRITE_BEHIND_MAX_WAIT_MS):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._commit_latencies = collections.deque(maxlen=1000)
+        self._batches = 0
+        self._committed = 0
+        self._failed = 0
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, fn, *args):
+        # fn(conn, *args) roda na thread escritora; o Future resolve após o commit
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("A fila de gravação foi encerrada.")
+            handle = Future()
+            self._queue.put((fn, args, handle))
+        return handle
+
+    def flush(self, timeout=None):
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, timeout=30):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        encerrar = False
+        while not encerrar:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            prazo = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if item is None:
+                    encerrar = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        inicio = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                resultados = [fn(conn, *args) for fn, args, _ in batch]
+        except Exception:
+            # Um item falhou e o grupo foi desfeito: reaplica um a um para isolar o erro
+            for item in batch:
+                self._commit_one(item)
+            return
+        self._record(inicio, len(batch))
+        for (_, _, handle), resultado in zip(batch, resultados):
+            handle.set_result(resultado)
+
+    def _commit_one(self, item):
+        fn, args, handle = item
+        inicio = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                resultado = fn(conn, *args)
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            handle.set_exception(e)
+        else:
+            self._record(inicio, 1)
+            handle.set_result(resultado)
+
+    def _record(self, inicio, itens):
+        with self._lock:
+            self._commit_latencies.append(time.perf_counter() - inicio)
+            self._batches += 1
+            self._committed += itens
+
+    def stats(self):
+        with self._lock:
+            latencias = sorted(self._commit_latencies)
+            return {
+                'depth': self._queue.qsize(),
+                'batches': self._batches,
+                'committed': self._committed,
+                'failed': self._failed,
+                'commit_ms_avg': 1000 * sum(latencias) / len(latencias) if latencias else 0.0,
+                'commit_ms_p95': 1000 * latencias[int(0.95 * (len(latencias) - 1))] if latencias else 0.0,
+            }
+
+@st.cache_resource
+def get_write_behind_queue(db_file=DB_FILE):
+    return WriteBehindQueue(get_connection_pool(db_file))
+
+def submit_write(fn, *args, wait=True):
+    # Com wait=True devolve o resultado já gravado; com wait=False, um Future
+    if WRITE_BEHIND_ENABLED:
+        handle = get_write_behind_queue(current_db_file()).submit(fn, *args)
+        return handle.result() if wait else handle
+    with get_db_connection() as conn:
+        resultado = fn(conn, *args)
+    if wait:
+        return resultado
+    handle = Future()
+    handle.set_result(resultado)
+    return handle
+
+# --- Versões dos dados e cache de consultas ---
+# Cada caminho de escrita incrementa, na mesma transação, a versão das tabelas
+# que altera. As leituras em cache usam essas versões na chave: depois de um
+# commit, a versão nova força a releitura e nenhum leitor recebe dado antigo.
+TABELAS_VERSIONADAS = ('produtos', 'recebimentos', 'auditorias', 'usuarios', 'fotos', 'lojas')
+QUERY_CACHE_MAX_ENTRIES = 256
+QUERY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+def _bump_versao(conn, *tabelas):
+    conn.executemany("UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = ?", [(t,) for t in tabelas])
+
+def get_data_versions(tabelas, conn=None):
+    if conn is None:
+        with get_db_connection() as conn:
+            return get_data_versions(tabelas, conn)
+    placeholders = ', '.join('?' for _ in tabelas)
+    versoes = dict(conn.execute(f"SELECT tabela, versao FROM versoes_dados WHERE tabela IN ({placeholders})", tuple(tabelas)))
+    return tuple(versoes.get(t, 0) for t in tabelas)
+
+def get_data_version(tabela):
+    return get_data_versions((tabela,))[0]
+
+def _approx_size(valor):
+    # deep=True conta o texto; com os tipos compactos não percorre objetos Python
+    if hasattr(valor, 'memory_usage'):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    return 1024
+
+class QueryCache:
+    def __init__(self, max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            self._misses += 1
+        valor = compute()
+        tamanho = _approx_size(valor)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (valor, tamanho)
+                self._bytes += tamanho
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, tamanho_removido) = self._entries.popitem(last=False)
+                self._bytes -= tamanho_removido
+                self._evictions += 1
+        return valor
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': self._hits / total if total else 0.0,
+            }
+
+@st.cache_resource
+def get_query_cache(db_file=DB_FILE):
+    return QueryCache()
+
+def _cache_key(fn, args, kwargs, versoes):
+    return (fn.__name__, args, tuple(sorted(kwargs.items())), versoes)
+
+def cached_query(*tabelas, central=False):
+    # Os DataFrames devolvidos são compartilhados entre sessões: não devem ser alterados.
+    # central=True: tabelas do banco principal (lojas, usuários), comuns a todas as lojas
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            db_file = DB_FILE if central else current_db_file()
+            with get_db_connection(db_file) as conn:
+                versoes = get_data_versions(tabelas, conn)
+            valor = get_query_cache(db_file).get_or_compute(_cache_key(fn, args, kwargs, versoes), lambda: fn(*args, **kwargs))
+            return contar_memoria(valor)
+        return wrapper
+    return decorator
+
+# --- Tipos dos DataFrames (esquema por tabela) ---
+# Sem tipos, cada texto lido vira um objeto Python (~60 bytes por célula no
+# pandas 2). Cada tabela declara o tipo das suas colunas: categoria para as de
+# poucos valores distintos, texto Arrow para as demais e inteiros de 32 bits
+# para contagens. Ids continuam int64 (rowid do SQLite) e quantidades float64:
+# a divergência é calculada sobre elas e arredondada em 3 casas.
+TIPOS_COMPACTOS = os.environ.get('RECEBIMENTO_TIPOS_COMPACTOS', '1') != '0'
+TEXTO = 'string[pyarrow]'
+CATEGORIA = 'category'
+ESQUEMAS = {
+    'produtos': {'codigo_produto': TEXTO, 'descricao_produto': TEXTO, 'secao_produto': CATEGORIA},
+    'recebimentos': {
+        'id_recebimento': 'int64', 'codigo_produto': TEXTO, 'quantidade_recebida': 'float64',
+        'condicao_produto': CATEGORIA, 'data_recebimento': TEXTO, 'dia_semana': CATEGORIA,
+        'hora_recebimento': CATEGORIA, 'foto_hash': TEXTO, 'conferente': CATEGORIA, 'ts_recebimento': TEXTO,
+    },
+    'auditorias': {
+        'id_auditoria': 'int64', 'codigo_produto': TEXTO, 'quantidade_sistema': 'float64',
+        'quantidade_divergente': 'float64', 'data_auditoria': TEXTO, 'auditor': CATEGORIA,
+        'status_divergencia': CATEGORIA, 'ts_auditoria': TEXTO,
+    },
+    'recebimentos_totais': {'codigo_produto': TEXTO, 'quantidade_total_recebida': 'float64'},
+    'recebimentos_diarios': {
+        'dia': TEXTO, 'conferente': CATEGORIA, 'secao_produto': CATEGORIA,
+        'qtd_recebimentos': 'int32', 'quantidade_total': 'float64', 'qtd_ruim': 'int32',
+    },
+}
+
+def tipar(df, *tabelas):
+    # Converte as colunas presentes no frame para os tipos das tabelas de origem
+    if not TIPOS_COMPACTOS:
+        return df
+    tipos = {}
+    for tabela in tabelas:
+        tipos.update({coluna: tipo for coluna, tipo in ESQUEMAS[tabela].items()
+                      if coluna in df.columns and not _tem_tipo(df[coluna].dtype, tipo)})
+    return df.astype(tipos) if tipos else df
+
+def _tem_tipo(dtype, tipo):
+    if tipo == CATEGORIA:
+        return isinstance(dtype, pd.CategoricalDtype)
+    return _mesmo_tipo(dtype, pd.api.types.pandas_dtype(tipo))
+
+def _mesmo_tipo(a, b):
+    # Comparação exata: uma coluna Arrow do DuckDB tem o mesmo nome ('string[pyarrow]') mas outro tipo
+    return type(a) is type(b) and a == b
+
+def read_sql_tipado(query, conn, params=None, tabelas=()):
+    return tipar(pd.read_sql_query(query, conn, params=params), *tabelas)
+
+def _alinhar_categorias(partes):
+    # Partes lidas separadamente (bases mensais, delta, páginas) têm categorias
+    # diferentes; sem uni-las, o concat voltaria a objetos. A primeira parte (o
+    # frame grande, num delta) só ganha categorias no fim, sem recodificar.
+    if len(partes) < 2:
+        return partes
+    primeira = partes[0]
+    tipos = {}
+    for coluna, tipo in primeira.dtypes.items():
+        if isinstance(tipo, pd.CategoricalDtype):
+            categorias = tipo.categories
+            for parte in partes[1:]:
+                valores = parte[coluna]
+                outras = (valores.cat.categories if isinstance(valores.dtype, pd.CategoricalDtype)
+                          else pd.Index(valores.dropna().unique()))
+                categorias = categorias.append(outras.difference(categorias))
+            if len(categorias) > len(tipo.categories):
+                primeira = primeira.assign(**{coluna: primeira[coluna].cat.add_categories(categorias[len(tipo.categories):])})
+            tipos[coluna] = primeira[coluna].dtype
+    return [primeira] + [_converter(parte, tipos) for parte in partes[1:]]
+
+def _converter(df, tipos):
+    # Só as colunas que de fato mudam: astype com o dicionário inteiro copia todas
+    tipos = {coluna: tipo for coluna, tipo in tipos.items() if not _mesmo_tipo(df[coluna].dtype, tipo)}
+    return df.astype(tipos) if tipos else df
+
+def concat_frames(partes):
+    # Mantém os tipos da primeira parte (ex.: colunas Arrow de uma carga pelo DuckDB)
+    partes = _alinhar_categorias(partes)
+    tipos = partes[0].dtypes.to_dict()
+    return pd.concat([partes[0]] + [_converter(parte, tipos) for parte in partes[1:]], ignore_index=True)
+
+# --- Atualização incremental (delta) dos históricos ---
+# recebimentos só recebem inserções e auditorias só mudam de status. Em vez de
+# reler a tabela a cada gravação, o frame carregado guarda o maior id já visto
+# e as versões dos dados; quando a versão muda, busca só os ids novos e as
+# auditorias com versao_alteracao maior, e aplica-os sobre uma cópia do frame.
+# Os frames são compartilhados entre sessões, como os do cache de consultas.
+# Linhas novas entram no fim: o id acompanha a data (gravada no momento).
+DELTA_MAX_ENTRIES = 64
+# Acima disso (ex.: importação em massa) sai mais barato reler tudo
+DELTA_MAX_LINHAS = 50000
+
+def _delta_clause(coluna, ids):
+    return f"{coluna} IN (SELECT value FROM json_each(?))", json.dumps(ids)
+
+class DeltaFrameStore:
+    def __init__(self, max_entries=DELTA_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # chave -> (frame, versoes, ultimo_id)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._deltas = 0
+        self._cargas = 0
+        self._linhas_delta = 0
+
+    def get(self, key, tabela, coluna_id, dependencias, alteracoes, carregar):
+        # carregar(ids) lê tudo (ids=None) ou só as linhas desses ids que passam no filtro
+        with get_db_connection() as conn:
+            versoes = get_data_versions((tabela,) + dependencias, conn)
+            with self._lock:
+                entrada = self._entries.get(key)
+                if entrada is not None:
+                    self._entries.move_to_end(key)
+            if entrada is not None and entrada[1] == versoes:
+                with self._lock:
+                    self._hits += 1
+                return entrada[0]
+            if entrada is None or entrada[1][1:] != versoes[1:]:
+                # Primeira leitura, ou mudou uma tabela da junção (ex.: descrições em produtos)
+                return self._carga_completa(conn, key, tabela, coluna_id, versoes, alteracoes, carregar)
+        return self._delta(key, tabela, coluna_id, versoes, alteracoes, carregar, entrada)
+
+    def _delta(self, key, tabela, coluna_id, versoes, alteracoes, carregar, entrada):
+        frame, versoes_anteriores, ultimo_id = entrada
+        with get_db_connection() as conn:
+            novos = [row[0] for row in conn.execute(f"SELECT {coluna_id} FROM {tabela} WHERE {coluna_id} > ?", (ultimo_id,))]
+            alterados = []
+            if alteracoes:
+                alterados = [row[0] for row in conn.execute(
+                    f"SELECT {coluna_id} FROM {tabela} WHERE versao_alteracao > ? AND {coluna_id} <= ?",
+                    (versoes_anteriores[0], ultimo_id))]
+            if len(novos) + len(alterados) > DELTA_MAX_LINHAS:
+                return self._carga_completa(conn, key, tabela, coluna_id, versoes, alteracoes, carregar, direto=True)
+
+        linhas = carregar(novos + alterados) if novos or alterados else None
+        if alterados:
+            no_frame = frame[coluna_id].isin(alterados)
+            alteradas = linhas[linhas[coluna_id] <= ultimo_id]
+            if not alteradas[coluna_id].isin(frame.loc[no_frame, coluna_id]).all():
+                # Uma linha passou a casar com o filtro (ex.: divergência reaberta):
+                # a posição dela no frame não é conhecida, então relê tudo
+                with get_db_connection() as conn:
+                    return self._carga_completa(conn, key, tabela, coluna_id, versoes, alteracoes, carregar, direto=True)
+            # As que deixaram de casar saem; as demais são atualizadas no lugar
+            frame = frame[~no_frame | frame[coluna_id].isin(alteradas[coluna_id])].reset_index(drop=True)
+            if not alteradas.empty:
+                # Um status novo precisa existir nas categorias antes de ser gravado
+                frame, alteradas = _alinhar_categorias([frame, alteradas])
+                posicoes = pd.Index(frame[coluna_id]).get_indexer(alteradas[coluna_id])
+                for posicao_coluna, coluna in enumerate(frame.columns):
+                    frame.iloc[posicoes, posicao_coluna] = alteradas[coluna].to_numpy()
+        if novos:
+            novas = linhas[linhas[coluna_id] > ultimo_id]
+            if frame.empty:
+                frame = novas.reset_index(drop=True)
+            elif not novas.empty:
+                frame = concat_frames([frame, novas])
+            ultimo_id = max(novos)
+        with self._lock:
+            self._deltas += 1
+            self._linhas_delta += len(novos) + len(alterados)
+            self._guardar(key, (frame, versoes, ultimo_id))
+        return frame
+
+    def _carga_completa(self, conn, key, tabela, coluna_id, versoes, alteracoes, carregar, direto=False):
+        # O maior id é lido antes dos dados: o que entrar durante a leitura volta no próximo delta
+        ultimo_id = conn.execute(f"SELECT MAX({coluna_id}) FROM {tabela}").fetchone()[0] or 0
+        if direto:
+            # Recarga de recuperação de um delta: um snapshot atrasado levaria ao mesmo delta
+            with sem_snapshot():
+                frame = carregar(None)
+        else:
+            frame = carregar(None)
+        cobertura = frame.attrs.pop('cobertura', None)
+        if cobertura is not None:
+            # Veio de um snapshot analítico, que pode estar atrasado: o delta a
+            # partir do que ele contém completa o que foi gravado depois
+            entrada = (frame, (cobertura['versao'],) + tuple(versoes[1:]), cobertura['ultimo_id'])
+            with self._lock:
+                self._cargas += 1
+                self._guardar(key, entrada)
+            if entrada[1] == tuple(versoes) and entrada[2] >= ultimo_id:
+                return frame
+            return self._delta(key, tabela, coluna_id, versoes, alteracoes, carregar, entrada)
+        if not frame.empty:
+            ultimo_id = max(ultimo_id, int(frame[coluna_id].max()))
+        with self._lock:
+            self._cargas += 1
+            self._guardar(key, (frame, versoes, ultimo_id))
+        return frame
+
+    def _guardar(self, key, entrada):
+        self._entries[key] = entrada
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(_approx_size(frame) for frame, _, _ in self._entries.values()),
+                'hits': self._hits,
+                'deltas': self._deltas,
+                'cargas': self._cargas,
+                'linhas_delta': self._linhas_delta,
+            }
+
+@st.cache_resource
+def get_delta_store(db_file=DB_FILE):
+    return DeltaFrameStore()
+
+def delta_query(tabela, coluna_id, *dependencias, alteracoes=False):
+    # A função decorada recebe ids=None (tudo) ou a lista de ids a reler;
+    # alteracoes=True quando a tabela tem versao_alteracao (linhas alteradas)
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            frame = get_delta_store(current_db_file()).get(key, tabela, coluna_id, dependencias, alteracoes,
+                                                           lambda ids: fn(*args, ids=ids, **kwargs))
+            return contar_memoria(frame)
+        return wrapper
+    return decorator
+
+# --- Migrações de esquema (PRAGMA user_version) ---
+# Cada migração é aplicada uma única vez por banco, em ordem, e é idempotente:
+# bases criadas antes do controle de versão (user_version = 0) passam por
+# todas sem perder dados. Novas alterações de esquema entram no fim da lista.
+def _migrate_initial_schema(conn):
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS versoes_dados (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.executemany("INSERT OR IGNORE INTO versoes_dados (tabela, versao) VALUES (?, 0)", [(t,) for t in TABELAS_VERSIONADAS])
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS produtos (
+            codigo_produto TEXT PRIMARY KEY,
+            descricao_produto TEXT,
+            secao_produto TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS recebimentos (
+            id_recebimento INTEGER PRIMARY KEY,
+            codigo_produto TEXT,
+            quantidade_recebida REAL,
+            condicao_produto TEXT,
+            data_recebimento TEXT,
+            dia_semana TEXT,
+            hora_recebimento TEXT,
+            foto_evidencia TEXT,
+            conferente TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS auditorias (
+            id_auditoria INTEGER PRIMARY KEY,
+            codigo_produto TEXT,
+            quantidade_sistema REAL,
+            quantidade_divergente REAL,
+            data_auditoria TEXT,
+            auditor TEXT,
+            status_divergencia TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id_usuario TEXT PRIMARY KEY,
+            nome_usuario TEXT,
+            tipo_acesso TEXT,
+            senha TEXT
+        )
+    """)
+
+    # Inserir usuários padrão se a tabela estiver vazia. Só no banco principal:
+    # os das lojas não guardam usuários (o login lê sempre o principal)
+    c.execute("SELECT COUNT(*) FROM usuarios")
+    if c.fetchone()[0] == 0 and os.path.abspath(_banco_da_conexao(conn)) == os.path.abspath(DB_FILE):
+        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('admin', 'Gestor Admin', 'Gestor', 'admin'))
+        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('conf1', 'Conferente 1', 'Conferente', '123'))
+        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('prev1', 'Prevenção 1', 'Prevenção', '123'))
+
+def _migrate_catalogo(conn):
+    _ensure_produtos_primary_key(conn)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS importacoes_catalogo (
+            hash TEXT PRIMARY KEY,
+            arquivo TEXT,
+            importado_em TEXT,
+            linhas INTEGER,
+            inseridos INTEGER,
+            atualizados INTEGER,
+            inalterados INTEGER,
+            segundos REAL
+        )
+    """)
+
+def _migrate_iso_timestamps(conn):
+    # Datas em formato ISO ('YYYY-MM-DD HH:MM'), ordenáveis e indexáveis.
+    # As colunas dd/mm/YYYY continuam sendo gravadas para exibição.
+    _add_column_if_missing(conn, 'recebimentos', 'ts_recebimento', 'TEXT')
+    _add_column_if_missing(conn, 'auditorias', 'ts_auditoria', 'TEXT')
+    conn.execute(f"""
+        UPDATE recebimentos SET ts_recebimento = {_SQL_ISO_FROM_BR.format(col='data_recebimento')}
+        WHERE ts_recebimento IS NULL AND data_recebimento LIKE '__/__/____ __:__'
+    """)
+    conn.execute(f"""
+        UPDATE auditorias SET ts_auditoria = {_SQL_ISO_FROM_BR.format(col='data_auditoria')}
+        WHERE ts_auditoria IS NULL AND data_auditoria LIKE '__/__/____ __:__'
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recebimentos_ts ON recebimentos (ts_recebimento)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recebimentos_conferente_ts ON recebimentos (conferente, ts_recebimento)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_recebimentos_codigo ON recebimentos (codigo_produto)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_auditorias_ts ON auditorias (ts_auditoria)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_auditorias_status_ts ON auditorias (status_divergencia, ts_auditoria)")
+
+def _migrate_fotos(conn):
+    # Fotos de evidência: bytes crus, uma única vez por conteúdo (hash SHA-256).
+    # O recebimento guarda apenas a referência em foto_hash.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS fotos (
+            hash TEXT PRIMARY KEY,
+            conteudo BLOB NOT NULL,
+            mime TEXT,
+            tamanho INTEGER,
+            miniatura BLOB,
+            processada INTEGER NOT NULL DEFAULT 0,
+            criado_em TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fotos_pendentes ON fotos (hash) WHERE processada = 0")
+    _add_column_if_missing(conn, 'recebimentos', 'foto_hash', 'TEXT')
+    _migrate_fotos_base64(conn)
+
+def _migrate_recebimentos_totais(conn):
+    # Totais recebidos por produto, mantidos por triggers a cada gravação
+    # (inclusive lotes), para a auditoria não precisar de GROUP BY.
+    totais_existia = _table_exists(conn, 'recebimentos_totais')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recebimentos_totais (
+            codigo_produto TEXT PRIMARY KEY,
+            quantidade_total_recebida REAL NOT NULL DEFAULT 0,
+            qtd_recebimentos INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_recebimentos_totais_insert
+        AFTER INSERT ON recebimentos
+        BEGIN
+            INSERT INTO recebimentos_totais (codigo_produto, quantidade_total_recebida, qtd_recebimentos)
+            VALUES (new.codigo_produto, COALESCE(new.quantidade_recebida, 0), 1)
+            ON CONFLICT (codigo_produto) DO UPDATE SET
+                quantidade_total_recebida = quantidade_total_recebida + excluded.quantidade_total_recebida,
+                qtd_recebimentos = qtd_recebimentos + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_recebimentos_totais_update
+        AFTER UPDATE OF codigo_produto, quantidade_recebida ON recebimentos
+        BEGIN
+            UPDATE recebimentos_totais
+            SET quantidade_total_recebida = quantidade_total_recebida - COALESCE(old.quantidade_recebida, 0),
+                qtd_recebimentos = qtd_recebimentos - 1
+            WHERE codigo_produto = old.codigo_produto;
+            INSERT INTO recebimentos_totais (codigo_produto, quantidade_total_recebida, qtd_recebimentos)
+            VALUES (new.codigo_produto, COALESCE(new.quantidade_recebida, 0), 1)
+            ON CONFLICT (codigo_produto) DO UPDATE SET
+                quantidade_total_recebida = quantidade_total_recebida + excluded.quantidade_total_recebida,
+                qtd_recebimentos = qtd_recebimentos + 1;
+        END
+    """)
+    if not totais_existia:
+        rebuild_recebimentos_totais(conn)
+
+def _migrate_auditorias_codigo(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_auditorias_codigo ON auditorias (codigo_produto)")
+
+def _migrate_recebimentos_diarios(conn):
+    # Resumo por dia × conferente × seção, mantido por triggers como os totais,
+    # para os painéis de Relatórios não varrerem recebimentos. A seção é a do
+    # produto no momento da gravação; rebuild_recebimentos_diarios recalcula.
+    diarios_existia = _table_exists(conn, 'recebimentos_diarios')
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS recebimentos_diarios (
+            dia TEXT NOT NULL,
+            conferente TEXT NOT NULL,
+            secao_produto TEXT NOT NULL,
+            qtd_recebimentos INTEGER NOT NULL DEFAULT 0,
+            quantidade_total REAL NOT NULL DEFAULT 0,
+            qtd_ruim INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, conferente, secao_produto)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_recebimentos_diarios_insert
+        AFTER INSERT ON recebimentos
+        WHEN new.ts_recebimento IS NOT NULL
+        BEGIN
+            {_SQL_DIARIO_SOMA.format(r='new')};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_recebimentos_diarios_update
+        AFTER UPDATE OF codigo_produto, quantidade_recebida, condicao_produto, conferente, ts_recebimento ON recebimentos
+        BEGIN
+            UPDATE recebimentos_diarios
+            SET qtd_recebimentos = qtd_recebimentos - 1,
+                quantidade_total = quantidade_total - COALESCE(old.quantidade_recebida, 0),
+                qtd_ruim = qtd_ruim - COALESCE(old.condicao_produto = 'Ruim', 0)
+            WHERE dia = substr(old.ts_recebimento, 1, 10)
+              AND conferente = COALESCE(old.conferente, '')
+              AND secao_produto = COALESCE((SELECT secao_produto FROM produtos WHERE codigo_produto = old.codigo_produto), '');
+            {_SQL_DIARIO_SOMA.format(r='new')};
+        END
+    """)
+    if not diarios_existia:
+        rebuild_recebimentos_diarios(conn)
+
+def _migrate_arquivo(conn):
+    # Registro das bases mensais do arquivo histórico e códigos cujas
+    # auditorias foram arquivadas (continuam contando como auditados)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS arquivos_mensais (
+            mes TEXT PRIMARY KEY,
+            arquivo TEXT NOT NULL,
+            recebimentos INTEGER NOT NULL DEFAULT 0,
+            auditorias INTEGER NOT NULL DEFAULT 0,
+            arquivado_em TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS auditorias_arquivadas (
+            codigo_produto TEXT PRIMARY KEY
+        ) WITHOUT ROWID
+    """)
+
+def _migrate_produtos_busca(conn):
+    # Índice FTS5 de conteúdo externo sobre produtos (descrição e seção): sem
+    # acentos, com índices de prefixo de 2 e 3 letras para a busca enquanto se digita.
+    # Os triggers mantêm o índice em dia na importação e no cadastro manual.
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS produtos_busca USING fts5(
+            descricao_produto, secao_produto,
+            content='produtos', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    # A descrição pesa mais que a seção no ranking (bm25)
+    conn.execute("INSERT INTO produtos_busca (produtos_busca, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_insert AFTER INSERT ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (rowid, descricao_produto, secao_produto)
+            VALUES (new.rowid, new.descricao_produto, new.secao_produto);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_delete AFTER DELETE ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (produtos_busca, rowid, descricao_produto, secao_produto)
+            VALUES ('delete', old.rowid, old.descricao_produto, old.secao_produto);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_produtos_busca_update AFTER UPDATE OF descricao_produto, secao_produto ON produtos
+        BEGIN
+            INSERT INTO produtos_busca (produtos_busca, rowid, descricao_produto, secao_produto)
+            VALUES ('delete', old.rowid, old.descricao_produto, old.secao_produto);
+            INSERT INTO produtos_busca (rowid, descricao_produto, secao_produto)
+            VALUES (new.rowid, new.descricao_produto, new.secao_produto);
+        END
+    """)
+    rebuild_produtos_busca(conn)
+
+def _migrate_auditorias_versao_alteracao(conn):
+    # Versão de auditorias em que a linha foi alterada pela última vez (mudança
+    # de status); a atualização incremental relê só as alteradas desde a sua versão
+    _add_column_if_missing(conn, 'auditorias', 'versao_alteracao', 'INTEGER')
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_auditorias_versao_alteracao ON auditorias (versao_alteracao)
+        WHERE versao_alteracao IS NOT NULL
+    """)
+
+def _migrate_lojas(conn):
+    # Cadastro de lojas e loja de cada usuário. Vale no banco principal; nos
+    # bancos das lojas as tabelas existem (mesmo esquema) mas ficam vazias.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS lojas (
+            id_loja TEXT PRIMARY KEY,
+            nome_loja TEXT NOT NULL,
+            arquivo TEXT NOT NULL UNIQUE
+        )
+    """)
+    _add_column_if_missing(conn, 'usuarios', 'id_loja', 'TEXT')
+    conn.execute("INSERT OR IGNORE INTO versoes_dados (tabela, versao) VALUES ('lojas', 0)")
+
+def _migrate_ids_autoincrement(conn):
+    # Sem AUTOINCREMENT o SQLite reaproveita ids quando o arquivamento esvazia a
+    # tabela (o próximo id seria 1 de novo), e o delta e a paginação por id, que
+    # contam com ids só crescentes, perdiam ou repetiam linhas. Reconstrói as
+    # duas tabelas com a mesma definição e a sequência parte do maior id já usado,
+    # inclusive nos meses arquivados.
+    for tabela, coluna_id in (('recebimentos', 'id_recebimento'), ('auditorias', 'id_auditoria')):
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)).fetchone()[0]
+        if 'AUTOINCREMENT' in sql.upper():
+            continue
+        dependentes = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+            (tabela,))]
+        # Depois de um RENAME o SQLite guarda o nome entre aspas
+        sql = re.sub(rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{tabela}\"?", f"CREATE TABLE {tabela}_novo", sql.strip(), flags=re.I)
+        sql = re.sub(rf"\b({coluna_id}\s+INTEGER\s+PRIMARY\s+KEY)\b", r"\1 AUTOINCREMENT", sql, count=1, flags=re.I)
+        conn.execute(sql)
+        conn.execute(f"INSERT INTO {tabela}_novo SELECT * FROM {tabela}")
+        conn.execute(f"DROP TABLE {tabela}")
+        conn.execute(f"ALTER TABLE {tabela}_novo RENAME TO {tabela}")
+        for sql in dependentes:
+            conn.execute(sql)
+
+        maior = conn.execute(f"SELECT COALESCE(MAX({coluna_id}), 0) FROM {tabela}").fetchone()[0]
+        for arquivo in _arquivos_do_periodo(conn):
+            arq = sqlite3.connect(_caminho_arquivo(conn, arquivo))
+            try:
+                if _table_exists(arq, tabela):
+                    maior = max(maior, arq.execute(f"SELECT COALESCE(MAX({coluna_id}), 0) FROM {tabela}").fetchone()[0])
+            finally:
+                arq.close()
+        if not conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (maior, tabela)).rowcount:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (tabela, maior))
+
+MIGRATIONS = [
+    (1, _migrate_initial_schema),
+    (2, _migrate_catalogo),
+    (3, _migrate_iso_timestamps),
+    (4, _migrate_fotos),
+    (5, _migrate_recebimentos_totais),
+    (6, _migrate_auditorias_codigo),
+    (7, _migrate_recebimentos_diarios),
+    (8, _migrate_arquivo),
+    (9, _migrate_produtos_busca),
+    (10, _migrate_auditorias_versao_alteracao),
+    (11, _migrate_lojas),
+    (12, _migrate_ids_autoincrement),
+]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn):
+    aplicadas = []
+    for versao, migracao in MIGRATIONS:
+        if get_schema_version(conn) >= versao:
+            continue
+        # BEGIN IMMEDIATE serializa processos que sobem ao mesmo tempo; quem
+        # esperou pelo lock confere de novo a versão antes de aplicar.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) < versao:
+                migracao(conn)
+                conn.execute(f"PRAGMA user_version = {versao}")
+                aplicadas.append(versao)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return aplicadas
+
+@st.cache_resource(show_spinner=False)
+def ensure_schema(db_file=DB_FILE):
+    # Roda uma vez por processo; as reexecuções do script não tocam no banco
+    with get_connection_pool(db_file).connection() as conn:
+        aplicadas = run_migrations(conn)
+        versao = get_schema_version(conn)
+    if aplicadas:
+        logging.info("Migrações aplicadas em %s: %s (versão %s)", db_file, aplicadas, versao)
+        # Colunas novas também entram nas bases mensais já arquivadas
+        with get_connection_pool(db_file).connection() as conn:
+            _sincronizar_esquema_arquivos(conn)
+
+    # Gera miniaturas das fotos que ainda não foram processadas (ex.: migradas agora)
+    for foto_hash in get_fotos_pendentes(db_file):
+        schedule_foto_processing(foto_hash, db_file)
+    return versao
+
+def init_db():
+    # Banco principal (lojas e usuários) e, depois do login, o banco da loja
+    ensure_schema(DB_FILE)
+    ensure_schema(current_db_file())
+
+# Converte 'dd/mm/YYYY HH:MM' em 'YYYY-MM-DD HH:MM' dentro do SQL (backfill)
+_SQL_ISO_FROM_BR = "substr({col}, 7, 4) || '-' || substr({col}, 4, 2) || '-' || substr({col}, 1, 2) || ' ' || substr({col}, 12, 5)"
+
+def _add_column_if_missing(conn, tabela, coluna, tipo):
+    colunas = [row[1] for row in conn.execute(f"PRAGMA table_info({tabela})")]
+    if coluna not in colunas:
+        conn.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+def _table_exists(conn, tabela):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)).fetchone() is not None
+
+def rebuild_recebimentos_totais(conn):
+    # Recalcula os totais do zero (manutenção); o dia a dia é incremental via triggers
+    conn.execute("DELETE FROM recebimentos_totais")
+    conn.execute("""
+        INSERT INTO recebimentos_totais (codigo_produto, quantidade_total_recebida, qtd_recebimentos)
+        SELECT codigo_produto, COALESCE(SUM(quantidade_recebida), 0), COUNT(*)
+        FROM recebimentos
+        GROUP BY codigo_produto
+    """)
+
+# Soma um recebimento ({r} = new/old) na linha do resumo diário
+_SQL_DIARIO_SOMA = """
+            INSERT INTO recebimentos_diarios (dia, conferente, secao_produto, qtd_recebimentos, quantidade_total, qtd_ruim)
+            SELECT substr({r}.ts_recebimento, 1, 10), COALESCE({r}.conferente, ''),
+                   COALESCE((SELECT secao_produto FROM produtos WHERE codigo_produto = {r}.codigo_produto), ''),
+                   1, COALESCE({r}.quantidade_recebida, 0), COALESCE({r}.condicao_produto = 'Ruim', 0)
+            WHERE {r}.ts_recebimento IS NOT NULL
+            ON CONFLICT (dia, conferente, secao_produto) DO UPDATE SET
+                qtd_recebimentos = qtd_recebimentos + 1,
+                quantidade_total = quantidade_total + excluded.quantidade_total,
+                qtd_ruim = qtd_ruim + excluded.qtd_ruim"""
+
+def rebuild_recebimentos_diarios(conn):
+    conn.execute("DELETE FROM recebimentos_diarios")
+    conn.execute("""
+        INSERT INTO recebimentos_diarios (dia, conferente, secao_produto, qtd_recebimentos, quantidade_total, qtd_ruim)
+        SELECT substr(r.ts_recebimento, 1, 10), COALESCE(r.conferente, ''), COALESCE(p.secao_produto, ''),
+               COUNT(*), COALESCE(SUM(r.quantidade_recebida), 0), COALESCE(SUM(r.condicao_produto = 'Ruim'), 0)
+        FROM recebimentos r
+        LEFT JOIN produtos p ON p.codigo_produto = r.codigo_produto
+        WHERE r.ts_recebimento IS NOT NULL
+        GROUP BY 1, 2, 3
+    """)
+
+def _ensure_produtos_primary_key(conn):
+    # Bases antigas substituíam produtos via to_sql(if_exists='replace'), que
+    # recria a tabela sem PRIMARY KEY; reconstrói com a chave e códigos em texto.
+    if any(row[5] for row in conn.execute("PRAGMA table_info(produtos)")):
+        return
+    conn.execute("""
+        CREATE TABLE produtos_novo (
+            codigo_produto TEXT PRIMARY KEY,
+            descricao_produto TEXT,
+            secao_produto TEXT
+        )
+    """)
+    conn.execute("""
+        INSERT OR REPLACE INTO produtos_novo (codigo_produto, descricao_produto, secao_produto)
+        SELECT CASE WHEN typeof(codigo_produto) = 'real' AND codigo_produto = CAST(codigo_produto AS INTEGER)
+                    THEN CAST(CAST(codigo_produto AS INTEGER) AS TEXT)
+                    ELSE TRIM(CAST(codigo_produto AS TEXT)) END,
+               descricao_produto, secao_produto
+        FROM produtos
+        WHERE codigo_produto IS NOT NULL
+        ORDER BY rowid
+    """)
+    conn.execute("DROP TABLE produtos")
+    conn.execute("ALTER TABLE produtos_novo RENAME TO produtos")
+    _bump_versao(conn, 'produtos')
+
+def _migrate_fotos_base64(conn, lote=100):
+    # Converte o legado em base64 (foto_evidencia) para a tabela fotos
+    import base64
+
+    while True:
+        rows = conn.execute("""
+            SELECT id_recebimento, foto_evidencia FROM recebimentos
+            WHERE foto_hash IS NULL AND foto_evidencia IS NOT NULL AND foto_evidencia != ''
+            LIMIT ?
+        """, (lote,)).fetchall()
+        if not rows:
+            return
+        _bump_versao(conn, 'recebimentos', 'fotos')
+        for id_recebimento, foto_b64 in rows:
+            foto_hash = _store_foto(conn, base64.b64decode(foto_b64))
+            conn.execute("UPDATE recebimentos SET foto_hash = ?, foto_evidencia = NULL WHERE id_recebimento = ?",
+                         (foto_hash, id_recebimento))
+
+def _iso_from_br(data_br):
+    return datetime.datetime.strptime(data_br, '%d/%m/%Y %H:%M').strftime('%Y-%m-%d %H:%M')
+
+def _date_range_clauses(coluna, start_date, end_date):
+    # Intervalo fechado em dias: [start 00:00, end + 1 dia 00:00)
+    clauses, params = [], []
+    if start_date:
+        clauses.append(f"{coluna} >= ?")
+        params.append(start_date.isoformat())
+    if end_date:
+        clauses.append(f"{coluna} < ?")
+        params.append((end_date + datetime.timedelta(days=1)).isoformat())
+    return clauses, params
+
+def _where(clauses):
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+# --- Arquivo histórico (bases mensais) ---
+# Meses fechados saem da base ativa para um SQLite por mês, em
+# <base>_arquivo/AAAA-MM.db, anexado (ATTACH) só pelas consultas cujo período
+# chega até ele. Fechado = anterior aos ARQUIVO_MESES_QUENTES meses mais
+# recentes e à divergência pendente mais antiga. Arquiva-se sempre um prefixo
+# contínuo da história: tudo o que está nos arquivos é mais antigo que a base
+# ativa, e as consultas juntam as partes já na ordem por data.
+# Totais e resumo diário não têm trigger de DELETE e seguem cobrindo os meses
+# arquivados; as fotos ficam na base ativa (os recebimentos guardam o hash).
+ARQUIVO_MESES_QUENTES = int(os.environ.get('RECEBIMENTO_ARQUIVO_MESES_QUENTES', '3'))
+ARQUIVO_TABELAS = {'recebimentos': 'ts_recebimento', 'auditorias': 'ts_auditoria'}
+ARQUIVO_CHUNK_SIZE = 5000
+
+def _mes_deslocado(mes, meses):
+    ano, numero = divmod(int(mes[:4]) * 12 + int(mes[5:7]) - 1 + meses, 12)
+    return f"{ano:04d}-{numero + 1:02d}"
+
+def _limite_arquivo(meses_quentes=ARQUIVO_MESES_QUENTES):
+    # Primeiro mês que fica na base ativa ('AAAA-MM' compara com os timestamps ISO)
+    return _mes_deslocado(datetime.datetime.now(brasilia_tz).strftime('%Y-%m'), -meses_quentes)
+
+def _banco_da_conexao(conn):
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main')
+
+def _pasta_arquivo(conn):
+    return os.path.splitext(_banco_da_conexao(conn))[0] + '_arquivo'
+
+def _caminho_arquivo(conn, arquivo):
+    caminho = os.path.join(_pasta_arquivo(conn), arquivo)
+    if not os.path.exists(caminho):
+        # O ATTACH criaria um banco vazio e o mês sumiria dos relatórios sem aviso
+        raise FileNotFoundError(f"Base do arquivo histórico não encontrada: {caminho}")
+    return caminho
+
+@contextmanager
+def _arquivo_anexado(conn, arquivo):
+    # Fora de transação (o SQLite não anexa dentro de uma); visível como schema "arquivo"
+    conn.execute("ATTACH DATABASE ? AS arquivo", (_caminho_arquivo(conn, arquivo),))
+    try:
+        yield conn
+    finally:
+        conn.execute("DETACH DATABASE arquivo")
+
+def _arquivos_do_periodo(conn, start_date=None, end_date=None):
+    # Bases mensais que cruzam o período, da mais antiga para a mais recente
+    clauses, params = [], []
+    if start_date:
+        clauses.append("mes >= ?")
+        params.append(start_date.strftime('%Y-%m'))
+    if end_date:
+        clauses.append("mes <= ?")
+        params.append(end_date.strftime('%Y-%m'))
+    return [row[0] for row in conn.execute(f"SELECT arquivo FROM arquivos_mensais {_where(clauses)} ORDER BY mes", params)]
+
+def _concat_partes(partes):
+    preenchidas = [parte for parte in partes if not parte.empty]
+    if len(preenchidas) <= 1:
+        return preenchidas[0] if preenchidas else partes[-1]
+    return concat_frames(preenchidas)
+
+def _read_sql_com_arquivos(montar_query, params, start_date=None, end_date=None, ids=None, tabelas=()):
+    # montar_query(schema) devolve o SQL para 'arquivo' ou 'main'; arquivos primeiro, base ativa por último.
+    # Cada parte já é convertida ao ser lida: o texto em objetos nunca existe da base inteira.
+    with get_db_connection() as conn:
+        if ids is not None:
+            # Delta: linhas novas ou alteradas estão sempre na base ativa
+            return read_sql_tipado(montar_query('main'), conn, params, tabelas)
+        while True:
+            arquivos = _arquivos_do_periodo(conn, start_date, end_date)
+            partes = []
+            for arquivo in arquivos:
+                with _arquivo_anexado(conn, arquivo):
+                    partes.append(read_sql_tipado(montar_query('arquivo'), conn, params, tabelas))
+            partes.append(read_sql_tipado(montar_query('main'), conn, params, tabelas))
+            # Um mês arquivado no meio da leitura sairia das duas partes: lê de novo
+            if _arquivos_do_periodo(conn, start_date, end_date) == arquivos:
+                return _concat_partes(partes)
+
+def _iter_chunks_com_arquivos(conn, montar_query, params, arquivos, chunk_size):
+    for arquivo in arquivos:
+        with _arquivo_anexado(conn, arquivo):
+            cursor = conn.execute(montar_query('arquivo'), params)
+            try:
+                yield from _iter_cursor_chunks(cursor, chunk_size)
+            finally:
+                # O DETACH falha com um comando ainda aberto sobre o arquivo
+                cursor.close()
+    yield from _iter_cursor_chunks(conn.execute(montar_query('main'), params), chunk_size)
+
+def _preparar_tabela_arquivo(conn, arq, tabela, coluna_ts):
+    # Mesmas colunas da base ativa, inclusive as criadas por migrações posteriores
+    info = conn.execute(f"PRAGMA table_info({tabela})").fetchall()
+    definicoes = [f"{row[1]} {row[2]}{' PRIMARY KEY' if row[5] else ''}" for row in info]
+    arq.execute(f"CREATE TABLE IF NOT EXISTS {tabela} ({', '.join(definicoes)})")
+    for row in info:
+        _add_column_if_missing(arq, tabela, row[1], row[2])
+    arq.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_ts ON {tabela} ({coluna_ts})")
+    arq.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabela}_codigo ON {tabela} (codigo_produto)")
+    return [row[1] for row in info]
+
+def _sincronizar_esquema_arquivos(conn):
+    for arquivo in _arquivos_do_periodo(conn):
+        arq = sqlite3.connect(_caminho_arquivo(conn, arquivo))
+        try:
+            for tabela, coluna_ts in ARQUIVO_TABELAS.items():
+                _preparar_tabela_arquivo(conn, arq, tabela, coluna_ts)
+            arq.commit()
+        finally:
+            arq.close()
+
+def _meses_com_dados(conn, limite):
+    # Um salto pelo índice de data por mês, sem varrer as linhas
+    meses = set()
+    for tabela, coluna_ts in ARQUIVO_TABELAS.items():
+        inicio = ''
+        while True:
+            ts = conn.execute(f"SELECT MIN({coluna_ts}) FROM {tabela} WHERE {coluna_ts} >= ? AND {coluna_ts} < ?",
+                              (inicio, limite)).fetchone()[0]
+            if ts is None:
+                break
+            meses.add(ts[:7])
+            inicio = _mes_deslocado(ts[:7], 1)
+    return sorted(meses)
+
+def _pendencia_mais_antiga(conn):
+    placeholders = ', '.join('?' for _ in STATUS_PENDENTES)
+    return conn.execute(f"""
+        SELECT id_auditoria, ts_auditoria FROM auditorias
+        WHERE status_divergencia IN ({placeholders}) AND ts_auditoria IS NOT NULL
+        ORDER BY ts_auditoria LIMIT 1
+    """, STATUS_PENDENTES).fetchone()
+
+@cached_query('recebimentos', 'auditorias')
+def get_arquivo_status(limite):
+    with get_db_connection() as conn:
+        arquivados = pd.read_sql_query(
+            "SELECT mes, arquivo, recebimentos, auditorias, arquivado_em FROM arquivos_mensais ORDER BY mes", conn)
+        pendencia = _pendencia_mais_antiga(conn)
+        if pendencia is not None and pendencia[1][:7] < limite:
+            limite = pendencia[1][:7]
+        else:
+            pendencia = None
+        return {'arquivados': arquivados, 'arquivaveis': _meses_com_dados(conn, limite), 'bloqueio': pendencia}
+
+def arquivar_meses(meses, compactar=False):
+    # Um mês por transação: a escrita na base ativa só espera a cópia de um mês
+    movidos = {mes: submit_write(_arquivar_mes, mes) for mes in sorted(meses)}
+    if compactar and movidos:
+        # VACUUM não roda dentro de transação nem pela fila de gravação
+        with get_db_connection() as conn:
+            conn.execute("VACUUM")
+            # O VACUUM pode renumerar o rowid de produtos, ao qual o índice de busca aponta
+            rebuild_produtos_busca(conn)
+    return movidos
+
+def _arquivar_mes(conn, mes):
+    # A versão é gravada primeiro: a base ativa fica travada para escrita até o commit
+    _bump_versao(conn, 'recebimentos', 'auditorias')
+    fim = _mes_deslocado(mes, 1)
+    pendencia = _pendencia_mais_antiga(conn)
+    if fim > _limite_arquivo() or (pendencia is not None and pendencia[1] < fim):
+        raise ValueError(f"O mês {mes[5:]}/{mes[:4]} ainda não está fechado.")
+    if _meses_com_dados(conn, mes):
+        raise ValueError(f"Arquive antes os meses anteriores a {mes[5:]}/{mes[:4]}.")
+
+    pasta = _pasta_arquivo(conn)
+    os.makedirs(pasta, exist_ok=True)
+    arquivo = f"{mes}.db"
+    arq = sqlite3.connect(os.path.join(pasta, arquivo))
+    try:
+        totais = []
+        for tabela, coluna_ts in ARQUIVO_TABELAS.items():
+            colunas = _preparar_tabela_arquivo(conn, arq, tabela, coluna_ts)
+            insert = f"INSERT OR REPLACE INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})"
+            cursor = conn.execute(f"SELECT {', '.join(colunas)} FROM {tabela} WHERE {coluna_ts} >= ? AND {coluna_ts} < ?",
+                                  (mes, fim))
+            for rows in _iter_cursor_chunks(cursor, ARQUIVO_CHUNK_SIZE):
+                arq.executemany(insert, rows)
+            totais.append(arq.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0])
+        # O arquivo é gravado antes: se algo falhar daqui em diante, os dados
+        # continuam na base ativa e o arquivo, sem registro, é ignorado
+        arq.commit()
+    finally:
+        arq.close()
+
+    conn.execute("""
+        INSERT OR IGNORE INTO auditorias_arquivadas (codigo_produto)
+        SELECT codigo_produto FROM auditorias
+        WHERE ts_auditoria >= ? AND ts_auditoria < ? AND codigo_produto IS NOT NULL
+    """, (mes, fim))
+    movidos = {}
+    for tabela, coluna_ts in ARQUIVO_TABELAS.items():
+        movidos[tabela] = conn.execute(f"DELETE FROM {tabela} WHERE {coluna_ts} >= ? AND {coluna_ts} < ?", (mes, fim)).rowcount
+    conn.execute("""
+        INSERT INTO arquivos_mensais (mes, arquivo, recebimentos, auditorias, arquivado_em)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (mes) DO UPDATE SET
+            recebimentos = excluded.recebimentos,
+            auditorias = excluded.auditorias,
+            arquivado_em = excluded.arquivado_em
+    """, (mes, arquivo, *totais, datetime.datetime.now(brasilia_tz).strftime('%d/%m/%Y %H:%M')))
+    return movidos
+
+def _somar_arquivos_nos_resumos(conn):
+    # Recontagem dos totais e do resumo diário: soma também os meses arquivados
+    for arquivo in _arquivos_do_periodo(conn):
+        arq = sqlite3.connect(_caminho_arquivo(conn, arquivo))
+        try:
+            totais = arq.execute("""
+                SELECT codigo_produto, COALESCE(SUM(quantidade_recebida), 0), COUNT(*)
+                FROM recebimentos GROUP BY codigo_produto
+            """).fetchall()
+            diarios = arq.execute("""
+                SELECT substr(ts_recebimento, 1, 10), COALESCE(conferente, ''), codigo_produto, COUNT(*),
+                       COALESCE(SUM(quantidade_recebida), 0), COALESCE(SUM(condicao_produto = 'Ruim'), 0)
+                FROM recebimentos WHERE ts_recebimento IS NOT NULL
+                GROUP BY 1, 2, 3
+            """).fetchall()
+        finally:
+            arq.close()
+        conn.executemany("""
+            INSERT INTO recebimentos_totais (codigo_produto, quantidade_total_recebida, qtd_recebimentos)
+            VALUES (?, ?, ?)
+            ON CONFLICT (codigo_produto) DO UPDATE SET
+                quantidade_total_recebida = quantidade_total_recebida + excluded.quantidade_total_recebida,
+                qtd_recebimentos = qtd_recebimentos + excluded.qtd_recebimentos
+        """, totais)
+        conn.executemany("""
+            INSERT INTO recebimentos_diarios (dia, conferente, secao_produto, qtd_recebimentos, quantidade_total, qtd_ruim)
+            SELECT ?, ?, COALESCE((SELECT secao_produto FROM produtos WHERE codigo_produto = ?), ''), ?, ?, ?
+            WHERE 1
+            ON CONFLICT (dia, conferente, secao_produto) DO UPDATE SET
+                qtd_recebimentos = qtd_recebimentos + excluded.qtd_recebimentos,
+                quantidade_total = quantidade_total + excluded.quantidade_total,
+                qtd_ruim = qtd_ruim + excluded.qtd_ruim
+        """, diarios)
+
+# --- Funções de Lógica ---
+STATUS_DIVERGENCIA = ["Aberta", "Em tratamento", "Solucionada"]
+STATUS_PENDENTES = [s for s in STATUS_DIVERGENCIA if s != "Solucionada"]
+
+RECEBIMENTOS_COLUNAS = ['id_recebimento', 'codigo_produto', 'quantidade_recebida', 'condicao_produto',
+                        'data_recebimento', 'dia_semana', 'hora_recebimento', 'foto_hash', 'conferente']
+AUDITORIAS_COLUNAS = ['id_auditoria', 'codigo_produto', 'quantidade_sistema', 'quantidade_divergente',
+                      'data_auditoria', 'auditor', 'status_divergencia']
+
+# --- Índice de produtos em memória ---
+# Carregado uma vez por processo: busca exata por dicionário e busca por
+# prefixo (autocomplete de código) por bisect numa lista ordenada.
+class ProductIndex:
+    def __init__(self, rows, versao=None):
+        self.versao = versao
+        self.verificado_em = time.monotonic()
+        self._lock = threading.Lock()
+        self._by_codigo = {}
+        for codigo, descricao, secao in rows:
+            self._by_codigo[codigo] = {'codigo_produto': codigo, 'descricao_produto': descricao, 'secao_produto': secao}
+        self._codigos = sorted(self._by_codigo)
+
+    def __len__(self):
+        return len(self._by_codigo)
+
+    def get(self, codigo):
+        return self._by_codigo.get(codigo)
+
+    def add(self, codigo, descricao, secao, versao_anterior, versao):
+        # Aplica uma inserção local sem recarregar tudo, se o índice estiver em dia
+        with self._lock:
+            if self.versao != versao_anterior:
+                return False
+            if codigo not in self._by_codigo:
+                bisect.insort(self._codigos, codigo)
+            self._by_codigo[codigo] = {'codigo_produto': codigo, 'descricao_produto': descricao, 'secao_produto': secao}
+            self.versao = versao
+            return True
+
+    def search_prefix(self, prefixo, limit=10):
+        inicio = bisect.bisect_left(self._codigos, prefixo)
+        resultados = []
+        for codigo in self._codigos[inicio:inicio + limit]:
+            if not codigo.startswith(prefixo):
+                break
+            resultados.append(self._by_codigo[codigo])
+        return resultados
+
+@st.cache_resource(show_spinner=False)
+def _load_product_index(db_file=DB_FILE):
+    with get_connection_pool(db_file).connection() as conn:
+        versao = get_data_versions(('produtos',), conn)[0]
+        rows = conn.execute("SELECT codigo_produto, descricao_produto, secao_produto FROM produtos").fetchall()
+    return ProductIndex(rows, versao)
+
+# A consulta da versão custa uma ida ao SQLite (e pode esperar por lock): as
+# leituras do índice só a repetem depois deste intervalo. Gravações de produtos
+# feitas neste processo atualizam o índice na hora; as de outros processos
+# aparecem em até PRODUTOS_VERIFICACAO_S segundos.
+PRODUTOS_VERIFICACAO_S = float(os.environ.get('RECEBIMENTO_PRODUTOS_VERIFICACAO_S', '2'))
+
+def get_product_index():
+    db_file = current_db_file()
+    index = _load_product_index(db_file)
+    agora = time.monotonic()
+    if agora - index.verificado_em < PRODUTOS_VERIFICACAO_S:
+        return index
+    # Marcado antes da consulta: as leituras simultâneas não repetem a verificação
+    index.verificado_em = agora
+    if index.versao != get_data_version('produtos'):
+        # Só o índice desta loja; os das outras continuam carregados
+        _load_product_index.clear(db_file)
+        index = _load_product_index(db_file)
+    return index
+
+def get_product_info(codigo):
+    return get_product_index().get(codigo)
+
+def search_products_by_prefix(prefixo, limit=10):
+    return get_product_index().search_prefix(prefixo, limit)
+
+def save_produto(codigo, descricao, secao):
+    with get_db_connection() as conn:
+        conn.execute("INSERT INTO produtos (codigo_produto, descricao_produto, secao_produto) VALUES (?, ?, ?)",
+                     (codigo, descricao, secao))
+        _bump_versao(conn, 'produtos')
+        versao = get_data_versions(('produtos',), conn)[0]
+    if not _load_product_index(current_db_file()).add(codigo, descricao, secao, versao - 1, versao):
+        # Índice atrasado (outra gravação no meio): recarrega na próxima leitura
+        _load_product_index.clear(current_db_file())
+
+# --- Busca de produtos por texto (FTS5) ---
+# Para quando o código de barras falta ou não lê: busca por palavras da
+# descrição/seção, sem acentos, cada palavra como prefixo, ordenada por bm25.
+BUSCA_PRODUTOS_LIMIT = 10
+
+def rebuild_produtos_busca(conn):
+    conn.execute("INSERT INTO produtos_busca (produtos_busca) VALUES ('rebuild')")
+
+def _busca_fts(texto):
+    # Cada palavra (2+ letras, as de 1 não têm índice de prefixo) vira um prefixo
+    # entre aspas: o que o usuário digita nunca é interpretado como sintaxe FTS5
+    return ' '.join('"' + termo + '"*' for termo in re.findall(r'\w+', texto) if len(termo) >= 2)
+
+def search_products(texto, limit=BUSCA_PRODUTOS_LIMIT):
+    consulta = _busca_fts(texto)
+    if not consulta:
+        return []
+    with get_db_connection() as conn:
+        rows = conn.execute("""
+            SELECT p.codigo_produto, p.descricao_produto, p.secao_produto
+            FROM (
+                -- ORDER BY rank LIMIT dentro do FTS5: ordena todos os que casam
+                -- e só então corta, mantendo apenas os n melhores em memória
+                SELECT rowid, rank FROM produtos_busca
+                WHERE produtos_busca MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            ) b
+            JOIN produtos p ON p.rowid = b.rowid
+            ORDER BY b.rank
+        """, (consulta, limit)).fetchall()
+    return [{'codigo_produto': codigo, 'descricao_produto': descricao, 'secao_produto': secao}
+            for codigo, descricao, secao in rows]
+
+# --- Importação da base de produtos ---
+# Linhas são lidas em streaming e gravadas em lotes numa tabela temporária;
+# o upsert final preserva o schema e a PRIMARY KEY de produtos.
+CATALOGO_CHUNK_SIZE = 5000
+CATALOGO_COLUNAS = {
+    'codigo': 'codigo_produto',
+    'codigo_produto': 'codigo_produto',
+    'descricao': 'descricao_produto',
+    'descricao_produto': 'descricao_produto',
+    'secao': 'secao_produto',
+    'secao_produto': 'secao_produto',
+}
+
+def _normalize_header(valor):
+    texto = unicodedata.normalize('NFKD', str(valor or '')).encode('ascii', 'ignore').decode()
+    return texto.strip().lower().replace(' ', '_')
+
+def _normalize_codigo(valor):
+    if valor is None:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor).strip()
+    return texto or None
+
+def _normalize_texto(valor):
+    if valor is None:
+        return None
+    texto = str(valor).strip()
+    return texto or None
+
+def _iter_planilha(nome_arquivo, conteudo):
+    # Gera as linhas da planilha (cabeçalho primeiro) sem carregar tudo em memória
+    if nome_arquivo.lower().endswith('.csv'):
+        texto = io.TextIOWrapper(io.BytesIO(conteudo), encoding='utf-8-sig', newline='')
+        amostra = texto.read(4096)
+        texto.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=';,\t')
+        except csv.Error:
+            dialeto = csv.excel
+        yield from csv.reader(texto, dialeto)
+    else:
+        import openpyxl
+        workbook = openpyxl.load_workbook(io.BytesIO(conteudo), read_only=True, data_only=True)
+        try:
+            yield from workbook.active.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+
+def _iter_catalogo_chunks(nome_arquivo, conteudo, chunk_size=CATALOGO_CHUNK_SIZE):
+    linhas = _iter_planilha(nome_arquivo, conteudo)
+    cabecalho = [CATALOGO_COLUNAS.get(_normalize_header(c)) for c in next(linhas, [])]
+    if 'codigo_produto' not in cabecalho:
+        raise ValueError("A planilha precisa de uma coluna 'codigo' (ou 'codigo_produto').")
+    posicoes = {coluna: cabecalho.index(coluna) for coluna in set(cabecalho) if coluna}
+    get = lambda linha, coluna: linha[posicoes[coluna]] if coluna in posicoes and posicoes[coluna] < len(linha) else None
+
+    chunk = []
+    for linha in linhas:
+        codigo = _normalize_codigo(get(linha, 'codigo_produto'))
+        if codigo is None:
+            continue
+        chunk.append((codigo, _normalize_texto(get(linha, 'descricao_produto')), _normalize_texto(get(linha, 'secao_produto'))))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def get_importacao_catalogo(arquivo_hash):
+    with get_db_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT * FROM importacoes_catalogo WHERE hash = ?", (arquivo_hash,)).fetchone()
+        finally:
+            conn.row_factory = None
+    return dict(row) if row else None
+
+def import_catalogo(nome_arquivo, conteudo):
+    # Retorna o resumo da importação; arquivos já importados (mesmo hash) são ignorados
+    arquivo_hash = hashlib.sha256(conteudo).hexdigest()
+    anterior = get_importacao_catalogo(arquivo_hash)
+    if anterior is not None:
+        return dict(anterior, ja_importado=True)
+
+    inicio = time.perf_counter()
+    with get_db_connection() as conn:
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS produtos_staging (
+                codigo_produto TEXT PRIMARY KEY,
+                descricao_produto TEXT,
+                secao_produto TEXT
+            )
+        """)
+        conn.execute("DELETE FROM produtos_staging")
+        for chunk in _iter_catalogo_chunks(nome_arquivo, conteudo):
+            conn.executemany("INSERT OR REPLACE INTO produtos_staging VALUES (?, ?, ?)", chunk)
+
+        linhas = conn.execute("SELECT COUNT(*) FROM produtos_staging").fetchone()[0]
+        inseridos = conn.execute("""
+            SELECT COUNT(*) FROM produtos_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM produtos p WHERE p.codigo_produto = s.codigo_produto)
+        """).fetchone()[0]
+        atualizados = conn.execute("""
+            SELECT COUNT(*) FROM produtos_staging s
+            JOIN produtos p ON p.codigo_produto = s.codigo_produto
+            WHERE p.descricao_produto IS NOT s.descricao_produto OR p.secao_produto IS NOT s.secao_produto
+        """).fetchone()[0]
+        conn.execute("""
+            INSERT INTO produtos (codigo_produto, descricao_produto, secao_produto)
+            SELECT codigo_produto, descricao_produto, secao_produto FROM produtos_staging WHERE true
+            ON CONFLICT (codigo_produto) DO UPDATE SET
+                descricao_produto = excluded.descricao_produto,
+                secao_produto = excluded.secao_produto
+            WHERE produtos.descricao_produto IS NOT excluded.descricao_produto
+               OR produtos.secao_produto IS NOT excluded.secao_produto
+        """)
+        conn.execute("DELETE FROM produtos_staging")
+        _bump_versao(conn, 'produtos')
+
+        resultado = {
+            'hash': arquivo_hash,
+            'arquivo': nome_arquivo,
+            'importado_em': datetime.datetime.now(brasilia_tz).strftime('%d/%m/%Y %H:%M'),
+            'linhas': linhas,
+            'inseridos': inseridos,
+            'atualizados': atualizados,
+            'inalterados': linhas - inseridos - atualizados,
+            'segundos': round(time.perf_counter() - inicio, 3),
+        }
+        conn.execute("""
+            INSERT INTO importacoes_catalogo (hash, arquivo, importado_em, linhas, inseridos, atualizados, inalterados, segundos)
+            VALUES (:hash, :arquivo, :importado_em, :linhas, :inseridos, :atualizados, :inalterados, :segundos)
+        """, resultado)
+    # Quem importou vê o catálogo novo já na próxima leitura, sem esperar a verificação
+    _load_product_index.clear(current_db_file())
+    return dict(resultado, ja_importado=False)
+
+# --- Fotos de evidência ---
+# Miniaturas e recompressão acontecem numa thread de fundo, fora da requisição
+FOTO_MINIATURA_PX = 320
+FOTO_MAX_PX = 1600
+FOTO_JPEG_QUALIDADE = 80
+
+def _store_foto(conn, foto_bytes):
+    # Quem chama incrementa a versão de 'fotos' junto com o recebimento
+    foto_hash = hashlib.sha256(foto_bytes).hexdigest()
+    conn.execute(
+        "INSERT OR IGNORE INTO fotos (hash, conteudo, tamanho, criado_em) VALUES (?, ?, ?, ?)",
+        (foto_hash, sqlite3.Binary(foto_bytes), len(foto_bytes), datetime.datetime.now(brasilia_tz).strftime('%Y-%m-%d %H:%M')),
+    )
+    return foto_hash
+
+def get_foto(foto_hash, miniatura=False):
+    coluna = "COALESCE(miniatura, conteudo)" if miniatura else "conteudo"
+    with get_db_connection() as conn:
+        row = conn.execute(f"SELECT {coluna} FROM fotos WHERE hash = ?", (foto_hash,)).fetchone()
+    return bytes(row[0]) if row else None
+
+def get_fotos_pendentes(db_file=None):
+    with get_db_connection(db_file) as conn:
+        return [row[0] for row in conn.execute("SELECT hash FROM fotos WHERE processada = 0")]
+
+@st.cache_resource
+def get_foto_executor():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="fotos")
+
+def schedule_foto_processing(foto_hash, db_file=None):
+    get_foto_executor().submit(_process_foto, get_connection_pool(db_file or current_db_file()), foto_hash)
+
+def _process_foto(pool, foto_hash):
+    try:
+        from PIL import Image, ImageOps
+
+        with pool.connection() as conn:
+            row = conn.execute("SELECT conteudo FROM fotos WHERE hash = ? AND processada = 0", (foto_hash,)).fetchone()
+        if row is None:
+            return
+        imagem = ImageOps.exif_transpose(Image.open(io.BytesIO(row[0]))).convert('RGB')
+
+        imagem.thumbnail((FOTO_MAX_PX, FOTO_MAX_PX))
+        buffer = io.BytesIO()
+        imagem.save(buffer, format='JPEG', quality=FOTO_JPEG_QUALIDADE, optimize=True)
+        conteudo = buffer.getvalue() if buffer.tell() < len(row[0]) else bytes(row[0])
+
+        imagem.thumbnail((FOTO_MINIATURA_PX, FOTO_MINIATURA_PX))
+        buffer = io.BytesIO()
+        imagem.save(buffer, format='JPEG', quality=FOTO_JPEG_QUALIDADE, optimize=True)
+
+        with pool.connection() as conn:
+            conn.execute(
+                "UPDATE fotos SET conteudo = ?, tamanho = ?, miniatura = ?, mime = 'image/jpeg', processada = 1 WHERE hash = ?",
+                (sqlite3.Binary(conteudo), len(conteudo), sqlite3.Binary(buffer.getvalue()), foto_hash),
+            )
+            _bump_versao(conn, 'fotos')
+    except Exception:
+        # Foto ilegível: mantém o original e não tenta de novo
+        logging.exception("Falha ao processar a foto %s", foto_hash)
+        with pool.connection() as conn:
+            conn.execute("UPDATE fotos SET processada = 1 WHERE hash = ?", (foto_hash,))
+
+def save_reception(data, wait=True):
+    return save_receptions([data], wait=wait)
+
+def save_receptions(rows, wait=True):
+    # Todos os itens numa única transação: ou entram todos, ou nenhum
+    handle = submit_write(_insert_recebimentos, rows, wait=False)
+    # O callback pode rodar na thread escritora, fora da sessão: leva o banco junto
+    handle.add_done_callback(functools.partial(_schedule_fotos_gravadas, current_db_file()))
+    return handle.result() if wait else handle
+
+def _schedule_fotos_gravadas(db_file, handle):
+    if handle.exception() is None:
+        for foto_hash in handle.result():
+            schedule_foto_processing(foto_hash, db_file)
+
+def _insert_recebimentos(conn, rows):
+    foto_hashes = set()
+    valores = []
+    for data in rows:
+        foto_hash = _store_foto(conn, data['foto_evidencia']) if data['foto_evidencia'] else None
+        if foto_hash:
+            foto_hashes.add(foto_hash)
+        valores.append((data['codigo_produto'], data['quantidade_recebida'], data['condicao_produto'],
+                        data['data_recebimento'], data['dia_semana'], data['hora_recebimento'],
+                        foto_hash, data['conferente'], _iso_from_br(data['data_recebimento'])))
+    conn.executemany("""
+        INSERT INTO recebimentos (codigo_produto, quantidade_recebida, condicao_produto,
+                                  data_recebimento, dia_semana, hora_recebimento,
+                                  foto_hash, conferente, ts_recebimento)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, valores)
+    _bump_versao(conn, 'recebimentos', *(['fotos'] if foto_hashes else []))
+    return foto_hashes
+
+@cached_query('recebimentos')
+def get_consolidated_recebimentos():
+    query = "SELECT codigo_produto, quantidade_total_recebida FROM recebimentos_totais"
+    with get_db_connection() as conn:
+        df = read_sql_tipado(query, conn, tabelas=('recebimentos_totais',))
+    return df
+
+# Produtos recebidos e ainda não auditados: anti-join indexado
+# (recebimentos_totais x idx_auditorias_codigo), paginado por codigo_produto.
+AUDITORIA_PAGE_SIZE = 100
+
+def _pendentes_auditoria_filtro(busca):
+    clauses = ["NOT EXISTS (SELECT 1 FROM auditorias a WHERE a.codigo_produto = t.codigo_produto)",
+               "NOT EXISTS (SELECT 1 FROM auditorias_arquivadas aa WHERE aa.codigo_produto = t.codigo_produto)"]
+    params = []
+    if busca:
+        clauses.append("((t.codigo_produto >= ? AND t.codigo_produto < ?) OR p.descricao_produto LIKE ?)")
+        params += [busca, busca + '\uffff', f"%{busca}%"]
+    return clauses, params
+
+@cached_query('recebimentos', 'auditorias', 'produtos')
+def get_pendentes_auditoria(busca=None, after_codigo=None, limit=AUDITORIA_PAGE_SIZE):
+    clauses, params = _pendentes_auditoria_filtro(busca)
+    if after_codigo is not None:
+        clauses.append("t.codigo_produto > ?")
+        params.append(after_codigo)
+    query = f"""
+        SELECT t.codigo_produto, p.descricao_produto, p.secao_produto, t.quantidade_total_recebida
+        FROM recebimentos_totais t
+        LEFT JOIN produtos p ON p.codigo_produto = t.codigo_produto
+        {_where(clauses)}
+        ORDER BY t.codigo_produto
+        LIMIT ?
+    """
+    with get_db_connection() as conn:
+        return read_sql_tipado(query, conn, params + [limit], ('recebimentos_totais', 'produtos'))
+
+@cached_query('recebimentos', 'auditorias', 'produtos')
+def count_pendentes_auditoria(busca=None):
+    clauses, params = _pendentes_auditoria_filtro(busca)
+    query = f"""
+        SELECT COUNT(*) FROM recebimentos_totais t
+        LEFT JOIN produtos p ON p.codigo_produto = t.codigo_produto
+        {_where(clauses)}
+    """
+    with get_db_connection() as conn:
+        return conn.execute(query, params).fetchone()[0]
+
+def save_audit(data, wait=True):
+    return submit_write(_insert_auditoria, data, wait=wait)
+
+def _insert_auditoria(conn, data):
+    conn.execute("""
+        INSERT INTO auditorias (codigo_produto, quantidade_sistema, quantidade_divergente,
+                                  data_auditoria, auditor, status_divergencia, ts_auditoria)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (data['codigo_produto'], data['quantidade_sistema'], data['quantidade_divergente'],
+          data['data_auditoria'], data['auditor'], data['status_divergencia'],
+          _iso_from_br(data['data_auditoria'])))
+    _bump_versao(conn, 'auditorias')
+
+def update_status_divergencia(id_auditoria, status, wait=True):
+    return submit_write(_update_status_divergencia, id_auditoria, status, wait=wait)
+
+def _update_status_divergencia(conn, id_auditoria, status):
+    # A versão sobe antes para a linha ficar marcada com a versão que a alterou
+    _bump_versao(conn, 'auditorias')
+    conn.execute("""
+        UPDATE auditorias
+        SET status_divergencia = ?,
+            versao_alteracao = (SELECT versao FROM versoes_dados WHERE tabela = 'auditorias')
+        WHERE id_auditoria = ?
+    """, (status, int(id_auditoria)))
+
+# --- Auditoria em lote (estoque exportado do ERP) ---
+ESTOQUE_ERP_COLUNAS = {
+    'codigo': 'codigo_produto',
+    'codigo_produto': 'codigo_produto',
+    'quantidade': 'quantidade_sistema',
+    'quantidade_sistema': 'quantidade_sistema',
+    'qtd': 'quantidade_sistema',
+    'qtd_sistema': 'quantidade_sistema',
+    'estoque': 'quantidade_sistema',
+    'saldo': 'quantidade_sistema',
+}
+RESUMO_DIVERGENCIAS_COLUNAS = ['codigo_produto', 'descricao_produto', 'secao_produto', 'quantidade_total_recebida',
+                               'quantidade_sistema', 'quantidade_divergente', 'status_divergencia']
+
+# Só milhar, sem vírgula decimal: "1.234" e "12.345.678" (não "1.5" nem "12.50")
+_QUANTIDADE_MILHAR = re.compile(r'^[+-]?\d{1,3}(\.\d{3})+$')
+# Casas da divergência gravada, iguais na auditoria individual e na em lote
+DIVERGENCIA_CASAS = 3
+
+def _normalize_quantidade(valor):
+    if valor is None or isinstance(valor, bool):
+        return None
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    texto = str(valor).strip().replace(' ', '')
+    # Formato brasileiro vindo de CSV: 1.234,50; e o ERP exporta 1.234 (mil
+    # duzentos e trinta e quatro) sem a vírgula quando não há decimais
+    if ',' in texto or _QUANTIDADE_MILHAR.match(texto):
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        return float(texto)
+    except ValueError:
+        return None
+
+def read_estoque_erp(nome_arquivo, conteudo):
+    linhas = _iter_planilha(nome_arquivo, conteudo)
+    cabecalho = [ESTOQUE_ERP_COLUNAS.get(_normalize_header(c)) for c in next(linhas, [])]
+    if 'codigo_produto' not in cabecalho or 'quantidade_sistema' not in cabecalho:
+        raise ValueError("A planilha precisa das colunas 'codigo' e 'quantidade' (ou 'quantidade_sistema').")
+    pos_codigo = cabecalho.index('codigo_produto')
+    pos_quantidade = cabecalho.index('quantidade_sistema')
+
+    codigos, quantidades = [], []
+    invalidas = 0
+    for linha in linhas:
+        codigo = _normalize_codigo(linha[pos_codigo]) if pos_codigo < len(linha) else None
+        if codigo is None:
+            continue
+        quantidade = _normalize_quantidade(linha[pos_quantidade]) if pos_quantidade < len(linha) else None
+        if quantidade is None:
+            invalidas += 1
+            continue
+        codigos.append(codigo)
+        quantidades.append(quantidade)
+    estoque = pd.DataFrame({'codigo_produto': codigos, 'quantidade_sistema': quantidades})
+    # Saldo em mais de um depósito vem em várias linhas: soma por código
+    estoque = estoque.groupby('codigo_produto', as_index=False, sort=False)['quantidade_sistema'].sum()
+    return estoque, invalidas
+
+def calcular_divergencias(recebido, sistema):
+    # Colunas inteiras de uma vez; + 0.0 evita gravar -0.0
+    return (recebido.astype('float64') - sistema.astype('float64')).round(DIVERGENCIA_CASAS) + 0.0
+
+def calcular_divergencia(recebido, sistema):
+    # Auditoria individual pela mesma conta do lote: o round do Python
+    # arredonda alguns meios (ex.: 0,0005) diferente do pandas
+    return float(calcular_divergencias(pd.Series([recebido]), pd.Series([sistema])).iloc[0])
+
+def reconcile_auditorias(estoque):
+    # Cruza o estoque do ERP com todos os pendentes de uma vez (sem laço por produto)
+    pendentes = get_pendentes_auditoria(limit=-1)
+    conciliacao = pendentes.merge(estoque, on='codigo_produto', how='inner')
+    conciliacao['quantidade_divergente'] = calcular_divergencias(conciliacao['quantidade_total_recebida'],
+                                                                 conciliacao['quantidade_sistema'])
+    conciliacao['status_divergencia'] = conciliacao['quantidade_divergente'].ne(0).map({True: "Aberta", False: "Solucionada"})
+    return {
+        'conciliacao': conciliacao,
+        'pendentes_fora_do_arquivo': len(pendentes) - len(conciliacao),
+        # Códigos já auditados ou que nunca foram recebidos
+        'ignorados': len(estoque) - len(conciliacao),
+    }
+
+def resumo_divergencias_csv(conciliacao):
+    divergentes = conciliacao.loc[conciliacao['quantidade_divergente'] != 0, RESUMO_DIVERGENCIAS_COLUNAS]
+    divergentes = divergentes.reindex(divergentes['quantidade_divergente'].abs().sort_values(ascending=False).index)
+    # Descrição ausente sai vazia no CSV (e não como "<NA>")
+    divergentes = divergentes.astype(object).where(divergentes.notna(), None)
+    buffer = io.BytesIO()
+    _write_csv(buffer, RESUMO_DIVERGENCIAS_COLUNAS, [divergentes.itertuples(index=False, name=None)])
+    return buffer.getvalue()
+
+def save_audits(rows, wait=True):
+    return submit_write(_insert_auditorias, rows, wait=wait)
+
+def _insert_auditorias(conn, rows):
+    # Só grava produtos ainda sem auditoria: entre a prévia e a confirmação
+    # outra pessoa pode ter auditado algum deles. Devolve quantos gravou.
+    cursor = conn.executemany("""
+        INSERT INTO auditorias (codigo_produto, quantidade_sistema, quantidade_divergente,
+                                data_auditoria, auditor, status_divergencia, ts_auditoria)
+        SELECT ?, ?, ?, ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM auditorias WHERE codigo_produto = ?)
+          AND NOT EXISTS (SELECT 1 FROM auditorias_arquivadas WHERE codigo_produto = ?)
+    """, [(data['codigo_produto'], data['quantidade_sistema'], data['quantidade_divergente'],
+           data['data_auditoria'], data['auditor'], data['status_divergencia'],
+           _iso_from_br(data['data_auditoria']), data['codigo_produto'], data['codigo_produto']) for data in rows])
+    _bump_versao(conn, 'auditorias')
+    return cursor.rowcount
+
+@delta_query('auditorias', 'id_auditoria', 'produtos', alteracoes=True)
+def get_auditorias_historico(start_date=None, end_date=None, ids=None):
+    clauses, params = _date_range_clauses('a.ts_auditoria', start_date, end_date)
+    if ids is not None:
+        clause, param = _delta_clause('a.id_auditoria', ids)
+        clauses.append(clause)
+        params.append(param)
+    colunas = ', '.join(f"a.{c}" for c in AUDITORIAS_COLUNAS)
+    montar_query = lambda schema: f"""
+        SELECT {colunas}, p.descricao_produto
+        FROM {schema}.auditorias a
+        LEFT JOIN main.produtos p ON p.codigo_produto = a.codigo_produto
+        {_where(clauses)}
+        ORDER BY a.ts_auditoria, a.id_auditoria
+    """
+    return _read_sql_com_arquivos(montar_query, params, start_date, end_date, ids, ('auditorias', 'produtos'))
+
+@delta_query('auditorias', 'id_auditoria', 'produtos', alteracoes=True)
+def get_divergencias(status=None, start_date=None, end_date=None, ids=None):
+    # Filtra pelo índice (status_divergencia, ts_auditoria)
+    status_list = [status] if status else STATUS_PENDENTES
+    clauses = [f"a.status_divergencia IN ({', '.join('?' for _ in status_list)})"]
+    params = list(status_list)
+    date_clauses, date_params = _date_range_clauses('a.ts_auditoria', start_date, end_date)
+    clauses += date_clauses
+    params += date_params
+    if ids is not None:
+        clause, param = _delta_clause('a.id_auditoria', ids)
+        clauses.append(clause)
+        params.append(param)
+    query = f"""
+        SELECT a.id_auditoria, a.codigo_produto, p.descricao_produto, a.quantidade_divergente,
+               a.data_auditoria, a.auditor, a.status_divergencia
+        FROM auditorias a
+        LEFT JOIN produtos p ON p.codigo_produto = a.codigo_produto
+        {_where(clauses)}
+        ORDER BY a.ts_auditoria, a.id_auditoria
+    """
+    # Snapshot de auditorias possivelmente atrasado (o delta completa a partir
+    # dele); o de produtos precisa estar em dia, pois a junção não tem delta
+    if ids is None and _periodo_longo(start_date, end_date):
+        df = analytics_query(query, params, ('auditorias', 'produtos'), atuais=('produtos',), coluna_id='id_auditoria')
+        if df is not None:
+            return tipar(df, 'auditorias', 'produtos')
+    with get_db_connection() as conn:
+        return read_sql_tipado(query, conn, params, ('auditorias', 'produtos'))
+
+@cached_query('auditorias')
+def get_divergencias_date_range():
+    placeholders = ', '.join('?' for _ in STATUS_PENDENTES)
+    with get_db_connection() as conn:
+        row = conn.execute(
+            f"SELECT MIN(ts_auditoria), MAX(ts_auditoria), COUNT(*) FROM auditorias WHERE status_divergencia IN ({placeholders})",
+            STATUS_PENDENTES,
+        ).fetchone()
+    if not row[2]:
+        return None
+    parse = lambda ts: datetime.datetime.strptime(ts[:10], '%Y-%m-%d').date() if ts else None
+    return parse(row[0]), parse(row[1])
+
+def get_primeiro_recebimento(codigo):
+    query = "SELECT condicao_produto, foto_hash FROM {schema}.recebimentos WHERE codigo_produto = ? ORDER BY id_recebimento LIMIT 1"
+    with get_db_connection() as conn:
+        # O primeiro recebimento pode estar num mês arquivado (do mais antigo ao mais recente)
+        for arquivo in _arquivos_do_periodo(conn):
+            with _arquivo_anexado(conn, arquivo):
+                row = conn.execute(query.format(schema='arquivo'), (codigo,)).fetchone()
+            if row is not None:
+                return row
+        return conn.execute(query.format(schema='main'), (codigo,)).fetchone()
+
+def _recebimentos_relatorio_query(conferente=None, start_date=None, end_date=None, colunas=RECEBIMENTOS_COLUNAS, schema='main', ids=None):
+    clauses, params = _date_range_clauses('ts_recebimento', start_date, end_date)
+    if conferente:
+        clauses.insert(0, "conferente = ?")
+        params.insert(0, conferente)
+    if ids is not None:
+        clause, param = _delta_clause('id_recebimento', ids)
+        clauses.append(clause)
+        params.append(param)
+    query = f"SELECT {', '.join(colunas)} FROM {schema}.recebimentos {_where(clauses)} ORDER BY ts_recebimento, id_recebimento"
+    return query, params
+
+@delta_query('recebimentos', 'id_recebimento')
+def get_recebimentos_relatorio(conferente=None, start_date=None, end_date=None, ids=None):
+    query, params = _recebimentos_relatorio_query(conferente, start_date, end_date, ids=ids)
+    # O delta continua a partir do maior id do snapshot, mesmo atrasado
+    if ids is None and _periodo_longo(start_date, end_date):
+        df = analytics_query(query, params, ('recebimentos',), coluna_id='id_recebimento')
+        if df is not None:
+            return tipar(df, 'recebimentos')
+    montar_query = lambda schema: _recebimentos_relatorio_query(conferente, start_date, end_date, schema=schema, ids=ids)[0]
+    return _read_sql_com_arquivos(montar_query, params, start_date, end_date, ids, ('recebimentos',))
+
+# Painéis de Relatórios: leem só recebimentos_diarios (nunca a tabela bruta)
+RESUMO_AGRUPAMENTOS = {'dia': 'dia', 'conferente': 'conferente', 'secao': 'secao_produto'}
+
+@cached_query('recebimentos')
+def get_resumo_recebimentos(agrupamento, conferente=None, start_date=None, end_date=None):
+    with get_db_connection() as conn:
+        return _ler_resumo_recebimentos(conn, agrupamento, conferente, start_date, end_date)
+
+def _ler_resumo_recebimentos(conn, agrupamento, conferente=None, start_date=None, end_date=None):
+    coluna = RESUMO_AGRUPAMENTOS[agrupamento]
+    clauses, params = [], []
+    if conferente is not None:
+        clauses.append("conferente = ?")
+        params.append(conferente)
+    if start_date and end_date:
+        clauses.append("dia BETWEEN ? AND ?")
+        params += [start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')]
+    query = f"""
+        SELECT {coluna}, SUM(qtd_recebimentos) AS qtd_recebimentos,
+               SUM(quantidade_total) AS quantidade_total, SUM(qtd_ruim) AS qtd_ruim
+        FROM recebimentos_diarios
+        {_where(clauses)}
+        GROUP BY {coluna}
+        ORDER BY {coluna}
+    """
+    df = read_sql_tipado(query, conn, params, ('recebimentos_diarios',))
+    df['pct_ruim'] = (100 * df['qtd_ruim'] / df['qtd_recebimentos']).astype('float32')
+    return df
+
+def somar_resumo(resumo, coluna):
+    # Reagrega um resumo (ex.: de várias lojas) por outra coluna
+    df = resumo.groupby(coluna, as_index=False, sort=True, observed=True)[['qtd_recebimentos', 'quantidade_total', 'qtd_ruim']].sum()
+    df['pct_ruim'] = (100 * df['qtd_ruim'] / df['qtd_recebimentos']).astype('float32')
+    return df
+
+def rebuild_resumos():
+    return submit_write(_rebuild_resumos)
+
+def _rebuild_resumos(conn):
+    rebuild_recebimentos_totais(conn)
+    rebuild_recebimentos_diarios(conn)
+    _somar_arquivos_nos_resumos(conn)
+    _bump_versao(conn, 'recebimentos')
+
+# --- Relatório consolidado (todas as lojas) ---
+# Cada loja calcula o seu resumo (recebimentos_diarios, nunca a tabela bruta)
+# numa thread do pool de consolidação, no seu banco, e os agregados são
+# juntados aqui. O resultado de cada loja entra no cache de consultas dela com
+# a mesma chave da tela de Relatórios: não é recalculado enquanto a loja não grava.
+CONSOLIDADO_WORKERS = int(os.environ.get('RECEBIMENTO_CONSOLIDADO_WORKERS', '4'))
+# Uma loja que não responde (ex.: arquivo inacessível) fica fora do consolidado
+CONSOLIDADO_TIMEOUT_S = 30
+
+@st.cache_resource
+def get_consolidado_executor():
+    return ThreadPoolExecutor(max_workers=CONSOLIDADO_WORKERS, thread_name_prefix="consolidado")
+
+def _resumo_da_loja(db_file, pool, cache, args):
+    # Roda fora da sessão: recebe o pool e o cache da loja já resolvidos.
+    # As migrações de uma loja ainda não aberta no processo contam no prazo dela.
+    ensure_schema(db_file)
+    with pool.connection() as conn:
+        versoes = get_data_versions(('recebimentos',), conn)
+        return cache.get_or_compute(_cache_key(get_resumo_recebimentos, args, {}, versoes),
+                                    lambda: _ler_resumo_recebimentos(conn, *args))
+
+def get_consolidado_recebimentos(agrupamento, start_date=None, end_date=None):
+    # Devolve o resumo por loja × agrupamento e {loja: erro} das que ficaram de fora
+    lojas = [(LOJA_PRINCIPAL, DB_FILE)] + [(nome, _caminho_loja(arquivo)) for _, nome, arquivo in get_lojas()]
+    args = (agrupamento, None, start_date, end_date)
+    pendentes, falhas = {}, {}
+    for nome, db_file in lojas:
+        # O connect criaria um banco vazio no lugar de um arquivo que falta
+        if not os.path.exists(db_file):
+            falhas[nome] = f"arquivo {db_file} não encontrado"
+            continue
+        pendentes[nome] = get_consolidado_executor().submit(
+            _resumo_da_loja, db_file, get_connection_pool(db_file), get_query_cache(db_file), args)
+
+    partes = []
+    prazo = time.monotonic() + CONSOLIDADO_TIMEOUT_S
+    for nome, handle in pendentes.items():
+        try:
+            resumo = handle.result(timeout=max(0, prazo - time.monotonic()))
+        except FutureTimeoutError:
+            falhas[nome] = f"sem resposta em {CONSOLIDADO_TIMEOUT_S} s"
+        except Exception as e:
+            falhas[nome] = str(e)
+        else:
+            if not resumo.empty:
+                partes.append(resumo.assign(loja=nome))
+    if not partes:
+        return pd.DataFrame(columns=[RESUMO_AGRUPAMENTOS[agrupamento], 'qtd_recebimentos', 'quantidade_total',
+                                     'qtd_ruim', 'pct_ruim', 'loja']), falhas
+    consolidado = concat_frames(partes)
+    consolidado['loja'] = consolidado['loja'].astype(CATEGORIA)
+    return contar_memoria(consolidado), falhas
+
+# --- Exportação de relatórios ---
+# O arquivo é gerado só quando pedido, lendo o cursor em lotes (memória limitada)
+# e fica em cache por filtros + versão dos dados.
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATOS = {
+    'Excel (.xlsx)': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+# Colunas que só referenciam fotos ficam fora do arquivo, salvo se pedidas
+EXPORT_COLUNAS_FOTO = ['foto_hash']
+
+def _iter_cursor_chunks(cursor, chunk_size=EXPORT_CHUNK_SIZE):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+def _write_xlsx(buffer, colunas, chunks):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Relatório de Recebimentos')
+    sheet.append(colunas)
+    for chunk in chunks:
+        for row in chunk:
+            sheet.append(row)
+    workbook.save(buffer)
+
+def _write_csv(buffer, colunas, chunks):
+    texto = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+    writer = csv.writer(texto, delimiter=';')
+    writer.writerow(colunas)
+    for chunk in chunks:
+        writer.writerows(chunk)
+    texto.flush()
+    texto.detach()
+
+def _write_parquet(buffer, colunas, chunks, tipos=None):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("A exportação em Parquet requer o pacote pyarrow.")
+    if tipos is None:
+        tipos = {'id_recebimento': pa.int64(), 'quantidade_recebida': pa.float64()}
+    schema = pa.schema([(c, tipos.get(c, pa.string())) for c in colunas])
+    with pq.ParquetWriter(buffer, schema) as writer:
+        for chunk in chunks:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(col, type=schema.field(c).type) for c, col in zip(colunas, zip(*chunk))],
+                schema=schema,
+            ))
+
+_EXPORT_WRITERS = {'xlsx': _write_xlsx, 'csv': _write_csv, 'parquet': _write_parquet}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def export_recebimentos(formato, conferente=None, start_date=None, end_date=None, incluir_fotos=False, versao=None, db_file=None):
+    # `versao` entra apenas na chave do cache: muda quando há novos recebimentos.
+    # `db_file` separa o cache por loja (é compartilhado entre sessões).
+    colunas = [c for c in RECEBIMENTOS_COLUNAS if incluir_fotos or c not in EXPORT_COLUNAS_FOTO]
+    _, params = _recebimentos_relatorio_query(conferente, start_date, end_date, colunas)
+    montar_query = lambda schema: _recebimentos_relatorio_query(conferente, start_date, end_date, colunas, schema)[0]
+    buffer = io.BytesIO()
+    with get_db_connection(db_file) as conn:
+        arquivos = _arquivos_do_periodo(conn, start_date, end_date)
+        chunks = _iter_chunks_com_arquivos(conn, montar_query, params, arquivos, EXPORT_CHUNK_SIZE)
+        _EXPORT_WRITERS[formato](buffer, colunas, chunks)
+        if _arquivos_do_periodo(conn, start_date, end_date) != arquivos:
+            raise RuntimeError("Meses foram arquivados durante a exportação. Gere o relatório novamente.")
+    return buffer.getvalue()
+
+# --- Backend analítico opcional (DuckDB sobre snapshots Parquet) ---
+# Com RECEBIMENTO_ANALYTICS=duckdb, as consultas de relatório rodam no DuckDB
+# (vetorizado, multi-core) sobre cópias Parquet das tabelas, sem disputar o
+# SQLite em que a tela de recebimento grava. Os snapshots são refeitos em
+# segundo plano quando a versão da tabela muda, no máximo a cada
+# ANALYTICS_REFRESH_S; no intervalo, os históricos incrementais partem do
+# snapshot e completam pelo delta o que foi gravado depois dele. Sem duckdb
+# instalado, tudo continua no SQLite.
+ANALYTICS_ENABLED = os.environ.get('RECEBIMENTO_ANALYTICS', 'sqlite') == 'duckdb'
+ANALYTICS_DIR = os.environ.get('RECEBIMENTO_ANALYTICS_DIR') or os.path.splitext(DB_FILE)[0] + '_analytics'
+ANALYTICS_REFRESH_S = float(os.environ.get('RECEBIMENTO_ANALYTICS_REFRESH_S', '300'))
+ANALYTICS_TABELAS = ('recebimentos', 'auditorias', 'produtos')
+ANALYTICS_CHUNK_SIZE = 50000
+# Períodos curtos continuam no SQLite, onde os índices por data ganham
+ANALYTICS_MIN_DIAS = int(os.environ.get('RECEBIMENTO_ANALYTICS_MIN_DIAS', '90'))
+_PARQUET_TIPOS_SQLITE = {'INTEGER': 'int64', 'REAL': 'float64', 'BLOB': 'binary'}
+
+class AnalyticsStore:
+    def __init__(self, pool, pasta):
+        import duckdb
+        self._duckdb = duckdb
+        self.pool = pool
+        self.pasta = pasta
+        os.makedirs(pasta, exist_ok=True)
+        self._lock = threading.Lock()
+        self._snapshots = {}  # tabela -> (versao, caminho, criado_em)
+        self._atualizando = {}  # tabela -> Future do snapshot em andamento
+        # Um único escritor de snapshots, fora da thread da página
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics')
+        self._load_existing()
+        for tabela in ANALYTICS_TABELAS:
+            if tabela not in self._snapshots:
+                self._schedule_refresh(tabela)
+
+    def _load_existing(self):
+        # Snapshots deixados por um processo anterior continuam valendo
+        for nome in os.listdir(self.pasta):
+            tabela, _, resto = nome.rpartition('_v')
+            if tabela in ANALYTICS_TABELAS and resto.endswith('.parquet') and resto[:-8].isdigit():
+                caminho = os.path.join(self.pasta, nome)
+                atual = self._snapshots.get(tabela)
+                if atual is None or int(resto[:-8]) > atual[0]:
+                    self._snapshots[tabela] = (int(resto[:-8]), caminho, os.path.getmtime(caminho))
+
+    def _write_snapshot(self, tabela):
+        import pyarrow as pa
+        with self.pool.connection() as conn:
+            # A versão é lida antes dos dados: no pior caso o snapshot é mais novo que o rótulo
+            versao = get_data_versions((tabela,), conn)[0]
+            info = conn.execute(f"PRAGMA table_info({tabela})").fetchall()
+            colunas = [row[1] for row in info]
+            tipos = {row[1]: getattr(pa, _PARQUET_TIPOS_SQLITE.get(row[2].upper(), 'string'))() for row in info}
+            caminho = os.path.join(self.pasta, f"{tabela}_v{versao}.parquet")
+            # Recebimentos e auditorias incluem os meses arquivados
+            arquivos = _arquivos_do_periodo(conn) if tabela in ARQUIVO_TABELAS else []
+            montar_query = lambda schema: f"SELECT {', '.join(colunas)} FROM {schema}.{tabela}"
+            with open(caminho + '.tmp', 'wb') as arquivo:
+                chunks = _iter_chunks_com_arquivos(conn, montar_query, (), arquivos, ANALYTICS_CHUNK_SIZE)
+                _write_parquet(arquivo, colunas, chunks, tipos)
+        os.replace(caminho + '.tmp', caminho)
+        with self._lock:
+            anterior = self._snapshots.get(tabela)
+            self._snapshots[tabela] = (versao, caminho, time.time())
+        if anterior and anterior[1] != caminho:
+            try:
+                os.remove(anterior[1])
+            except OSError:
+                pass
+        # Nada a invalidar: os frames lidos de um snapshot guardam a versão dele
+        # e seguem pelo delta, e o cache de consultas não usa os snapshots
+        return self._snapshots[tabela]
+
+    def _schedule_refresh(self, tabela):
+        with self._lock:
+            handle = self._atualizando.get(tabela)
+            novo = handle is None
+            if novo:
+                handle = self._executor.submit(self._write_snapshot, tabela)
+                self._atualizando[tabela] = handle
+        if novo:
+            handle.add_done_callback(functools.partial(self._refresh_done, tabela))
+        return handle
+
+    def _refresh_done(self, tabela, handle):
+        with self._lock:
+            self._atualizando.pop(tabela, None)
+        if handle.exception() is not None:
+            logging.error("Falha ao atualizar o snapshot analítico de %s", tabela, exc_info=handle.exception())
+
+    def snapshots(self, tabelas, atuais=()):
+        # Devolve {tabela: (versao, caminho)}, ou None se uma das tabelas em
+        # `atuais` (ex.: a da junção) não estiver em dia. Snapshots atrasados
+        # são refeitos em segundo plano, no máximo a cada ANALYTICS_REFRESH_S.
+        with self.pool.connection() as conn:
+            versoes = dict(zip(tabelas, get_data_versions(tabelas, conn)))
+        resultado = {}
+        for tabela in tabelas:
+            with self._lock:
+                snapshot = self._snapshots.get(tabela)
+            if snapshot is None:
+                # Primeira vez: espera o snapshot ficar pronto
+                snapshot = self._schedule_refresh(tabela).result()
+            elif snapshot[0] != versoes[tabela]:
+                if time.time() - snapshot[2] >= ANALYTICS_REFRESH_S:
+                    self._schedule_refresh(tabela)
+                if tabela in atuais:
+                    return None
+            resultado[tabela] = snapshot[:2]
+        return resultado
+
+    def query(self, sql, params, tabelas, atuais=(), coluna_id=None):
+        # Com coluna_id, o frame leva em attrs['cobertura'] a versão e o maior id
+        # do snapshot da primeira tabela, de onde o delta continua
+        snapshots = self.snapshots(tabelas, atuais)
+        if snapshots is None:
+            return None
+        con = self._duckdb.connect()
+        try:
+            for tabela, (_, caminho) in snapshots.items():
+                con.execute(f"CREATE VIEW {tabela} AS SELECT * FROM read_parquet('{caminho.replace(chr(39), chr(39) * 2)}')")
+            resultado = con.execute(sql, params).arrow()
+            # duckdb >= 1.4 devolve um RecordBatchReader; versões anteriores, uma Table
+            if hasattr(resultado, 'read_all'):
+                resultado = resultado.read_all()
+            ultimo_id = None
+            if coluna_id:
+                ultimo_id = con.execute(f"SELECT COALESCE(MAX({coluna_id}), 0) FROM {tabelas[0]}").fetchone()[0]
+        finally:
+            con.close()
+        df = resultado.to_pandas(types_mapper=pd.ArrowDtype)
+        if coluna_id:
+            df.attrs['cobertura'] = {'versao': snapshots[tabelas[0]][0], 'ultimo_id': int(ultimo_id)}
+        return df
+
+    def status(self):
+        with self._lock:
+            return {tabela: {'versao': s[0], 'criado_em': s[2]} for tabela, s in self._snapshots.items()}
+
+@st.cache_resource
+def get_analytics_store(db_file=DB_FILE):
+    try:
+        # A pasta configurada é a do banco principal; cada loja usa a pasta ao lado do seu banco
+        pasta = ANALYTICS_DIR if db_file == DB_FILE else os.path.splitext(db_file)[0] + '_analytics'
+        return AnalyticsStore(get_connection_pool(db_file), pasta)
+    except ImportError:
+        logging.warning("RECEBIMENTO_ANALYTICS=duckdb, mas o pacote duckdb não está instalado; usando o SQLite.")
+        return None
+
+def _periodo_longo(start_date, end_date):
+    return not (start_date and end_date) or (end_date - start_date).days >= ANALYTICS_MIN_DIAS
 
-# --- Funções do Banco de Dados (SQLite) ---
-DB_FILE = "gestao_recebimentos.db"
+_analytics_local = threading.local()
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS produtos (
-            codigo_produto TEXT PRIMARY KEY,
-            descricao_produto TEXT,
-            secao_produto TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS recebimentos (
-            id_recebimento INTEGER PRIMARY KEY,
-            codigo_produto TEXT,
-            quantidade_recebida REAL,
-            condicao_produto TEXT,
-            data_recebimento TEXT,
-            dia_semana TEXT,
-            hora_recebimento TEXT,
-            foto_evidencia TEXT,
-            conferente TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS auditorias (
-            id_auditoria INTEGER PRIMARY KEY,
-            codigo_produto TEXT,
-            quantidade_sistema REAL,
-            quantidade_divergente REAL,
-            data_auditoria TEXT,
-            auditor TEXT,
-            status_divergencia TEXT
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id_usuario TEXT PRIMARY KEY,
-            nome_usuario TEXT,
-            tipo_acesso TEXT,
-            senha TEXT
-        )
-    """)
-    
-    # Inserir usuários padrão se a tabela estiver vazia
-    c.execute("SELECT COUNT(*) FROM usuarios")
-    if c.fetchone()[0] == 0:
-        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('admin', 'Gestor Admin', 'Gestor', 'admin'))
-        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('conf1', 'Conferente 1', 'Conferente', '123'))
-        c.execute("INSERT INTO usuarios VALUES (?, ?, ?, ?)", ('prev1', 'Prevenção 1', 'Prevenção', '123'))
+@contextmanager
+def sem_snapshot():
+    # Leituras feitas aqui dentro vão direto ao SQLite; aninhado, devolve o estado anterior
+    anterior = getattr(_analytics_local, 'desligado', False)
+    _analytics_local.desligado = True
+    try:
+        yield
+    finally:
+        _analytics_local.desligado = anterior
 
-    conn.commit()
-    conn.close()
+def analytics_query(sql, params, tabelas, atuais=(), coluna_id=None):
+    # None = use o SQLite (backend desligado, indisponível ou snapshot desatualizado)
+    if not ANALYTICS_ENABLED or getattr(_analytics_local, 'desligado', False):
+        return None
+    store = get_analytics_store(current_db_file())
+    if store is None:
+        return None
+    try:
+        return store.query(sql, params, tabelas, atuais, coluna_id)
+    except Exception:
+        logging.exception("Falha na consulta analítica; usando o SQLite.")
+        return None
 
-def get_db_connection():
-    return sqlite3.connect(DB_FILE)
+# Histórico paginado por keyset (id_recebimento decrescente): cada página
+# custa o mesmo, independentemente do tamanho da tabela.
+HISTORICO_PAGE_SIZE = 50
 
-# --- Funções de Lógica ---
-def get_product_info(codigo):
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM produtos WHERE codigo_produto = ?", conn, params=(codigo,))
-    conn.close()
-    return df.iloc[0] if not df.empty else None
+@cached_query('recebimentos', 'produtos')
+def get_historico_recebimentos(before_id=None, limit=HISTORICO_PAGE_SIZE):
+    clauses, params = [], []
+    if before_id is not None:
+        clauses.append("r.id_recebimento < ?")
+        params.append(int(before_id))
+    montar_query = lambda schema: f"""
+        SELECT r.id_recebimento, r.codigo_produto, p.descricao_produto, p.secao_produto,
+               r.quantidade_recebida, r.condicao_produto, r.data_recebimento, r.dia_semana,
+               r.hora_recebimento, r.conferente
+        FROM {schema}.recebimentos r
+        LEFT JOIN main.produtos p ON p.codigo_produto = r.codigo_produto
+        {_where(clauses)}
+        ORDER BY r.id_recebimento DESC
+        LIMIT ?
+    """
+    with get_db_connection() as conn:
+        partes = [read_sql_tipado(montar_query('main'), conn, params + [limit], ('recebimentos', 'produtos'))]
+        # A página que passa do início da base ativa continua nos arquivos, do mais recente para trás
+        restante = limit - len(partes[0])
+        for arquivo in reversed(_arquivos_do_periodo(conn) if restante > 0 else []):
+            with _arquivo_anexado(conn, arquivo):
+                partes.append(read_sql_tipado(montar_query('arquivo'), conn, params + [restante], ('recebimentos', 'produtos')))
+            restante -= len(partes[-1])
+            if restante <= 0:
+                break
+    return _concat_partes(partes)
 
-def save_reception(data):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO recebimentos (codigo_produto, quantidade_recebida, condicao_produto,
-                                  data_recebimento, dia_semana, hora_recebimento,
-                                  foto_evidencia, conferente)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (data['codigo_produto'], data['quantidade_recebida'], data['condicao_produto'],
-          data['data_recebimento'], data['dia_semana'], data['hora_recebimento'],
-          data['foto_evidencia'], data['conferente']))
-    conn.commit()
-    conn.close()
+def get_historico_cursor_para_data(data):
+    # Primeiro id após o último recebimento do dia informado (busca pelo índice em ts_recebimento)
+    query = "SELECT id_recebimento FROM {schema}.recebimentos WHERE ts_recebimento < ? ORDER BY ts_recebimento DESC LIMIT 1"
+    params = ((data + datetime.timedelta(days=1)).isoformat(),)
+    with get_db_connection() as conn:
+        row = conn.execute(query.format(schema='main'), params).fetchone()
+        for arquivo in reversed(_arquivos_do_periodo(conn, end_date=data) if row is None else []):
+            with _arquivo_anexado(conn, arquivo):
+                row = conn.execute(query.format(schema='arquivo'), params).fetchone()
+            if row is not None:
+                break
+    return row[0] + 1 if row else 0
 
-def get_consolidated_recebimentos():
-    conn = get_db_connection()
-    query = "SELECT codigo_produto, SUM(quantidade_recebida) as quantidade_total_recebida FROM recebimentos GROUP BY codigo_produto"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+@cached_query('recebimentos')
+def get_conferentes():
+    with get_db_connection() as conn:
+        # O resumo diário também lista quem só tem recebimentos em meses arquivados
+        return [row[0] for row in conn.execute("""
+            SELECT DISTINCT conferente FROM recebimentos
+            UNION SELECT conferente FROM recebimentos_diarios WHERE conferente != ''
+            ORDER BY conferente
+        """)]
 
-def save_audit(data):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO auditorias (codigo_produto, quantidade_sistema, quantidade_divergente,
-                                  data_auditoria, auditor, status_divergencia)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (data['codigo_produto'], data['quantidade_sistema'], data['quantidade_divergente'],
-          data['data_auditoria'], data['auditor'], data['status_divergencia']))
-    conn.commit()
-    conn.close()
+def table_has_rows(tabela):
+    with get_db_connection() as conn:
+        return conn.execute(f"SELECT EXISTS (SELECT 1 FROM {tabela})").fetchone()[0] == 1
 
+# Usuários e lojas ficam sempre no banco principal, qualquer que seja a loja da sessão
+@cached_query('usuarios', central=True)
 def get_all_users():
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM usuarios", conn)
-    conn.close()
+    with get_db_connection(DB_FILE) as conn:
+        df = pd.read_sql_query("SELECT * FROM usuarios", conn)
     return df
 
 def get_user(user_id):
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM usuarios WHERE id_usuario = ?", conn, params=(user_id,))
-    conn.close()
-    return df.iloc[0] if not df.empty else None
+    # Sem pandas: a tela de login não deve carregá-lo
+    with get_db_connection(DB_FILE) as conn:
+        cursor = conn.execute("SELECT * FROM usuarios WHERE id_usuario = ?", (user_id,))
+        row = cursor.fetchone()
+    return dict(zip([col[0] for col in cursor.description], row)) if row is not None else None
 
-def save_user(user_id, nome, tipo, senha):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO usuarios (id_usuario, nome_usuario, tipo_acesso, senha) VALUES (?, ?, ?, ?)", (user_id, nome, tipo, senha))
-    conn.commit()
-    conn.close()
+def save_user(user_id, nome, tipo, senha, id_loja=None):
+    with get_db_connection(DB_FILE) as conn:
+        conn.execute("INSERT OR REPLACE INTO usuarios (id_usuario, nome_usuario, tipo_acesso, senha, id_loja) VALUES (?, ?, ?, ?, ?)",
+                     (user_id, nome, tipo, senha, id_loja))
+        _bump_versao(conn, 'usuarios')
 
 def delete_user(user_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM usuarios WHERE id_usuario = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with get_db_connection(DB_FILE) as conn:
+        conn.execute("DELETE FROM usuarios WHERE id_usuario = ?", (user_id,))
+        _bump_versao(conn, 'usuarios')
+
+# --- Lojas (um banco por loja) ---
+# O banco principal (DB_FILE) guarda o cadastro de lojas e de usuários; os
+# recebimentos, auditorias e produtos de cada loja ficam no arquivo dela, com
+# pool, caches e fila de gravação próprios, criados só quando a loja é usada.
+# Usuário sem loja trabalha no banco principal, como antes das lojas.
+LOJA_PRINCIPAL = "Loja principal"
+
+@cached_query('lojas', central=True)
+def get_lojas():
+    with get_db_connection(DB_FILE) as conn:
+        return conn.execute("SELECT id_loja, nome_loja, arquivo FROM lojas ORDER BY nome_loja").fetchall()
+
+def get_loja(id_loja):
+    return next((loja for loja in get_lojas() if loja[0] == id_loja), None)
+
+def _caminho_loja(arquivo):
+    # Caminhos relativos partem da pasta do banco principal
+    return os.path.join(os.path.dirname(DB_FILE), arquivo)
+
+def save_loja(id_loja, nome, arquivo):
+    # Só arquivos dentro da pasta do banco principal: o nome vem de um formulário
+    if not arquivo or os.path.isabs(arquivo) or '..' in re.split(r'[\\/]', arquivo):
+        raise ValueError("Informe o arquivo da loja relativo à pasta do banco principal, sem '..'.")
+    arquivo = os.path.normpath(arquivo)
+    if os.path.abspath(_caminho_loja(arquivo)) == os.path.abspath(DB_FILE):
+        raise ValueError("O banco principal não pode ser o arquivo de uma loja.")
+    try:
+        with get_db_connection(DB_FILE) as conn:
+            # Upsert em vez de OR REPLACE: um arquivo repetido não pode apagar a outra loja
+            conn.execute("""
+                INSERT INTO lojas (id_loja, nome_loja, arquivo) VALUES (?, ?, ?)
+                ON CONFLICT (id_loja) DO UPDATE SET nome_loja = excluded.nome_loja, arquivo = excluded.arquivo
+            """, (id_loja, nome, arquivo))
+            _bump_versao(conn, 'lojas')
+    except sqlite3.IntegrityError:
+        raise ValueError(f"O arquivo {arquivo} já é o banco de outra loja.")
+
+def _nome_loja(id_loja):
+    loja = get_loja(id_loja) if id_loja else None
+    return loja[1] if loja else LOJA_PRINCIPAL
+
+def _abrir_loja(id_loja):
+    # Aponta a sessão para o banco da loja (None = banco principal)
+    loja = get_loja(id_loja) if id_loja else None
+    st.session_state.id_loja = loja[0] if loja else None
+    st.session_state.db_file = _caminho_loja(loja[2]) if loja else DB_FILE
+    ensure_schema(st.session_state.db_file)
+
+# Chaves que sobrevivem à troca de loja; o resto da sessão (lote, paginação,
+# filtros, relatório gerado) pertence à loja anterior
+SESSAO_LOGIN = ('logged_in', 'user_role', 'user_id', 'loja_selecionada')
+
+def _trocar_loja():
+    for chave in [chave for chave in st.session_state if chave not in SESSAO_LOGIN]:
+        del st.session_state[chave]
+    _abrir_loja(st.session_state.loja_selecionada)
 
 # --- Funções de Interface do Usuário (UI) ---
+@instrumented_page
 def login_page():
     st.sidebar.image("logo.png", width=150)
     st.sidebar.title("Login")
@@ -189,13 +2720,16 @@ def login_page():
     
     if st.sidebar.button("Entrar"):
         user = get_user(username)
-        if user is not None and user['senha'] == password:
+        if user is None or user['senha'] != password:
+            st.sidebar.error("Usuário ou senha incorretos.")
+        elif user['id_loja'] and get_loja(user['id_loja']) is None:
+            st.sidebar.error(f"A loja {user['id_loja']} deste usuário não está cadastrada.")
+        else:
+            _abrir_loja(user['id_loja'])
             st.session_state.logged_in = True
             st.session_state.user_role = user['tipo_acesso']
             st.session_state.user_id = user['id_usuario']
             st.rerun()
-        else:
-            st.sidebar.error("Usuário ou senha incorretos.")
 
 def main_app():
     st.sidebar.image("logo.png", width=150)
@@ -205,16 +2739,39 @@ def main_app():
     menu_items = {
         "Conferente": ["Recebimento"],
         "Prevenção": ["Auditoria", "Divergentes"],
-        "Gestor": ["Recebimento", "Auditoria", "Divergentes", "Relatórios", "Gestão de Usuários"],
+        "Gestor": ["Recebimento", "Auditoria", "Divergentes", "Relatórios", "Consolidado", "Gestão de Usuários", "Desempenho"],
     }
     
     current_role = st.session_state.user_role
+    # O Gestor pode trabalhar em qualquer loja; os demais, só na sua
+    lojas = get_lojas()
+    if current_role == 'Gestor' and lojas:
+        opcoes = [None] + [loja[0] for loja in lojas]
+        id_loja = st.session_state.get('id_loja')
+        st.sidebar.selectbox("Loja", opcoes, index=opcoes.index(id_loja) if id_loja in opcoes else 0,
+                             format_func=_nome_loja, key='loja_selecionada', on_change=_trocar_loja)
+    elif lojas:
+        st.sidebar.markdown(f"**Loja:** {_nome_loja(st.session_state.get('id_loja'))}")
     selected_page = st.sidebar.radio("Navegação", menu_items.get(current_role, []))
+
+    if current_role == 'Gestor':
+        pool_stats = get_connection_pool(current_db_file()).stats()
+        st.sidebar.caption(f"Conexões com o banco: {pool_stats['open']} abertas, "
+                           f"{pool_stats['in_use']} em uso, {pool_stats['reused']} reutilizações")
+        cache_stats = get_query_cache(current_db_file()).stats()
+        st.sidebar.caption(f"Cache de consultas: {cache_stats['hit_rate']:.0%} de acertos, "
+                           f"{cache_stats['entries']} entradas")
+        if WRITE_BEHIND_ENABLED:
+            fila_stats = get_write_behind_queue(current_db_file()).stats()
+            st.sidebar.caption(f"Fila de gravação: {fila_stats['depth']} pendentes, "
+                               f"commit médio {fila_stats['commit_ms_avg']:.1f} ms (p95 {fila_stats['commit_ms_p95']:.1f} ms)")
     
     if st.sidebar.button("Sair"):
         st.session_state.logged_in = False
         st.session_state.user_role = None
         st.session_state.user_id = None
+        for chave in ('id_loja', 'db_file', 'loja_selecionada'):
+            st.session_state.pop(chave, None)
         st.rerun()
 
     st.title("Sistema de Gestão de Recebimentos 📦")
@@ -229,56 +2786,105 @@ def main_app():
         show_divergentes_page()
     elif selected_page == "Relatórios":
         show_relatorios_page()
+    elif selected_page == "Consolidado":
+        show_consolidado_page()
     elif selected_page == "Gestão de Usuários":
         show_gestao_usuarios_page()
+    elif selected_page == "Desempenho":
+        show_desempenho_page()
 
+@instrumented_page
 def show_recebimento_page():
     st.header("Coleta de Recebimento")
     
-    st.subheader("Subir Base de Produtos (Excel)")
-    uploaded_file = st.file_uploader("Escolha um arquivo Excel", type=["xlsx", "xls"])
-    if uploaded_file is not None:
-        try:
-            df = pd.read_excel(uploaded_file)
-            conn = get_db_connection()
-            df = df.rename(columns={
-                'codigo': 'codigo_produto',
-                'descricao': 'descricao_produto',
-                'secao': 'secao_produto'
-            })
-            df.to_sql('produtos', conn, if_exists='replace', index=False)
-            conn.close()
-            st.success("Base de produtos carregada com sucesso!")
-        except Exception as e:
-            st.error(f"Erro ao ler o arquivo: {e}")
+    # Cada bloco interativo é um fragmento: uma interação reexecuta só o seu
+    # bloco, e não init_db, a barra lateral, o upload e o histórico.
+    show_importacao_catalogo()
+    st.markdown("---")
+
+    show_lancamento_recebimento()
     st.markdown("---")
+    show_historico_recebimentos()
+
+@st.fragment
+def show_lancamento_recebimento():
+    # Modo lote: os itens vão para um buffer na sessão e são gravados juntos,
+    # numa transação. Formulário, produto e lote ficam neste fragmento: adicionar
+    # um item reexecuta só ele; a página inteira (com o histórico) só roda de
+    # novo quando algo é gravado.
+    if st.session_state.pop('recebimento_gravado', False):
+        st.rerun()
+    modo_lote = st.toggle("Modo lote (conferir vários itens e confirmar de uma vez)", key="modo_lote")
+    if 'lote_recebimento' not in st.session_state:
+        st.session_state.lote_recebimento = []
+
+    show_produto_info()
 
     col1, col2 = st.columns([1, 1])
 
     with col1:
-        st.subheader("Lançamento de Produto")
         with st.form("form_recebimento", clear_on_submit=True):
-            codigo = st.text_input("Código do Produto", key="codigo_input").strip()
-            
-            with st.expander("Calculadora rápida"):
-                expr = st.text_input("Insira uma expressão matemática (ex: 25+25)", key="calc_input")
-                if expr:
-                    try:
-                        result = eval(expr)
-                        st.info(f"Resultado: {result}")
-                    except:
-                        st.error("Expressão inválida.")
-
-            quantidade = st.number_input("Quantidade", value=0.0, format="%.2f", min_value=0.0)
-            condicao = st.radio("Condição do Produto", ('Bom', 'Ruim'))
-            foto_evidencia = None
+            st.number_input("Quantidade", value=0.0, format="%.2f", min_value=0.0, key="quantidade_input")
+            condicao = st.radio("Condição do Produto", ('Bom', 'Ruim'), key="condicao_input")
             if condicao == 'Ruim':
-                uploaded_photo = st.camera_input("Tire uma foto do produto")
-                if uploaded_photo:
-                    foto_evidencia = base64.b64encode(uploaded_photo.read()).decode()
+                st.camera_input("Tire uma foto do produto", key="foto_input")
             
-            submit_button = st.form_submit_button("Registrar Recebimento")
-    
+            st.form_submit_button("Adicionar ao Lote" if modo_lote else "Registrar Recebimento",
+                                  on_click=_registrar_recebimento, args=(modo_lote,))
+
+    with col2:
+        show_calculadora()
+
+    mensagem = st.session_state.pop('recebimento_msg', None)
+    if mensagem:
+        if modo_lote:
+            st.toast(mensagem)
+        else:
+            st.success(mensagem)
+
+    if modo_lote or st.session_state.lote_recebimento:
+        st.markdown("---")
+        show_lote_recebimento()
+
+@st.fragment
+def show_importacao_catalogo():
+    st.subheader("Subir Base de Produtos (Excel)")
+    uploaded_file = st.file_uploader("Escolha um arquivo Excel ou CSV", type=["xlsx", "csv"])
+    if uploaded_file is not None:
+        # O arquivo continua no uploader entre reruns: importa só uma vez por upload
+        if st.session_state.get('catalogo_file_id') != uploaded_file.file_id:
+            try:
+                st.session_state.catalogo_resultado = import_catalogo(uploaded_file.name, uploaded_file.getvalue())
+                st.session_state.catalogo_file_id = uploaded_file.file_id
+            except Exception as e:
+                st.session_state.catalogo_resultado = None
+                st.error(f"Erro ao ler o arquivo: {e}")
+        resultado = st.session_state.get('catalogo_resultado')
+        if resultado and resultado['ja_importado']:
+            st.info(f"Este arquivo já foi importado em {resultado['importado_em']}. Nada a fazer.")
+        elif resultado:
+            st.success(
+                f"Base de produtos carregada com sucesso! {resultado['inseridos']} novos, "
+                f"{resultado['atualizados']} atualizados, {resultado['inalterados']} sem alteração "
+                f"({resultado['segundos']:.2f}s)."
+            )
+
+@st.fragment
+def show_produto_info():
+    col1, col2 = st.columns([1, 1])
+
+    with col1:
+        st.subheader("Lançamento de Produto")
+        codigo = st.text_input("Código do Produto", key="codigo_input").strip()
+        busca = st.text_input("Sem código? Buscar pela descrição ou seção", key="busca_produto_input",
+                              placeholder="ex.: banana prata, flv")
+        if busca.strip():
+            resultados = search_products(busca)
+            if resultados:
+                _escolher_produto(resultados, "busca_produto_resultado")
+            else:
+                st.caption("Nenhum produto encontrado.")
+
     with col2:
         st.subheader("Informações do Produto")
         if codigo:
@@ -289,116 +2895,265 @@ def show_recebimento_page():
                 st.write(f"**Seção:** {prod_info['secao_produto']}")
             else:
                 st.warning("Produto não encontrado na base. Por favor, digite as informações manualmente.")
+                sugestoes = search_products_by_prefix(codigo)
+                if sugestoes:
+                    st.caption("Códigos que começam com o valor digitado:")
+                    st.dataframe(pd.DataFrame(sugestoes), hide_index=True)
                 descricao_manual = st.text_input("Descrição (manual)")
                 secao_manual = st.text_input("Seção (manual)")
                 if descricao_manual and secao_manual:
-                    conn = get_db_connection()
-                    c = conn.cursor()
-                    c.execute("INSERT INTO produtos VALUES (?, ?, ?)", (codigo, descricao_manual, secao_manual))
-                    conn.commit()
-                    conn.close()
-                    st.success("Produto adicionado à base.")
-
-    if submit_button:
-        if codigo and quantidade > 0:
-            now = datetime.datetime.now(brasilia_tz) 
-            data_recebimento = now.strftime('%d/%m/%Y %H:%M')
-            dia_semana_ingles = now.strftime('%A')
-            dia_semana_br = dias_semana.get(dia_semana_ingles, dia_semana_ingles)
-            
-            reception_data = {
-                'codigo_produto': codigo,
-                'quantidade_recebida': quantidade,
-                'condicao_produto': condicao,
-                'data_recebimento': data_recebimento,
-                'dia_semana': dia_semana_br,
-                'hora_recebimento': now.strftime('%H:%M'),
-                'foto_evidencia': foto_evidencia,
-                'conferente': st.session_state.user_id
-            }
-            save_reception(reception_data)
-            st.success("Recebimento registrado com sucesso!")
-            st.rerun()
+                    # Antes de cadastrar, mostra produtos parecidos para evitar duplicatas
+                    parecidos = search_products(descricao_manual)
+                    if parecidos:
+                        st.caption("Produtos parecidos já cadastrados:")
+                        _escolher_produto(parecidos, "produto_parecido")
+                    if not parecidos or st.button("Não é nenhum destes: cadastrar novo produto"):
+                        save_produto(codigo, descricao_manual, secao_manual)
+                        st.success("Produto adicionado à base.")
 
-    st.markdown("---")
-    st.subheader("Histórico de Recebimentos")
-    conn = get_db_connection()
-    recebimentos_df = pd.read_sql_query("SELECT * FROM recebimentos", conn)
-    produtos_df = pd.read_sql_query("SELECT * FROM produtos", conn)
-    conn.close()
-
-    if not recebimentos_df.empty:
-        df_display = recebimentos_df.merge(produtos_df, on='codigo_produto', how='left')
-        st.dataframe(df_display.drop(columns=['foto_evidencia']))
+def _usar_produto(codigo):
+    # Callback: roda antes de o campo de código ser recriado no próximo rerun
+    st.session_state.codigo_input = codigo
+    st.session_state.busca_produto_input = ""
+
+def _escolher_produto(produtos, key):
+    opcoes = {f"{p['codigo_produto']} — {p['descricao_produto']} ({p['secao_produto']})": p['codigo_produto'] for p in produtos}
+    escolhido = st.selectbox("Produtos encontrados", list(opcoes), key=key)
+    st.button("Usar este produto", key=f"{key}_usar", on_click=_usar_produto, args=(opcoes[escolhido],))
+
+@st.fragment
+def show_calculadora():
+    with st.expander("Calculadora rápida"):
+        expr = st.text_input("Insira uma expressão matemática (ex: 25+25)", key="calc_input")
+        if expr:
+            try:
+                result = eval(expr)
+                st.info(f"Resultado: {result}")
+            except:
+                st.error("Expressão inválida.")
+
+def _registrar_recebimento(modo_lote):
+    # Callback do formulário: roda antes do rerun, lendo os valores pela sessão
+    codigo = st.session_state.get('codigo_input', '').strip()
+    quantidade = st.session_state.get('quantidade_input') or 0.0
+    condicao = st.session_state.get('condicao_input', 'Bom')
+    uploaded_photo = st.session_state.get('foto_input') if condicao == 'Ruim' else None
+    if not (codigo and quantidade > 0):
+        return
+
+    now = datetime.datetime.now(brasilia_tz) 
+    data_recebimento = now.strftime('%d/%m/%Y %H:%M')
+    dia_semana_ingles = now.strftime('%A')
+    dia_semana_br = dias_semana.get(dia_semana_ingles, dia_semana_ingles)
+    
+    reception_data = {
+        'codigo_produto': codigo,
+        'quantidade_recebida': quantidade,
+        'condicao_produto': condicao,
+        'data_recebimento': data_recebimento,
+        'dia_semana': dia_semana_br,
+        'hora_recebimento': now.strftime('%H:%M'),
+        'foto_evidencia': uploaded_photo.getvalue() if uploaded_photo else None,
+        'conferente': st.session_state.user_id
+    }
+    if modo_lote:
+        _adicionar_item_lote(reception_data)
+        st.session_state.recebimento_msg = f"Item {codigo} adicionado ao lote."
     else:
+        save_reception(reception_data)
+        st.session_state.recebimento_msg = "Recebimento registrado com sucesso!"
+        # O callback não pode pedir rerun: o fragmento pede o da página (histórico)
+        st.session_state.recebimento_gravado = True
+    st.session_state.codigo_input = ""
+
+def _adicionar_item_lote(reception_data):
+    lote = st.session_state.lote_recebimento
+    item_id = max((item['item_id'] for item in lote), default=0) + 1
+    lote.append(dict(reception_data, item_id=item_id))
+
+def _limpar_lote():
+    st.session_state.lote_recebimento = []
+    st.session_state.pop('lote_editor', None)
+
+@st.fragment
+def show_lote_recebimento():
+    lote = st.session_state.lote_recebimento
+    st.subheader(f"Lote em Conferência ({len(lote)} itens)")
+    if not lote:
+        st.info("Nenhum item no lote. Use o formulário acima para adicionar itens.")
+        return
+
+    produtos = {item['codigo_produto']: get_product_info(item['codigo_produto']) for item in lote}
+    df_lote = pd.DataFrame({
+        'codigo_produto': [item['codigo_produto'] for item in lote],
+        'descricao_produto': [(produtos[item['codigo_produto']] or {}).get('descricao_produto') for item in lote],
+        'quantidade_recebida': [item['quantidade_recebida'] for item in lote],
+        'condicao_produto': [item['condicao_produto'] for item in lote],
+        'foto': [bool(item['foto_evidencia']) for item in lote],
+        'hora_recebimento': [item['hora_recebimento'] for item in lote],
+        'remover': False,
+    }, index=pd.Index([item['item_id'] for item in lote], name='item'))
+
+    # Quantidade e condição podem ser corrigidas; os itens marcados em "Remover"
+    # não são gravados. Linhas fixas: uma linha nova não teria item no lote.
+    df_editado = st.data_editor(
+        df_lote,
+        key="lote_editor",
+        num_rows="fixed",
+        disabled=['codigo_produto', 'descricao_produto', 'foto', 'hora_recebimento'],
+        column_config={
+            'quantidade_recebida': st.column_config.NumberColumn("Quantidade", min_value=0.0, format="%.2f"),
+            'condicao_produto': st.column_config.SelectboxColumn("Condição", options=['Bom', 'Ruim'], required=True),
+            'remover': st.column_config.CheckboxColumn("Remover"),
+        },
+    )
+    df_editado = df_editado[~df_editado['remover'].astype(bool)]
+
+    col_confirmar, col_descartar = st.columns(2)
+    with col_confirmar:
+        confirmar = st.button(f"Confirmar Lote ({len(df_editado)} itens)", type="primary")
+    with col_descartar:
+        st.button("Descartar Lote", on_click=_limpar_lote)
+
+    if confirmar:
+        itens_por_id = {item['item_id']: item for item in lote}
+        itens = [dict(itens_por_id[item_id],
+                      quantidade_recebida=float(row['quantidade_recebida'] or 0),
+                      condicao_produto=row['condicao_produto'])
+                 for item_id, row in df_editado.iterrows()]
+        if not itens:
+            st.error("O lote está vazio.")
+        elif any(item['quantidade_recebida'] <= 0 for item in itens):
+            st.error("Todos os itens do lote precisam ter quantidade maior que zero.")
+        else:
+            try:
+                save_receptions(itens)
+            except Exception as e:
+                st.error(f"Falha ao gravar o lote; nenhum item foi registrado. Detalhe: {e}")
+            else:
+                _limpar_lote()
+                st.success(f"Lote com {len(itens)} recebimentos registrado com sucesso!")
+                st.rerun()
+
+def _reset_historico_recebimentos():
+    st.session_state.hist_receb = {'paginas': [], 'ultimo_id': None, 'topo': None, 'fim': False}
+
+def _carregar_mais_historico():
+    hist = st.session_state.hist_receb
+    pagina = get_historico_recebimentos(before_id=hist['ultimo_id'])
+    hist['paginas'].append(pagina)
+    hist['fim'] = len(pagina) < HISTORICO_PAGE_SIZE
+
+@st.fragment
+def show_historico_recebimentos():
+    st.subheader("Histórico de Recebimentos")
+    if 'hist_receb' not in st.session_state:
+        _reset_historico_recebimentos()
+    hist = st.session_state.hist_receb
+
+    ir_para_data = st.date_input("Ir para data", value=None, key="hist_receb_data", on_change=_reset_historico_recebimentos)
+    before_id = get_historico_cursor_para_data(ir_para_data) if ir_para_data else None
+
+    # Sem páginas extras, a primeira é sempre relida (mostra os lançamentos novos).
+    # Depois de "Carregar mais" ela fica presa ao maior id daquele momento: se
+    # acompanhasse os novos, as linhas empurradas para fora dela sumiriam da
+    # lista, pois as páginas seguintes (na sessão) começam num id já fixado.
+    if hist['paginas'] and hist['topo'] is not None:
+        if before_id is None:
+            novos = get_historico_recebimentos(limit=1)
+            if not novos.empty and int(novos['id_recebimento'].iloc[0]) > hist['topo']:
+                st.caption("Há recebimentos novos desde que a lista foi carregada.")
+                st.button("Mostrar os mais recentes", key="hist_receb_novos", on_click=_reset_historico_recebimentos)
+        before_id = hist['topo'] + 1 if before_id is None else before_id
+    primeira_pagina = get_historico_recebimentos(before_id=before_id)
+    if primeira_pagina.empty:
         st.info("Nenhum recebimento registrado.")
+        return
+    if not hist['paginas']:
+        hist['fim'] = len(primeira_pagina) < HISTORICO_PAGE_SIZE
+        hist['topo'] = int(primeira_pagina['id_recebimento'].max())
+
+    df_display = concat_frames([primeira_pagina] + hist['paginas'])
+    hist['ultimo_id'] = int(df_display['id_recebimento'].min())
+    st.dataframe(df_display, hide_index=True)
+    st.caption(f"{len(df_display)} recebimentos exibidos, do mais recente para o mais antigo.")
+    if not hist['fim']:
+        st.button("Carregar mais", key="hist_receb_mais", on_click=_carregar_mais_historico)
 
+@instrumented_page
 def show_auditoria_page():
     st.header("Auditoria de Recebimentos")
 
+    show_historico_auditorias()
+    
+    st.markdown("---")
+    
+    show_pendentes_auditoria()
+
+    st.markdown("---")
+
+    show_auditoria_em_lote()
+
+@st.fragment
+def show_historico_auditorias():
     # --- SEÇÃO DE HISTÓRICO DE AUDITORIAS (continua igual) ---
     st.subheader("Histórico de Auditorias Realizadas")
-    conn = get_db_connection()
-    df_auditorias_hist = pd.read_sql_query("SELECT * FROM auditorias", conn)
-    produtos_df_hist = pd.read_sql_query("SELECT * FROM produtos", conn)
-    conn.close()
-
-    if df_auditorias_hist.empty:
+    if not table_has_rows('auditorias') and not table_has_rows('arquivos_mensais'):
         st.info("Nenhuma auditoria foi registrada ainda.")
     else:
-        df_auditorias_hist = df_auditorias_hist.merge(produtos_df_hist[['codigo_produto', 'descricao_produto']], on='codigo_produto', how='left')
-        df_auditorias_hist['data_auditoria_dt'] = pd.to_datetime(df_auditorias_hist['data_auditoria'], format='%d/%m/%Y %H:%M')
-
         start_date_hist = st.date_input("Data de Início", value=None, key="audit_start_date")
         end_date_hist = st.date_input("Data de Fim", value=None, key="audit_end_date")
 
-        df_filtered_hist = df_auditorias_hist.copy()
-        if start_date_hist:
-            df_filtered_hist = df_filtered_hist[df_filtered_hist['data_auditoria_dt'].dt.date >= start_date_hist]
-        if end_date_hist:
-            df_filtered_hist = df_filtered_hist[df_filtered_hist['data_auditoria_dt'].dt.date <= end_date_hist]
-        
-        st.dataframe(df_filtered_hist.drop(columns=['data_auditoria_dt']))
-    
-    st.markdown("---")
-    
+        # O filtro de datas roda no SQL, usando o índice em ts_auditoria
+        df_filtered_hist = get_auditorias_historico(start_date_hist, end_date_hist)
+        st.dataframe(df_filtered_hist)
+
+@st.fragment
+def show_pendentes_auditoria():
     # --- SEÇÃO DE REGISTRO DE NOVA AUDITORIA (aqui faremos a mudança) ---
     st.subheader("Registrar Nova Auditoria (Produtos Pendentes)")
 
-    consolidado = get_consolidated_recebimentos()
-    
-    conn = get_db_connection()
-    produtos_df = pd.read_sql_query("SELECT * FROM produtos", conn)
-    # MUDANÇA 1: Pegar a lista de produtos que JÁ FORAM auditados
-    df_produtos_auditados = pd.read_sql_query("SELECT DISTINCT codigo_produto FROM auditorias", conn)
-    conn.close()
-
-    if not consolidado.empty:
-        consolidado = consolidado.merge(produtos_df, on='codigo_produto', how='left')
-
-        # MUDANÇA 2: Remover os produtos já auditados da lista de pendentes
-        produtos_auditados_lista = df_produtos_auditados['codigo_produto'].tolist()
-        consolidado_pendente = consolidado[~consolidado['codigo_produto'].isin(produtos_auditados_lista)]
-    else:
-        consolidado_pendente = pd.DataFrame() # Cria um dataframe vazio se não houver nada
+    # Pendentes = recebidos sem nenhuma auditoria, calculado no SQL a partir
+    # dos totais mantidos na gravação; a lista vem paginada e filtrável.
+    if count_pendentes_auditoria() == 0:
+        st.success("🎉 Todos os produtos recebidos já foram auditados!")
+        return
 
-    # A partir daqui, usamos o `consolidado_pendente` em vez do `consolidado`
+    busca = st.text_input("Buscar produto (código ou descrição)", key="audit_busca", on_change=_reset_pendentes_paginacao).strip()
+    if 'audit_cursores' not in st.session_state:
+        _reset_pendentes_paginacao()
+    cursores = st.session_state.audit_cursores
+
+    consolidado_pendente = get_pendentes_auditoria(busca, cursores[-1], AUDITORIA_PAGE_SIZE + 1)
+    tem_proxima = len(consolidado_pendente) > AUDITORIA_PAGE_SIZE
+    consolidado_pendente = consolidado_pendente.head(AUDITORIA_PAGE_SIZE)
     if consolidado_pendente.empty:
-        st.success("🎉 Todos os produtos recebidos já foram auditados!")
+        st.info("Nenhum produto pendente encontrado para a busca.")
         return
-        
-    opcoes_produtos = consolidado_pendente['codigo_produto'].tolist()
-    
+
+    total_pendentes = count_pendentes_auditoria(busca)
+    pagina = len(cursores)
+    col_ant, col_info, col_prox = st.columns([1, 2, 1])
+    with col_ant:
+        st.button("◀ Anterior", key="audit_pag_anterior", disabled=pagina == 1, on_click=_pendentes_pagina_anterior)
+    with col_info:
+        st.caption(f"Página {pagina} · {total_pendentes} produtos pendentes")
+    with col_prox:
+        st.button("Próxima ▶", key="audit_pag_proxima", disabled=not tem_proxima,
+                  on_click=_pendentes_pagina_proxima, args=(consolidado_pendente['codigo_produto'].iloc[-1],))
+
+    codigos = consolidado_pendente['codigo_produto'].tolist()
+    descricoes = dict(zip(codigos, consolidado_pendente['descricao_produto']))
     prod_audit = st.selectbox(
         "Selecione o Produto para Auditar",
-        opcoes_produtos,
+        codigos,
+        format_func=lambda codigo: f"{codigo} — {descricoes[codigo]}" if pd.notna(descricoes.get(codigo)) else codigo,
         key="prod_audit_selectbox"
     )
     
     quant_receb = 0
     if prod_audit:
-        # Usamos o consolidado_pendente para pegar a quantidade
-        quant_receb = consolidado_pendente[consolidado_pendente['codigo_produto'] == prod_audit]['quantidade_total_recebida'].iloc[0]
+        quant_receb = consolidado_pendente['quantidade_total_recebida'].iloc[codigos.index(prod_audit)]
     
     st.metric("Quantidade Total Recebida (Coletada)", f"{quant_receb:.2f}")
 
@@ -408,7 +3163,7 @@ def show_auditoria_page():
 
     if submit_audit:
         if prod_audit and quant_sistema >= 0:
-            divergencia = quant_receb - quant_sistema
+            divergencia = calcular_divergencia(quant_receb, quant_sistema)
             status = "Aberta" if divergencia != 0 else "Solucionada"
             
             now = datetime.datetime.now(brasilia_tz)
@@ -431,128 +3186,340 @@ def show_auditoria_page():
             st.error("Por favor, selecione um produto e insira a quantidade do sistema.")
 
 
-def show_divergentes_page():
-    st.header("Divergências Encontradas")
+def _reset_pendentes_paginacao():
+    st.session_state.audit_cursores = [None]
+
+def _pendentes_pagina_proxima(ultimo_codigo):
+    st.session_state.audit_cursores.append(ultimo_codigo)
+
+def _pendentes_pagina_anterior():
+    if len(st.session_state.audit_cursores) > 1:
+        st.session_state.audit_cursores.pop()
+
+@st.fragment
+def show_auditoria_em_lote():
+    st.subheader("Auditoria em Lote (Estoque do ERP)")
+    uploaded_file = st.file_uploader("Arquivo do ERP com código e quantidade do sistema (Excel ou CSV)",
+                                     type=["xlsx", "csv"], key="audit_lote_arquivo")
+    if uploaded_file is None:
+        return
+    # Lê o arquivo uma vez por upload; a conciliação é refeita a cada rerun
+    # contra os pendentes atuais (consulta em cache)
+    if st.session_state.get('audit_lote_file_id') != uploaded_file.file_id:
+        try:
+            estoque, invalidas = read_estoque_erp(uploaded_file.name, uploaded_file.getvalue())
+            st.session_state.audit_lote = {'estoque': estoque, 'invalidas': invalidas, 'resultado': None}
+        except Exception as e:
+            st.session_state.audit_lote = None
+            st.error(f"Erro ao ler o arquivo: {e}")
+        st.session_state.audit_lote_file_id = uploaded_file.file_id
+    lote = st.session_state.get('audit_lote')
+    if not lote:
+        return
+
+    resultado = lote['resultado']
+    if resultado:
+        st.success(f"{resultado['gravadas']} auditorias registradas em {resultado['segundos']:.2f}s "
+                   f"({resultado['divergentes']} com divergência).")
+        if resultado['gravadas'] < resultado['enviadas']:
+            st.warning(f"{resultado['enviadas'] - resultado['gravadas']} produtos já tinham sido auditados por outra pessoa.")
+        st.download_button("Baixar resumo de divergências (CSV)", resultado['resumo'],
+                           file_name="divergencias_auditoria_lote.csv", mime="text/csv")
+        return
 
-    conn = get_db_connection()
-    df_auditorias = pd.read_sql_query("SELECT * FROM auditorias", conn)
-    df_recebimentos = pd.read_sql_query("SELECT * FROM recebimentos", conn)
-    df_produtos = pd.read_sql_query("SELECT * FROM produtos", conn)
-    conn.close()
+    reconciliacao = reconcile_auditorias(lote['estoque'])
+    conciliacao = reconciliacao['conciliacao']
+    divergentes = int((conciliacao['quantidade_divergente'] != 0).sum())
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Produtos a auditar", len(conciliacao))
+    col2.metric("Com divergência", divergentes)
+    col3.metric("Pendentes fora do arquivo", reconciliacao['pendentes_fora_do_arquivo'])
+    col4.metric("Linhas ignoradas", reconciliacao['ignorados'] + lote['invalidas'],
+                help="Códigos já auditados, nunca recebidos ou sem quantidade válida.")
+    if conciliacao.empty:
+        st.info("Nenhum produto pendente de auditoria aparece no arquivo.")
+        return
+
+    st.dataframe(conciliacao, hide_index=True, column_config={
+        'codigo_produto': "Código",
+        'descricao_produto': "Descrição",
+        'secao_produto': "Seção",
+        'quantidade_total_recebida': st.column_config.NumberColumn("Recebido", format="%.2f"),
+        'quantidade_sistema': st.column_config.NumberColumn("Sistema", format="%.2f"),
+        'quantidade_divergente': st.column_config.NumberColumn("Divergência", format="%.2f"),
+        'status_divergencia': "Status",
+    })
+    resumo = resumo_divergencias_csv(conciliacao)
+    col_confirmar, col_baixar = st.columns(2)
+    with col_baixar:
+        st.download_button("Baixar prévia das divergências (CSV)", resumo,
+                           file_name="divergencias_previa.csv", mime="text/csv")
+    with col_confirmar:
+        confirmar = st.button(f"Registrar {len(conciliacao)} auditorias", type="primary")
+    if confirmar:
+        data_auditoria = datetime.datetime.now(brasilia_tz).strftime('%d/%m/%Y %H:%M')
+        rows = conciliacao[['codigo_produto', 'quantidade_sistema', 'quantidade_divergente', 'status_divergencia']] \
+            .assign(data_auditoria=data_auditoria, auditor=st.session_state.user_id).to_dict('records')
+        inicio = time.perf_counter()
+        gravadas = save_audits(rows)
+        lote['resultado'] = {
+            'enviadas': len(rows),
+            'gravadas': gravadas,
+            'divergentes': divergentes,
+            'segundos': time.perf_counter() - inicio,
+            'resumo': resumo,
+        }
+        # Recarrega a página inteira: os produtos saem da lista de pendentes
+        st.rerun()
 
-    if not df_auditorias.empty:
-        df_auditorias['data_auditoria_dt'] = pd.to_datetime(df_auditorias['data_auditoria'], format='%d/%m/%Y %H:%M')
+@instrumented_page
+def show_divergentes_page():
+    st.header("Divergências Encontradas")
 
-    df_divergentes = df_auditorias[df_auditorias['status_divergencia'] != 'Solucionada']
-    if df_divergentes.empty:
+    date_range = get_divergencias_date_range()
+    if date_range is None:
         st.info("Nenhuma pendência em aberto.")
         return
     
-    df_divergentes = df_divergentes.merge(df_produtos[['codigo_produto', 'descricao_produto']], on='codigo_produto', how='left')
-    
     st.markdown("---")
+    show_pendencias_divergentes(*date_range)
+
+@st.fragment
+def show_pendencias_divergentes(min_date, max_date):
     st.subheader("Pendências Abertas")
     
     col1, col2 = st.columns(2)
     with col1:
-        status_filter = st.selectbox("Filtrar por Status", ["Todos"] + list(df_divergentes['status_divergencia'].unique()))
+        status_filter = st.selectbox("Filtrar por Status", ["Todos"] + STATUS_PENDENTES)
     with col2:
-        min_date = df_divergentes['data_auditoria_dt'].min().date() if not df_divergentes.empty else None
-        max_date = df_divergentes['data_auditoria_dt'].max().date() if not df_divergentes.empty else None
-        
         start_date = st.date_input("Data de Início", value=None, min_value=min_date, max_value=max_date, key="diverg_start_date")
         end_date = st.date_input("Data de Fim", value=None, min_value=min_date, max_value=max_date, key="diverg_end_date")
 
-    df_filtered = df_divergentes.copy()
-
-    if status_filter != "Todos":
-        df_filtered = df_filtered[df_filtered['status_divergencia'] == status_filter]
-    
-    if start_date:
-        df_filtered = df_filtered[df_filtered['data_auditoria_dt'].dt.date >= start_date]
-    
-    if end_date:
-        df_filtered = df_filtered[df_filtered['data_auditoria_dt'].dt.date <= end_date]
-
     if start_date and end_date and start_date > end_date:
         st.error("A data de início não pode ser maior que a data de fim.")
-        st.dataframe(pd.DataFrame()) 
+        df_filtered = pd.DataFrame()
+        st.dataframe(df_filtered)
     else:
-        st.dataframe(df_filtered.drop(columns=['data_auditoria_dt'])[['id_auditoria', 'codigo_produto', 'descricao_produto', 'quantidade_divergente', 'data_auditoria', 'auditor', 'status_divergencia']])
+        # Status e datas filtrados no SQL pelo índice (status_divergencia, ts_auditoria)
+        df_filtered = get_divergencias(None if status_filter == "Todos" else status_filter, start_date, end_date)
+        st.dataframe(df_filtered)
     
     st.markdown("---")
     st.subheader("Tratamento de Pendência")
 
     if not df_filtered.empty:
-        selected_audit = st.selectbox("Selecione a divergência para tratamento", df_filtered['id_auditoria'].tolist())
+        ids_auditoria = df_filtered['id_auditoria'].tolist()
+        selected_audit = st.selectbox("Selecione a divergência para tratamento", ids_auditoria)
         
         if selected_audit:
-            divergence_info = df_filtered[df_filtered['id_auditoria'] == selected_audit].iloc[0]
+            # Pela posição: uma máscara booleana copiaria o frame inteiro para achar uma linha
+            divergence_info = df_filtered.iloc[ids_auditoria.index(selected_audit)]
             st.write(f"**Produto:** {divergence_info['descricao_produto']}")
             st.write(f"**Divergência:** {divergence_info['quantidade_divergente']} unidades")
             st.write(f"**Status Atual:** {divergence_info['status_divergencia']}")
 
-            reception_record = df_recebimentos[df_recebimentos['codigo_produto'] == divergence_info['codigo_produto']]
-            if not reception_record.empty and reception_record['condicao_produto'].iloc[0] == 'Ruim' and reception_record['foto_evidencia'].iloc[0]:
+            reception_record = get_primeiro_recebimento(divergence_info['codigo_produto'])
+            if reception_record is not None and reception_record[0] == 'Ruim' and reception_record[1]:
+                # A foto só é lida do banco quando a divergência é aberta
                 st.subheader("Evidência Registrada")
-                image_bytes = base64.b64decode(reception_record['foto_evidencia'].iloc[0])
-                st.image(image_bytes, caption="Foto do produto ruim")
+                st.image(get_foto(reception_record[1], miniatura=True), caption="Foto do produto ruim")
+                if st.toggle("Ver foto em tamanho original"):
+                    st.image(get_foto(reception_record[1]))
 
-            new_status = st.radio("Mudar Status", ["Aberta", "Em tratamento", "Solucionada"], index=["Aberta", "Em tratamento", "Solucionada"].index(divergence_info['status_divergencia']))
+            new_status = st.radio("Mudar Status", STATUS_DIVERGENCIA, index=STATUS_DIVERGENCIA.index(divergence_info['status_divergencia']))
             
             if st.button("Atualizar Status"):
-                conn = get_db_connection()
-                c = conn.cursor()
-                c.execute("UPDATE auditorias SET status_divergencia = ? WHERE id_auditoria = ?", (new_status, int(selected_audit)))
-                conn.commit()
-                conn.close()
+                update_status_divergencia(selected_audit, new_status)
                 st.success("Status atualizado com sucesso!")
                 st.rerun()
     else:
         st.info("Nenhuma divergência encontrada para os filtros selecionados.")
 
+COLUNAS_RESUMO = {
+    'qtd_recebimentos': st.column_config.NumberColumn("Recebimentos"),
+    'quantidade_total': st.column_config.NumberColumn("Quantidade", format="%.2f"),
+    'qtd_ruim': st.column_config.NumberColumn("Itens 'Ruim'"),
+    'pct_ruim': st.column_config.NumberColumn("% 'Ruim'", format="%.1f%%"),
+}
+
+def _metricas_resumo(resumo):
+    total_recebimentos = int(resumo['qtd_recebimentos'].sum())
+    total_ruim = int(resumo['qtd_ruim'].sum())
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Recebimentos", f"{total_recebimentos:,}".replace(',', '.'))
+    col2.metric("Quantidade recebida", f"{resumo['quantidade_total'].sum():,.0f}".replace(',', '.'))
+    col3.metric("Itens 'Ruim'", f"{total_ruim:,}".replace(',', '.'))
+    col4.metric("% 'Ruim'", f"{100 * total_ruim / total_recebimentos:.1f}%")
+
+@instrumented_page
 def show_relatorios_page():
     st.header("Relatórios Detalhados")
     
-    conn = get_db_connection()
-    df_receb = pd.read_sql_query("SELECT * FROM recebimentos", conn)
-    conn.close()
-
-    if df_receb.empty:
+    if not table_has_rows('recebimentos') and not table_has_rows('arquivos_mensais'):
         st.info("Nenhum dado para gerar relatório.")
         return
-        
-    df_receb['data_recebimento_dt'] = pd.to_datetime(df_receb['data_recebimento'], format='%d/%m/%Y %H:%M')
     
     col1, col2 = st.columns(2)
     with col1:
-        recebedor_filter = st.selectbox("Filtrar por Recebedor", ["Todos"] + list(df_receb['conferente'].unique()))
+        recebedor_filter = st.selectbox("Filtrar por Recebedor", ["Todos"] + get_conferentes())
     with col2:
         start_date = st.date_input("Data de Início", value=None, key="rel_start_date")
         end_date = st.date_input("Data de Fim", value=None, key="rel_end_date")
 
-    df_filtered = df_receb.copy()
-    if recebedor_filter != "Todos":
-        df_filtered = df_filtered[df_filtered['conferente'] == recebedor_filter]
-    
-    if start_date and end_date:
-        df_filtered = df_filtered[(df_filtered['data_recebimento_dt'].dt.date >= start_date) & (df_filtered['data_recebimento_dt'].dt.date <= end_date)]
+    # Conferente e período filtrados no SQL (índice conferente, ts_recebimento)
+    conferente = None if recebedor_filter == "Todos" else recebedor_filter
+    periodo = (start_date, end_date) if start_date and end_date else (None, None)
+
+    st.markdown("---")
+    st.subheader("Resumo")
+    resumo_dia = get_resumo_recebimentos('dia', conferente, *periodo)
+    if resumo_dia.empty:
+        st.info("Nenhum recebimento no período.")
+    else:
+        _metricas_resumo(resumo_dia)
+
+        tab_dia, tab_conferente, tab_secao = st.tabs(["Por dia", "Por conferente", "Por seção"])
+        with tab_dia:
+            st.bar_chart(resumo_dia, x='dia', y='quantidade_total', x_label="Dia", y_label="Quantidade recebida")
+            st.line_chart(resumo_dia, x='dia', y='pct_ruim', x_label="Dia", y_label="% 'Ruim'")
+        with tab_conferente:
+            resumo_conferente = get_resumo_recebimentos('conferente', conferente, *periodo)
+            st.bar_chart(resumo_conferente, x='conferente', y='qtd_recebimentos', x_label="Conferente", y_label="Recebimentos")
+            st.dataframe(resumo_conferente, hide_index=True, column_config=dict(COLUNAS_RESUMO, conferente="Conferente"))
+        with tab_secao:
+            resumo_secao = get_resumo_recebimentos('secao', conferente, *periodo)
+            st.bar_chart(resumo_secao, x='secao_produto', y='quantidade_total', x_label="Seção", y_label="Quantidade recebida")
+            st.dataframe(resumo_secao, hide_index=True, column_config=dict(COLUNAS_RESUMO, secao_produto="Seção"))
+        if st.button("Recalcular resumos", help="Refaz os totais e o resumo diário a partir dos recebimentos "
+                                                  "(ex.: depois de mudar a seção de produtos)."):
+            with st.spinner("Recalculando..."):
+                rebuild_resumos()
+            st.rerun()
 
     st.markdown("---")
     st.subheader("Resultados")
-    st.dataframe(df_filtered.drop(columns=['foto_evidencia', 'data_recebimento_dt']))
+    # A tabela bruta só é lida quando pedida; os painéis acima usam o resumo
+    if st.toggle("Mostrar registros detalhados", key="rel_detalhes"):
+        # Coluna escondida pela configuração, sem copiar o frame para removê-la
+        st.dataframe(get_recebimentos_relatorio(conferente, *periodo), column_config={'foto_hash': None})
+        store = get_analytics_store(current_db_file()) if ANALYTICS_ENABLED else None
+        snapshot = store.status().get('recebimentos') if store else None
+        if snapshot:
+            criado_em = datetime.datetime.fromtimestamp(snapshot['criado_em'], brasilia_tz)
+            st.caption(f"Consulta no DuckDB sobre o snapshot de {criado_em.strftime('%d/%m/%Y %H:%M')}.")
 
-    excel_buffer = io.BytesIO()
-    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-        df_filtered.to_excel(writer, index=False, sheet_name='Relatório de Recebimentos')
-    
-    st.download_button(
-        label="Download Relatório (Excel)",
-        data=excel_buffer.getvalue(),
-        file_name='relatorio_recebimentos.xlsx',
-        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    st.markdown("---")
+    st.subheader("Exportar")
+    col1, col2 = st.columns(2)
+    with col1:
+        formato_label = st.selectbox("Formato", list(EXPORT_FORMATOS), key="rel_export_formato")
+    with col2:
+        incluir_fotos = st.checkbox("Incluir referência das fotos", value=False, key="rel_export_fotos")
+    formato, mime = EXPORT_FORMATOS[formato_label]
+
+    # O arquivo só é montado depois do clique; reruns seguintes reaproveitam o cache
+    export_params = (formato, conferente, start_date if start_date and end_date else None,
+                     end_date if start_date and end_date else None, incluir_fotos, get_data_version('recebimentos'),
+                     current_db_file())
+    if st.button("Gerar relatório"):
+        st.session_state.rel_export_params = export_params
+    if st.session_state.get('rel_export_params') == export_params:
+        try:
+            with st.spinner("Gerando arquivo..."):
+                arquivo = export_recebimentos(*export_params)
+        except RuntimeError as e:
+            st.error(str(e))
+        else:
+            st.download_button(
+                label=f"Download Relatório ({formato_label})",
+                data=arquivo,
+                file_name=f'relatorio_recebimentos.{formato}',
+                mime=mime
+            )
+
+    st.markdown("---")
+    show_arquivo_historico()
+
+@st.fragment
+def show_arquivo_historico():
+    st.subheader("Arquivo Histórico")
+    status = get_arquivo_status(_limite_arquivo())
+    arquivados = status['arquivados']
+    formatar_mes = lambda mes: f"{mes[5:]}/{mes[:4]}"
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Meses arquivados", len(arquivados))
+    col2.metric("Recebimentos arquivados", f"{int(arquivados['recebimentos'].sum()):,}".replace(',', '.'))
+    col3.metric("Auditorias arquivadas", f"{int(arquivados['auditorias'].sum()):,}".replace(',', '.'))
+    if not arquivados.empty:
+        with st.expander("Bases mensais"):
+            st.dataframe(arquivados, hide_index=True)
+
+    if status['bloqueio'] is not None:
+        id_auditoria, ts_auditoria = status['bloqueio']
+        st.info(f"A divergência #{id_auditoria} ({formatar_mes(ts_auditoria[:7])}) ainda está pendente: "
+                "ela e os meses seguintes ficam na base ativa até ser solucionada.")
+    arquivaveis = status['arquivaveis']
+    if not arquivaveis:
+        if status['bloqueio'] is None:
+            st.caption(f"Nenhum mês fechado para arquivar. Os últimos {ARQUIVO_MESES_QUENTES} meses e o mês atual "
+                       "ficam sempre na base ativa.")
+        return
+
+    # Sempre do mês mais antigo até o escolhido: o arquivo é um prefixo contínuo da história
+    ate = st.selectbox("Arquivar até o mês", arquivaveis, index=len(arquivaveis) - 1, format_func=formatar_mes)
+    compactar = st.checkbox("Compactar o banco ao final (VACUUM)", value=True,
+                            help="Devolve ao disco o espaço liberado. As gravações esperam enquanto roda.")
+    if st.button("Arquivar meses fechados"):
+        meses = [mes for mes in arquivaveis if mes <= ate]
+        try:
+            with st.spinner(f"Arquivando {len(meses)} mês(es)..."):
+                movidos = arquivar_meses(meses, compactar)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            total = sum(sum(contagem.values()) for contagem in movidos.values())
+            st.success(f"{len(movidos)} mês(es) arquivado(s), {total:,} registros movidos.".replace(',', '.'))
+            st.rerun()
+
+@instrumented_page
+def show_consolidado_page():
+    st.header("Consolidado das Lojas")
+    if not get_lojas():
+        st.info("Só a loja principal está cadastrada. Cadastre as demais em Gestão de Usuários.")
+        return
 
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("Data de Início", value=None, key="cons_start_date")
+    with col2:
+        end_date = st.date_input("Data de Fim", value=None, key="cons_end_date")
+    periodo = (start_date, end_date) if start_date and end_date else (None, None)
+
+    with st.spinner("Consultando as lojas..."):
+        resumo_dia, falhas = get_consolidado_recebimentos('dia', *periodo)
+        resumo_secao, falhas_secao = get_consolidado_recebimentos('secao', *periodo)
+    for nome, erro in dict(falhas, **falhas_secao).items():
+        st.warning(f"{nome} ficou fora do consolidado: {erro}")
+    if resumo_dia.empty:
+        st.info("Nenhum recebimento no período.")
+        return
+
+    _metricas_resumo(resumo_dia)
+    tab_loja, tab_dia, tab_secao = st.tabs(["Por loja", "Por dia", "Por seção"])
+    with tab_loja:
+        resumo_loja = somar_resumo(resumo_dia, 'loja')
+        st.bar_chart(resumo_loja, x='loja', y='quantidade_total', x_label="Loja", y_label="Quantidade recebida")
+        st.dataframe(resumo_loja, hide_index=True, column_config=dict(COLUNAS_RESUMO, loja="Loja"))
+    with tab_dia:
+        st.line_chart(resumo_dia, x='dia', y='quantidade_total', color='loja', x_label="Dia", y_label="Quantidade recebida")
+        st.dataframe(somar_resumo(resumo_dia, 'dia'), hide_index=True, column_config=dict(COLUNAS_RESUMO, dia="Dia"))
+    with tab_secao:
+        st.bar_chart(resumo_secao, x='secao_produto', y='quantidade_total', color='loja', x_label="Seção", y_label="Quantidade recebida")
+        st.dataframe(somar_resumo(resumo_secao, 'secao_produto'), hide_index=True,
+                     column_config=dict(COLUNAS_RESUMO, secao_produto="Seção"))
+
+@instrumented_page
 def show_gestao_usuarios_page():
     st.header("Gestão de Usuários")
     
@@ -574,12 +3541,13 @@ def show_gestao_usuarios_page():
         with col2:
             tipo_acesso = st.selectbox("Tipo de Acesso", ["Conferente", "Prevenção", "Gestor"])
             senha = st.text_input("Senha", type="password")
+        id_loja = st.selectbox("Loja", [None] + [loja[0] for loja in get_lojas()], format_func=_nome_loja)
         
         submit_user = st.form_submit_button("Salvar Usuário")
         
     if submit_user:
         if user_id and nome_usuario and senha:
-            save_user(user_id, nome_usuario, tipo_acesso, senha)
+            save_user(user_id, nome_usuario, tipo_acesso, senha, id_loja)
             st.success("Usuário salvo com sucesso!")
             st.rerun()
         else:
@@ -594,6 +3562,153 @@ def show_gestao_usuarios_page():
             st.warning(f"Usuário {user_to_delete} excluído com sucesso.")
             st.rerun()
 
+    st.markdown("---")
+    st.subheader("Lojas")
+    lojas = get_lojas()
+    if lojas:
+        st.dataframe(pd.DataFrame(lojas, columns=['id_loja', 'nome_loja', 'arquivo']), hide_index=True)
+    with st.form("form_loja", clear_on_submit=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            id_loja = st.text_input("Código da Loja")
+        with col2:
+            nome_loja = st.text_input("Nome da Loja")
+        with col3:
+            arquivo_loja = st.text_input("Arquivo do banco", placeholder="loja_centro.db",
+                                         help="Caminho relativo à pasta do banco principal. O arquivo é criado no primeiro acesso.")
+        submit_loja = st.form_submit_button("Salvar Loja")
+
+    if submit_loja:
+        if id_loja and nome_loja and arquivo_loja:
+            try:
+                save_loja(id_loja, nome_loja, arquivo_loja)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                st.success(f"Loja {nome_loja} salva com sucesso!")
+                st.rerun()
+        else:
+            st.error("Todos os campos devem ser preenchidos.")
+
+def _memoria_sessao():
+    total, pendentes = 0, list(st.session_state.values())
+    while pendentes:
+        valor = pendentes.pop()
+        if isinstance(valor, dict):
+            pendentes.extend(valor.values())
+        elif isinstance(valor, (list, tuple)):
+            pendentes.extend(valor)
+        elif isinstance(valor, bytes):
+            total += len(valor)
+        elif hasattr(valor, 'memory_usage'):
+            total += _approx_size(valor)
+    return total
+
+HISTOGRAMA_LIMITES_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+def _histograma(amostras):
+    contagens = [0] * (len(HISTOGRAMA_LIMITES_MS) + 1)
+    for ms in amostras:
+        contagens[bisect.bisect_left(HISTOGRAMA_LIMITES_MS, ms)] += 1
+    faixas = [f"≤ {limite} ms" for limite in HISTOGRAMA_LIMITES_MS] + [f"> {HISTOGRAMA_LIMITES_MS[-1]} ms"]
+    return pd.DataFrame({'Faixa': faixas, 'Ocorrências': contagens})
+
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))] if ordenados else 0.0
+
+@instrumented_page
+def show_desempenho_page():
+    st.header("Desempenho")
+    if not INSTRUMENTACAO_ENABLED:
+        st.info("A instrumentação está desligada (RECEBIMENTO_INSTRUMENTACAO=0).")
+        return
+
+    metricas = get_performance_metrics()
+    stats = metricas.stats()
+    st.caption(f"Métricas deste processo desde o início ou a última limpeza. "
+               f"Consultas acima de {metricas.slow_query_ms:.0f} ms são registradas como lentas (RECEBIMENTO_SLOW_QUERY_MS).")
+    if st.button("Zerar métricas"):
+        metricas.reset()
+        st.rerun()
+
+    st.subheader("Páginas")
+    if stats['pages']:
+        linhas = []
+        for nome, pagina in sorted(stats['pages'].items()):
+            ordenados = sorted(pagina['samples'])
+            tamanhos = sorted(pagina['bytes'])
+            linhas.append({
+                'Página': nome,
+                'Execuções': len(ordenados),
+                'p50 (ms)': _percentil(ordenados, 0.50),
+                'p95 (ms)': _percentil(ordenados, 0.95),
+                'Máximo (ms)': ordenados[-1],
+                'Consultas por execução': pagina['queries'] / len(ordenados),
+                'Dados p50 (MB)': _percentil(tamanhos, 0.50) / 1024 / 1024,
+                'Dados máx. (MB)': tamanhos[-1] / 1024 / 1024,
+            })
+        st.dataframe(pd.DataFrame(linhas), hide_index=True, column_config={
+            col: st.column_config.NumberColumn(format="%.1f")
+            for col in ['p50 (ms)', 'p95 (ms)', 'Máximo (ms)', 'Consultas por execução', 'Dados p50 (MB)', 'Dados máx. (MB)']
+        })
+        st.caption("Dados = tamanho dos DataFrames entregues à página por execução (tipos compactos: "
+                   f"{'ligados' if TIPOS_COMPACTOS else 'desligados'}, RECEBIMENTO_TIPOS_COMPACTOS).")
+        pagina_hist = st.selectbox("Histograma da página", sorted(stats['pages']))
+        st.bar_chart(_histograma(stats['pages'][pagina_hist]['samples']), x='Faixa', y='Ocorrências', sort=False)
+    else:
+        st.info("Nenhuma página medida ainda.")
+
+    st.subheader("Consultas SQL")
+    if stats['queries']:
+        st.bar_chart(_histograma(stats['query_samples']), x='Faixa', y='Ocorrências', sort=False)
+        df_queries = pd.DataFrame([
+            {'SQL': sql, 'Execuções': q['count'], 'Total (ms)': q['total_ms'],
+             'Média (ms)': q['total_ms'] / q['count'], 'Máximo (ms)': q['max_ms'], 'Linhas': q['rows']}
+            for sql, q in stats['queries'].items()
+        ]).sort_values('Total (ms)', ascending=False).head(20)
+        st.markdown("**Mais custosas (tempo total)**")
+        st.dataframe(df_queries, hide_index=True, column_config={
+            col: st.column_config.NumberColumn(format="%.1f") for col in ['Total (ms)', 'Média (ms)', 'Máximo (ms)']
+        })
+    else:
+        st.info("Nenhuma consulta medida ainda.")
+
+    st.markdown("**Consultas lentas recentes**")
+    if stats['slow']:
+        for lenta in reversed(stats['slow']):
+            with st.expander(f"{lenta['quando']} · {lenta['ms']:.0f} ms · {lenta['rows']} linhas · {lenta['sql'][:80]}"):
+                st.code(lenta['sql'], language='sql')
+                if lenta['plano']:
+                    st.code(lenta['plano'], language='text')
+    else:
+        st.caption("Nenhuma consulta lenta.")
+
+    st.subheader("Caches e conexões")
+    cache_stats = get_query_cache(current_db_file()).stats()
+    pool_stats = get_connection_pool(current_db_file()).stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Acertos do cache", f"{cache_stats['hit_rate']:.0%}")
+    col2.metric("Entradas em cache", cache_stats['entries'], help=f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+    col3.metric("Remoções (LRU)", cache_stats['evictions'])
+    col4.metric("Conexões reutilizadas", pool_stats['reused'], help=f"{pool_stats['opened']} abertas no total")
+    delta_stats = get_delta_store(current_db_file()).stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Históricos sem mudança", delta_stats['hits'])
+    col2.metric("Atualizações por delta", delta_stats['deltas'], help=f"{delta_stats['linhas_delta']} linhas relidas")
+    col3.metric("Cargas completas", delta_stats['cargas'])
+    col4.metric("Históricos em memória", delta_stats['entries'], help=f"{delta_stats['bytes'] / 1024 / 1024:.1f} MB")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Dados nesta sessão", f"{_memoria_sessao() / 1024 / 1024:.1f} MB",
+                help="Páginas do histórico, lote em conferência e demais dados guardados só para esta sessão.")
+    col2.metric("Cache de consultas", f"{cache_stats['bytes'] / 1024 / 1024:.1f} MB", help="Compartilhado entre as sessões.")
+    col3.metric("Históricos incrementais", f"{delta_stats['bytes'] / 1024 / 1024:.1f} MB", help="Compartilhados entre as sessões.")
+    if WRITE_BEHIND_ENABLED:
+        fila_stats = get_write_behind_queue(current_db_file()).stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Fila de gravação", fila_stats['depth'])
+        col2.metric("Commit médio", f"{fila_stats['commit_ms_avg']:.1f} ms")
+        col3.metric("Commit p95", f"{fila_stats['commit_ms_p95']:.1f} ms")
+
 # --- Execução Principal ---
 if __name__ == '__main__':
     if 'logged_in' not in st.session_state:
@@ -0,0 +1,35 @@
+import datetime
+import importlib.util
+import os
+
+import pytest
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'recebimento.py')
+
+def carregar_app(db_file):
+    # Mesmo carregamento do benchmark: o módulo lê RECEBIMENTO_DB na importação
+    os.environ['RECEBIMENTO_DB'] = db_file
+    os.environ.setdefault('STREAMLIT_LOGGER_LEVEL', 'error')
+    spec = importlib.util.spec_from_file_location('recebimento', APP_SCRIPT)
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.delenv('RECEBIMENTO_ANALYTICS', raising=False)
+    monkeypatch.chdir(tmp_path)
+    modulo = carregar_app(str(tmp_path / 'gestao_recebimentos.db'))
+    modulo.init_db()
+    return modulo
+
+def recebimento(codigo='100', quantidade=1.0, quando=None, conferente='conf1'):
+    quando = quando or datetime.datetime.now()
+    return {'codigo_produto': codigo, 'quantidade_recebida': quantidade, 'condicao_produto': 'Bom',
+            'data_recebimento': quando.strftime('%d/%m/%Y %H:%M'), 'dia_semana': 'Segunda-feira',
+            'hora_recebimento': quando.strftime('%H:%M'), 'foto_evidencia': None, 'conferente': conferente}
+
+def auditoria(codigo='100', status='Aberta', quando=None, divergente=1.0):
+    quando = quando or datetime.datetime.now()
+    return {'codigo_produto': codigo, 'quantidade_sistema': 1.0, 'quantidade_divergente': divergente,
+            'data_auditoria': quando.strftime('%d/%m/%Y %H:%M'), 'auditor': 'prev1', 'status_divergencia': status}
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from conftest import auditoria, recebimento
+
+@pytest.fixture
+def analitico(app, monkeypatch):
+    monkeypatch.setattr(app, 'ANALYTICS_ENABLED', True)
+    monkeypatch.setattr(app, 'ANALYTICS_REFRESH_S', 3600)
+    app.save_receptions([recebimento(str(i)) for i in range(3)])
+    app.save_audits([auditoria(str(i)) for i in range(3)])
+    return app.get_analytics_store(app.DB_FILE)
+
+def _sqlite(app, consulta, **filtros):
+    with app.sem_snapshot():
+        return consulta.__wrapped__(ids=None, **filtros)
+
+def test_snapshot_atrasado_e_completado_pelo_delta(app, analitico):
+    assert len(app.get_recebimentos_relatorio()) == 3
+    versao = analitico.status()['recebimentos']['versao']
+
+    app.save_receptions([recebimento('3'), recebimento('4')])
+    relatorio = app.get_recebimentos_relatorio()
+
+    # Dentro do intervalo de atualização o snapshot não é refeito
+    assert analitico.status()['recebimentos']['versao'] == versao
+    assert relatorio['id_recebimento'].tolist() == _sqlite(app, app.get_recebimentos_relatorio)['id_recebimento'].tolist()
+    # Um frame novo (outra chave) também parte do snapshot antigo e completa pelo delta
+    por_conferente = app.get_recebimentos_relatorio(conferente='conf1')
+    assert len(por_conferente) == 5
+
+def test_tabela_da_juncao_atrasada_volta_ao_sqlite(app, analitico):
+    sql = "SELECT a.id_auditoria, p.descricao_produto FROM auditorias a LEFT JOIN produtos p USING (codigo_produto)"
+    assert analitico.query(sql, [], ('auditorias', 'produtos'), atuais=('produtos',)) is not None
+
+    app.save_produto('0', 'PRODUTO NOVO', 'FLV')
+
+    assert analitico.query(sql, [], ('auditorias', 'produtos'), atuais=('produtos',)) is None
+    divergencias = app.get_divergencias()
+    assert divergencias.set_index('codigo_produto').loc['0', 'descricao_produto'] == 'PRODUTO NOVO'
+
+def test_snapshot_vencido_e_refeito_em_segundo_plano(app, analitico, monkeypatch):
+    app.get_recebimentos_relatorio()
+    monkeypatch.setattr(app, 'ANALYTICS_REFRESH_S', 0)
+    app.save_reception(recebimento('3'))
+    atual = app.get_data_version('recebimentos')
+
+    # Frame já carregado segue pelo delta; uma carga nova consulta o snapshot vencido
+    app.get_recebimentos_relatorio()
+    app.get_recebimentos_relatorio(conferente='conf1')
+
+    prazo = time.monotonic() + 10
+    while analitico.status()['recebimentos']['versao'] != atual and time.monotonic() < prazo:
+        time.sleep(0.05)
+    assert analitico.status()['recebimentos']['versao'] == atual
+
+def test_falha_no_duckdb_usa_o_sqlite(app, analitico, monkeypatch):
+    def falhar(*args, **kwargs):
+        raise RuntimeError("duckdb indisponível")
+    monkeypatch.setattr(analitico, 'query', falhar)
+
+    assert app.analytics_query("SELECT 1", [], ('recebimentos',)) is None
+    assert len(app.get_recebimentos_relatorio()) == 3
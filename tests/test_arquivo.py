@@ -0,0 +1,61 @@
+import datetime
+
+from conftest import auditoria, recebimento
+
+def _mes_antigo(app):
+    # Um mês bem antes da janela quente, para poder ser arquivado
+    mes = app._mes_deslocado(app._limite_arquivo(), -2)
+    return datetime.datetime.strptime(mes + '-10 09:00', '%Y-%m-%d %H:%M')
+
+def test_arquivar_mes_move_linhas_e_relatorio_le_do_arquivo(app):
+    antigo = _mes_antigo(app)
+    app.save_receptions([recebimento(str(i), quando=antigo) for i in range(5)])
+    app.save_audit(auditoria('0', status='Solucionada', quando=antigo))
+    mes = antigo.strftime('%Y-%m')
+
+    movidos = app.arquivar_meses([mes])
+
+    assert movidos[mes] == {'recebimentos': 5, 'auditorias': 1}
+    with app.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM recebimentos").fetchone()[0] == 0
+    relatorio = app.get_recebimentos_relatorio()
+    assert sorted(relatorio['codigo_produto']) == [str(i) for i in range(5)]
+    assert len(app.get_auditorias_historico()) == 1
+
+def test_ids_nao_sao_reaproveitados_depois_de_arquivar_a_tabela_inteira(app):
+    antigo = _mes_antigo(app)
+    app.save_receptions([recebimento(str(i), quando=antigo) for i in range(3)])
+    app.save_audit(auditoria('0', status='Solucionada', quando=antigo))
+    # Carrega os históricos antes: o delta guarda o maior id já visto
+    ids_antes = app.get_recebimentos_relatorio()['id_recebimento'].tolist()
+    app.get_auditorias_historico()
+
+    app.arquivar_meses([antigo.strftime('%Y-%m')])
+    app.save_reception(recebimento('77'))
+    app.save_audit(auditoria('77'))
+
+    with app.get_db_connection() as conn:
+        novo_recebimento = conn.execute("SELECT MAX(id_recebimento) FROM recebimentos").fetchone()[0]
+        nova_auditoria = conn.execute("SELECT MAX(id_auditoria) FROM auditorias").fetchone()[0]
+    assert novo_recebimento > max(ids_antes)
+    assert nova_auditoria > 1
+    historico = app.get_historico_recebimentos()
+    assert historico['id_recebimento'].is_unique
+    assert historico['id_recebimento'].iloc[0] == novo_recebimento
+    assert '77' in app.get_auditorias_historico()['codigo_produto'].tolist()
+    assert '77' in app.get_recebimentos_relatorio()['codigo_produto'].tolist()
+
+def test_migracao_parte_do_maior_id_dos_arquivos(app):
+    antigo = _mes_antigo(app)
+    app.save_receptions([recebimento(str(i), quando=antigo) for i in range(4)])
+    app.arquivar_meses([antigo.strftime('%Y-%m')])
+    with app.get_db_connection() as conn:
+        # Volta a tabela (já vazia) à definição anterior à migração, sem AUTOINCREMENT
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'recebimentos'").fetchone()[0]
+        conn.execute("DROP TABLE recebimentos")
+        conn.execute(sql.replace(' AUTOINCREMENT', ''))
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'recebimentos'")
+        app._migrate_ids_autoincrement(conn)
+        conn.commit()
+        assert 'AUTOINCREMENT' in conn.execute("SELECT sql FROM sqlite_master WHERE name = 'recebimentos'").fetchone()[0]
+        assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'recebimentos'").fetchone()[0] == 4
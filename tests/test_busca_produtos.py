@@ -0,0 +1,17 @@
+def _cadastrar(app, produtos):
+    with app.get_db_connection() as conn:
+        conn.executemany("INSERT INTO produtos (codigo_produto, descricao_produto, secao_produto) VALUES (?, ?, ?)", produtos)
+        app._bump_versao(conn, 'produtos')
+        conn.commit()
+
+def test_busca_ignora_acentos(app):
+    _cadastrar(app, [('1', 'MAÇÃ FUJI', 'FLV'), ('2', 'LIMÃO TAHITI', 'FLV')])
+    assert [p['codigo_produto'] for p in app.search_products('maca')] == ['1']
+
+def test_melhor_resultado_entre_muitos_candidatos(app):
+    # Mais de mil produtos casam com "arroz"; o mais relevante é o último inserido
+    comuns = [(str(i), f'ARROZ TIPO 1 PACOTE GRANDE SORTIDO {i}', 'MERCEARIA') for i in range(1500)]
+    _cadastrar(app, comuns + [('9999', 'ARROZ ARROZ', 'MERCEARIA')])
+    resultados = app.search_products('arroz', limit=5)
+    assert len(resultados) == 5
+    assert resultados[0]['codigo_produto'] == '9999'
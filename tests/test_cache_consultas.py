@@ -0,0 +1,55 @@
+import pandas as pd
+
+from conftest import auditoria, recebimento
+
+def _frame(linhas):
+    return pd.DataFrame({'valor': range(linhas)}, dtype='int64')
+
+def test_lru_descarta_o_menos_usado(app):
+    cache = app.QueryCache(max_entries=2)
+    calculos = []
+    obter = lambda chave: cache.get_or_compute(chave, lambda: calculos.append(chave) or chave)
+
+    obter('a'), obter('b'), obter('a'), obter('c'), obter('a'), obter('b')
+
+    assert calculos == ['a', 'b', 'c', 'b']
+    assert cache.stats()['evictions'] == 2
+
+def test_limite_de_bytes(app):
+    tamanho = app._approx_size(_frame(1000))
+    cache = app.QueryCache(max_bytes=int(tamanho * 2.5))
+    for chave in range(5):
+        cache.get_or_compute(chave, lambda: _frame(1000))
+    assert cache.stats()['entries'] == 2
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+    # Maior que o limite: devolvido, mas não guardado
+    grande = cache.get_or_compute('grande', lambda: _frame(10000))
+    assert len(grande) == 10000
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+def test_gravacao_invalida_so_as_consultas_da_tabela(app):
+    cache = app.get_query_cache(app.DB_FILE)
+    app.save_reception(recebimento('1', 2.0))
+    assert app.get_consolidated_recebimentos()['quantidade_total_recebida'].tolist() == [2.0]
+    app.get_consolidated_recebimentos()
+    assert cache.stats()['hits'] == 1
+
+    # Auditoria não muda recebimentos: continua no cache
+    app.save_audit(auditoria('1'))
+    app.get_consolidated_recebimentos()
+    assert cache.stats()['hits'] == 2
+
+    app.save_reception(recebimento('1', 3.0))
+    assert app.get_consolidated_recebimentos()['quantidade_total_recebida'].tolist() == [5.0]
+
+def test_gravacao_de_outro_processo_invalida_o_cache(app):
+    app.save_reception(recebimento('1', 2.0))
+    assert len(app.get_consolidated_recebimentos()) == 1
+
+    # Outra conexão (como outro processo) grava e sobe a versão
+    outra = app.ConnectionPool(app.DB_FILE)
+    with outra.connection() as conn:
+        app._insert_recebimentos(conn, [recebimento('2', 1.0)])
+
+    assert sorted(app.get_consolidated_recebimentos()['codigo_produto']) == ['1', '2']
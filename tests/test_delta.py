@@ -0,0 +1,66 @@
+import datetime
+
+from conftest import auditoria, recebimento
+
+def _releitura(app, consulta, **filtros):
+    # Leitura completa, sem o cache de delta nem snapshot analítico
+    with app.sem_snapshot():
+        return consulta.__wrapped__(ids=None, **filtros)
+
+def _ids(frame, coluna):
+    return frame[coluna].tolist()
+
+def test_delta_traz_recebimentos_novos(app):
+    app.save_receptions([recebimento(str(i)) for i in range(3)])
+    assert len(app.get_recebimentos_relatorio()) == 3
+    cargas = app.get_delta_store(app.current_db_file()).stats()['cargas']
+
+    app.save_receptions([recebimento(str(i)) for i in range(3, 5)])
+    relatorio = app.get_recebimentos_relatorio()
+
+    stats = app.get_delta_store(app.current_db_file()).stats()
+    assert stats['cargas'] == cargas and stats['deltas'] == 1
+    assert _ids(relatorio, 'id_recebimento') == _ids(_releitura(app, app.get_recebimentos_relatorio), 'id_recebimento')
+
+def test_delta_acompanha_mudancas_de_status(app):
+    app.save_audits([auditoria(str(i)) for i in range(4)])
+    ids = _ids(app.get_auditorias_historico(), 'id_auditoria')
+    assert _ids(app.get_divergencias(status='Aberta'), 'id_auditoria') == ids
+
+    # Solucionada sai do filtro (remoção no delta) ...
+    app.update_status_divergencia(ids[1], 'Solucionada')
+    abertas = app.get_divergencias(status='Aberta')
+    assert _ids(abertas, 'id_auditoria') == [ids[0], ids[2], ids[3]]
+    # ... e reaberta volta na mesma posição
+    app.update_status_divergencia(ids[1], 'Aberta')
+    abertas = app.get_divergencias(status='Aberta')
+    assert _ids(abertas, 'id_auditoria') == ids
+    # Status novo atualizado no lugar, junto com uma linha nova
+    app.update_status_divergencia(ids[2], 'Em tratamento')
+    app.save_audit(auditoria('9'))
+    pendentes = app.get_divergencias()
+    releitura = _releitura(app, app.get_divergencias)
+    assert _ids(pendentes, 'id_auditoria') == _ids(releitura, 'id_auditoria')
+    assert pendentes['status_divergencia'].tolist() == releitura['status_divergencia'].tolist()
+    historico = app.get_auditorias_historico()
+    assert historico.loc[historico['id_auditoria'] == ids[2], 'status_divergencia'].item() == 'Em tratamento'
+
+def test_delta_depois_de_arquivar(app):
+    antigo = datetime.datetime.strptime(app._mes_deslocado(app._limite_arquivo(), -2) + '-10 09:00', '%Y-%m-%d %H:%M')
+    app.save_receptions([recebimento(str(i), quando=antigo) for i in range(3)] + [recebimento('3')])
+    assert len(app.get_recebimentos_relatorio()) == 4
+
+    # Linhas saem da base ativa para o arquivo e outras entram depois
+    app.arquivar_meses([antigo.strftime('%Y-%m')])
+    app.save_reception(recebimento('4'))
+
+    relatorio = app.get_recebimentos_relatorio()
+    assert _ids(relatorio, 'id_recebimento') == _ids(_releitura(app, app.get_recebimentos_relatorio), 'id_recebimento')
+    assert sorted(relatorio['codigo_produto']) == [str(i) for i in range(5)]
+
+def test_sem_snapshot_aninhado_mantem_o_de_fora(app):
+    with app.sem_snapshot():
+        with app.sem_snapshot():
+            pass
+        assert app._analytics_local.desligado
+    assert not app._analytics_local.desligado
@@ -0,0 +1,50 @@
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import recebimento
+
+@pytest.mark.parametrize('texto, esperado', [
+    ('1.234', 1234.0),
+    ('12.345.678', 12345678.0),
+    ('-1.234', -1234.0),
+    ('1.234,50', 1234.5),
+    ('1,5', 1.5),
+    ('1.5', 1.5),
+    ('12.50', 12.5),
+    ('1234', 1234.0),
+    (' 2 ', 2.0),
+    (1.234, 1.234),
+    ('abc', None),
+    ('', None),
+    (None, None),
+])
+def test_normalize_quantidade(app, texto, esperado):
+    assert app._normalize_quantidade(texto) == esperado
+
+def test_read_estoque_erp_le_milhar_sem_decimais(app):
+    conteudo = "codigo;quantidade\n100;1.234\n200;2,5\n100;10\n300;xyz\n".encode('utf-8')
+    estoque, invalidas = app.read_estoque_erp('estoque.csv', conteudo)
+    assert dict(zip(estoque['codigo_produto'], estoque['quantidade_sistema'])) == {'100': 1244.0, '200': 2.5}
+    assert invalidas == 1
+
+def test_divergencia_arredondada_igual_na_auditoria_individual_e_em_lote(app):
+    app.save_receptions([recebimento('100', 0.1), recebimento('100', 0.2), recebimento('200', 10.0)])
+    estoque, _ = app.read_estoque_erp('estoque.csv', b"codigo;quantidade\n100;0,3\n200;8,7654\n")
+    conciliacao = app.reconcile_auditorias(estoque)['conciliacao'].set_index('codigo_produto')
+
+    # 0.1 + 0.2 - 0.3 não é zero em ponto flutuante: sem arredondar, abriria divergência
+    assert conciliacao.loc['100', 'quantidade_divergente'] == 0.0
+    assert conciliacao.loc['100', 'status_divergencia'] == "Solucionada"
+    assert conciliacao.loc['200', 'quantidade_divergente'] == app.calcular_divergencia(10.0, 8.7654) == 1.235
+
+def test_divergencia_vetorizada_igual_a_individual(app):
+    aleatorio = random.Random(7)
+    pares = [(0.0005, 0.0), (0.0015, 0.0), (2.675, 0.0), (0.3, 0.1 + 0.2), (1.0, 1.0)]
+    pares += [(round(aleatorio.uniform(0, 500), 4), round(aleatorio.uniform(0, 500), 4)) for _ in range(2000)]
+    recebido, sistema = zip(*pares)
+
+    em_lote = app.calcular_divergencias(pd.Series(recebido), pd.Series(sistema))
+
+    assert em_lote.tolist() == [app.calcular_divergencia(r, s) for r, s in zip(recebido, sistema)]
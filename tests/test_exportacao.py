@@ -0,0 +1,64 @@
+import csv
+import datetime
+import io
+import os
+import shutil
+
+import openpyxl
+import pyarrow.parquet as pq
+from streamlit.testing.v1 import AppTest
+
+from conftest import APP_SCRIPT, recebimento
+
+def _exportar(app, formato, **filtros):
+    return app.export_recebimentos(formato, versao=app.get_data_version('recebimentos'), db_file=app.DB_FILE, **filtros)
+
+def _linhas_csv(conteudo):
+    return list(csv.DictReader(io.StringIO(conteudo.decode('utf-8-sig')), delimiter=';'))
+
+def test_csv_lido_em_lotes_traz_todas_as_linhas(app, monkeypatch):
+    monkeypatch.setattr(app, 'EXPORT_CHUNK_SIZE', 3)
+    app.save_receptions([recebimento(str(i), float(i)) for i in range(10)])
+
+    linhas = _linhas_csv(_exportar(app, 'csv'))
+
+    assert [linha['codigo_produto'] for linha in linhas] == [str(i) for i in range(10)]
+    assert 'foto_hash' not in linhas[0]
+    assert 'foto_hash' in _linhas_csv(_exportar(app, 'csv', incluir_fotos=True))[0]
+
+def test_excel_e_parquet(app):
+    app.save_receptions([recebimento(str(i), float(i)) for i in range(5)])
+
+    planilha = openpyxl.load_workbook(io.BytesIO(_exportar(app, 'xlsx')), read_only=True).active
+    linhas = list(planilha.values)
+    assert linhas[0][:2] == ('id_recebimento', 'codigo_produto')
+    assert len(linhas) == 6
+
+    tabela = pq.read_table(io.BytesIO(_exportar(app, 'parquet')))
+    assert tabela.num_rows == 5
+    assert str(tabela.schema.field('id_recebimento').type) == 'int64'
+    assert tabela.column('quantidade_recebida').to_pylist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+def test_exportacao_inclui_meses_arquivados(app):
+    antigo = datetime.datetime.strptime(app._mes_deslocado(app._limite_arquivo(), -2) + '-10 09:00', '%Y-%m-%d %H:%M')
+    app.save_receptions([recebimento('1', quando=antigo), recebimento('2')])
+    app.arquivar_meses([antigo.strftime('%Y-%m')])
+
+    assert [linha['codigo_produto'] for linha in _linhas_csv(_exportar(app, 'csv'))] == ['1', '2']
+
+def test_arquivo_so_e_gerado_depois_do_clique(app, tmp_path):
+    shutil.copy(os.path.join(os.path.dirname(APP_SCRIPT), 'logo.png'), tmp_path / 'logo.png')
+    app.save_receptions([recebimento('1')])
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=60)
+    at.session_state['logged_in'] = True
+    at.session_state['user_role'] = 'Gestor'
+    at.session_state['user_id'] = 'admin'
+    at.run()
+    at.sidebar.radio[0].set_value('Relatórios').run()
+    assert not at.exception
+    assert not at.get('download_button')
+
+    next(b for b in at.button if b.label == 'Gerar relatório').click().run()
+
+    assert not at.exception
+    assert len(at.get('download_button')) == 1
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from conftest import recebimento
+
+def _inserir(conn, codigo):
+    conn.execute("INSERT INTO produtos (codigo_produto) VALUES (?)", (codigo,))
+    return codigo
+
+def _inserir_e_falhar(conn, codigo):
+    _inserir(conn, codigo)
+    raise ValueError(f"falha em {codigo}")
+
+def _codigos(app):
+    with app.get_db_connection() as conn:
+        return sorted(row[0] for row in conn.execute("SELECT codigo_produto FROM produtos"))
+
+@pytest.fixture
+def fila(app):
+    # Espera longa: tudo o que for enviado em sequência cai no mesmo grupo
+    fila = app.WriteBehindQueue(app.get_connection_pool(app.DB_FILE), max_wait_ms=500)
+    yield fila
+    fila.close()
+
+def test_gravacoes_seguidas_entram_num_unico_commit(app, fila):
+    handles = [fila.submit(_inserir, str(i)) for i in range(50)]
+
+    assert [handle.result(5) for handle in handles] == [str(i) for i in range(50)]
+    stats = fila.stats()
+    assert (stats['batches'], stats['committed'], stats['failed']) == (1, 50, 0)
+    assert _codigos(app) == sorted(str(i) for i in range(50))
+
+def test_item_com_erro_falha_sozinho(app, fila):
+    handles = [fila.submit(_inserir, '1'), fila.submit(_inserir_e_falhar, '2'), fila.submit(_inserir, '3')]
+
+    assert handles[0].result(5) == '1' and handles[2].result(5) == '3'
+    with pytest.raises(ValueError, match='falha em 2'):
+        handles[1].result(5)
+    # O grupo foi desfeito e reaplicado item a item: nada duplicado, nada do item com erro
+    assert _codigos(app) == ['1', '3']
+    assert fila.stats()['failed'] == 1
+
+def test_encerrar_grava_o_que_estava_na_fila(app):
+    fila = app.WriteBehindQueue(app.get_connection_pool(app.DB_FILE), max_batch=10, max_wait_ms=500)
+    liberar = threading.Event()
+    bloqueio = fila.submit(lambda conn: liberar.wait(5))
+    handles = [fila.submit(_inserir, str(i)) for i in range(25)]
+    liberar.set()
+
+    fila.close()
+
+    assert bloqueio.done() and all(handle.done() for handle in handles)
+    assert len(_codigos(app)) == 25
+    with pytest.raises(RuntimeError):
+        fila.submit(_inserir, 'depois')
+
+def test_app_grava_pela_fila_quando_ligada(app, monkeypatch):
+    monkeypatch.setattr(app, 'WRITE_BEHIND_ENABLED', True)
+    handle = app.save_receptions([recebimento('1'), recebimento('2')], wait=False)
+    handle.result(5)
+    app.save_reception(recebimento('3'))
+
+    with app.get_db_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM recebimentos").fetchone()[0] == 3
+    assert app.get_write_behind_queue(app.DB_FILE).stats()['committed'] >= 2
@@ -0,0 +1,51 @@
+import os
+import shutil
+
+from streamlit.testing.v1 import AppTest
+
+from conftest import APP_SCRIPT, recebimento
+
+def _inserir(app, quantidade):
+    app.save_receptions([recebimento(str(i)) for i in range(quantidade)])
+
+def test_paginas_por_keyset_nao_mudam_com_insercoes(app):
+    _inserir(app, 120)
+    primeira = app.get_historico_recebimentos()
+    segunda = app.get_historico_recebimentos(before_id=primeira['id_recebimento'].min())
+
+    _inserir(app, 10)
+
+    topo = int(primeira['id_recebimento'].max())
+    assert app.get_historico_recebimentos(before_id=topo + 1).equals(primeira)
+    assert app.get_historico_recebimentos(before_id=primeira['id_recebimento'].min()).equals(segunda)
+    ids = primeira['id_recebimento'].tolist() + segunda['id_recebimento'].tolist()
+    assert ids == list(range(120, 20, -1))
+
+def _historico_na_tela(tmp_path):
+    shutil.copy(os.path.join(os.path.dirname(APP_SCRIPT), 'logo.png'), tmp_path / 'logo.png')
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=60)
+    at.session_state['logged_in'] = True
+    at.session_state['user_role'] = 'Gestor'
+    at.session_state['user_id'] = 'admin'
+    at.run()
+    at.sidebar.radio[0].set_value('Recebimento').run()
+    assert not at.exception
+    return at
+
+def _botao(at, rotulo):
+    return next(b for b in at.button if b.label == rotulo)
+
+def test_lista_carregada_fica_estavel_ate_pedir_os_novos(app, tmp_path):
+    _inserir(app, 120)
+    at = _historico_na_tela(tmp_path)
+    _botao(at, 'Carregar mais').click().run()
+    ids = at.dataframe[0].value['id_recebimento'].tolist()
+    assert ids == list(range(120, 20, -1))
+
+    _inserir(app, 10)
+    at.run()
+
+    # Nada some nem se repete: as linhas novas esperam o pedido explícito
+    assert at.dataframe[0].value['id_recebimento'].tolist() == ids
+    _botao(at, 'Mostrar os mais recentes').click().run()
+    assert at.dataframe[0].value['id_recebimento'].tolist() == list(range(130, 80, -1))
@@ -0,0 +1,28 @@
+def test_consultas_nao_verificam_versao_a_cada_chamada(app, monkeypatch):
+    app.save_produto('100', 'BANANA PRATA', 'FLV')
+    app.get_product_info('100')
+    chamadas = []
+    original = app.get_data_version
+    monkeypatch.setattr(app, 'get_data_version', lambda tabela: chamadas.append(tabela) or original(tabela))
+    for _ in range(50):
+        assert app.get_product_info('100')['descricao_produto'] == 'BANANA PRATA'
+    assert chamadas == []
+
+def test_gravacao_de_outro_processo_aparece_depois_do_intervalo(app, monkeypatch):
+    app.save_produto('100', 'BANANA PRATA', 'FLV')
+    assert app.get_product_info('100')['descricao_produto'] == 'BANANA PRATA'
+    # Outro processo altera o catálogo direto no banco
+    with app.get_db_connection() as conn:
+        conn.execute("UPDATE produtos SET descricao_produto = 'BANANA NANICA' WHERE codigo_produto = '100'")
+        app._bump_versao(conn, 'produtos')
+        conn.commit()
+    assert app.get_product_info('100')['descricao_produto'] == 'BANANA PRATA'
+    monkeypatch.setattr(app, 'PRODUTOS_VERIFICACAO_S', 0)
+    assert app.get_product_info('100')['descricao_produto'] == 'BANANA NANICA'
+
+def test_importacao_atualiza_o_indice_na_hora(app):
+    app.save_produto('100', 'BANANA PRATA', 'FLV')
+    app.get_product_info('100')
+    app.import_catalogo('catalogo.csv', "codigo;descricao;secao\n100;BANANA NANICA;FLV\n200;MAMAO;FLV\n".encode('utf-8'))
+    assert app.get_product_info('100')['descricao_produto'] == 'BANANA NANICA'
+    assert app.get_product_info('200') is not None
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from conftest import recebimento
+
+def _usuarios(app, db_file):
+    with app.get_db_connection(db_file) as conn:
+        return [row[0] for row in conn.execute("SELECT id_usuario FROM usuarios ORDER BY id_usuario")]
+
+def test_banco_da_loja_nao_recebe_usuarios_padrao(app, tmp_path):
+    app.save_loja('L1', 'Loja 1', 'loja1.db')
+    caminho = app._caminho_loja(app.get_loja('L1')[2])
+
+    app.ensure_schema(caminho)
+
+    assert _usuarios(app, caminho) == []
+    assert 'admin' in _usuarios(app, app.DB_FILE)
+
+@pytest.mark.parametrize('arquivo', ['/tmp/loja.db', '../loja.db', 'lojas/../../loja.db', '..\\loja.db', ''])
+def test_save_loja_recusa_arquivo_fora_da_pasta_do_banco(app, arquivo):
+    with pytest.raises(ValueError):
+        app.save_loja('L1', 'Loja 1', arquivo)
+    assert app.get_lojas() == []
+
+def test_save_loja_recusa_o_banco_principal(app):
+    with pytest.raises(ValueError):
+        app.save_loja('L1', 'Loja 1', 'gestao_recebimentos.db')
+
+def test_save_loja_aceita_subpasta(app, tmp_path):
+    (tmp_path / 'lojas').mkdir()
+    app.save_loja('L1', 'Loja 1', 'lojas/loja1.db')
+    assert app.get_loja('L1')[2] == 'lojas/loja1.db'
+
+def test_consolidado_aponta_loja_sem_arquivo_sem_criar_o_banco(app, tmp_path):
+    app.save_reception(recebimento('1'))
+    app.save_loja('L1', 'Loja 1', 'loja1.db')
+
+    consolidado, falhas = app.get_consolidado_recebimentos('dia')
+
+    assert 'não encontrado' in falhas['Loja 1']
+    assert not (tmp_path / 'loja1.db').exists()
+    assert set(consolidado['loja']) == {app.LOJA_PRINCIPAL}
+
+def test_consolidado_segue_quando_uma_loja_falha_ou_demora(app, tmp_path, monkeypatch):
+    app.save_reception(recebimento('1'))
+    (tmp_path / 'quebrada.db').write_bytes(b'isto nao e um banco sqlite' * 100)
+    (tmp_path / 'lenta.db').write_bytes(b'')
+    app.save_loja('L1', 'Quebrada', 'quebrada.db')
+    app.save_loja('L2', 'Lenta', 'lenta.db')
+    ensure_schema = app.ensure_schema
+
+    def migracao_lenta(db_file=app.DB_FILE):
+        if db_file.endswith('lenta.db'):
+            time.sleep(1)
+        return ensure_schema(db_file)
+
+    # As migrações rodam no executor, dentro do prazo de cada loja
+    monkeypatch.setattr(app, 'ensure_schema', migracao_lenta)
+    monkeypatch.setattr(app, 'CONSOLIDADO_TIMEOUT_S', 0.3)
+    consolidado, falhas = app.get_consolidado_recebimentos('dia')
+
+    assert set(falhas) == {'Quebrada', 'Lenta'}
+    assert 'sem resposta' in falhas['Lenta']
+    assert set(consolidado['loja']) == {app.LOJA_PRINCIPAL}
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from conftest import APP_SCRIPT, recebimento
+
+def _contar(app, tabela):
+    with app.get_db_connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+
+def test_lote_grava_todos_os_itens_numa_transacao(app):
+    app.save_receptions([recebimento('1', 2.0), recebimento('1', 3.0), recebimento('2', 1.0)])
+    assert _contar(app, 'recebimentos') == 3
+    with app.get_db_connection() as conn:
+        assert conn.execute("SELECT quantidade_total_recebida FROM recebimentos_totais WHERE codigo_produto = '1'").fetchone()[0] == 5.0
+
+def test_falha_num_item_desfaz_o_lote_inteiro(app):
+    ruim = dict(recebimento('3'), data_recebimento='data inválida')
+    com_foto = dict(recebimento('1'), foto_evidencia=b'foto')
+
+    with pytest.raises(ValueError):
+        app.save_receptions([com_foto, recebimento('2'), ruim])
+
+    # Nem as linhas anteriores ao erro nem a foto ficam gravadas
+    assert _contar(app, 'recebimentos') == 0
+    assert _contar(app, 'fotos') == 0
+    assert _contar(app, 'recebimentos_totais') == 0
+    app.save_receptions([recebimento('2')])
+    assert _contar(app, 'recebimentos') == 1
+
+def _tela_de_lote(tmp_path, codigos):
+    shutil.copy(os.path.join(os.path.dirname(APP_SCRIPT), 'logo.png'), tmp_path / 'logo.png')
+    at = AppTest.from_file(APP_SCRIPT, default_timeout=60)
+    at.session_state['logged_in'] = True
+    at.session_state['user_role'] = 'Conferente'
+    at.session_state['user_id'] = 'conf1'
+    at.run()
+    at.toggle[0].set_value(True).run()
+    for codigo in codigos:
+        next(t for t in at.text_input if t.label == 'Código do Produto').set_value(codigo)
+        next(n for n in at.number_input if n.label == 'Quantidade').set_value(2.0)
+        next(b for b in at.button if b.label == 'Adicionar ao Lote').click().run()
+    assert not at.exception
+    return at
+
+def test_confirmar_lote_grava_os_itens_contados_no_botao(app, tmp_path):
+    at = _tela_de_lote(tmp_path, ['1', '2', '3'])
+    # O AppTest não edita o data_editor: a marcação vai direto no estado do widget
+    marcacao = {'edited_rows': {1: {'remover': True}}, 'added_rows': [], 'deleted_rows': []}
+    at.session_state['lote_editor'] = marcacao
+    at.run()
+
+    confirmar = next(b for b in at.button if b.label.startswith('Confirmar Lote'))
+    assert confirmar.label == 'Confirmar Lote (2 itens)'
+    at.session_state['lote_editor'] = marcacao
+    confirmar.click().run()
+
+    assert not at.exception
+    with app.get_db_connection() as conn:
+        assert [row[0] for row in conn.execute("SELECT codigo_produto FROM recebimentos ORDER BY 1")] == ['1', '3']
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+@pytest.fixture
+def medida(app, tmp_path):
+    # Pool próprio com métricas separadas das globais do processo
+    metricas = app.PerformanceMetrics()
+    pool = app.ConnectionPool(str(tmp_path / 'gestao_recebimentos.db'), metricas=metricas)
+    return pool, metricas
+
+def test_conta_comandos_e_linhas_lidas(medida):
+    pool, metricas = medida
+    with pool.connection() as conn:
+        conn.execute("SELECT id_usuario FROM usuarios").fetchall()
+        conn.execute("SELECT id_usuario FROM usuarios").fetchall()
+        conn.executemany("INSERT INTO produtos (codigo_produto) VALUES (?)", [('1',), ('2',)])
+
+    consultas = metricas.stats()['queries']
+    assert consultas['SELECT id_usuario FROM usuarios']['count'] == 2
+    assert consultas['SELECT id_usuario FROM usuarios']['rows'] == 6
+    assert consultas['INSERT INTO produtos (codigo_produto) VALUES (?)']['rows'] == 2
+
+def test_cursor_iterado_conta_linhas_ao_acabar(medida):
+    pool, metricas = medida
+    with pool.connection() as conn:
+        assert len(list(conn.execute("SELECT * FROM usuarios"))) == 3
+    consulta = metricas.stats()['queries']['SELECT * FROM usuarios']
+    assert (consulta['count'], consulta['rows']) == (1, 3)
+
+def test_consulta_lenta_guarda_plano_mesmo_com_comentario(medida):
+    pool, metricas = medida
+    metricas.slow_query_ms = 0
+    with pool.connection() as conn:
+        conn.execute("""
+            SELECT codigo_produto FROM produtos
+            -- comentário no meio do comando
+            WHERE codigo_produto = ?
+        """, ('1',)).fetchall()
+
+    lenta = metricas.stats()['slow'][-1]
+    assert lenta['sql'] == 'SELECT codigo_produto FROM produtos WHERE codigo_produto = ?'
+    assert 'indisponível' not in lenta['plano']
+    assert 'produtos' in lenta['plano']
+
+def test_busca_de_produtos_lenta_tem_plano(app):
+    metricas = app.get_performance_metrics()
+    metricas.reset()
+    metricas.slow_query_ms = 0
+    try:
+        app.search_products('arroz')
+    finally:
+        metricas.slow_query_ms = app.SLOW_QUERY_MS
+    busca = [lenta for lenta in metricas.stats()['slow'] if 'produtos_busca MATCH' in lenta['sql']]
+    assert busca and 'indisponível' not in busca[-1]['plano']
+
+def test_pagina_soma_consultas_e_memoria(app):
+    metricas = app.PerformanceMetrics()
+    with metricas.page('pagina'):
+        metricas.record_query(None, "SELECT 1", None, 0.001, 1)
+        metricas.record_frame(1024)
+    pagina = metricas.stats()['pages']['pagina']
+    assert pagina['queries'] == 1
+    assert pagina['bytes'] == [1024]
+    assert len(pagina['samples']) == 1
@@ -0,0 +1,65 @@
+import base64
+import io
+import os
+import shutil
+import sqlite3
+
+from PIL import Image
+
+from conftest import carregar_app, recebimento
+
+AMOSTRA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.devcontainer', 'gestao_recebimentos.db')
+
+def _foto_base64():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, format='PNG')
+    return buffer.getvalue(), base64.b64encode(buffer.getvalue()).decode()
+
+def _amostra_legada(tmp_path):
+    # Cópia da base de exemplo (user_version 0, produtos sem PRIMARY KEY) com uma foto em base64
+    db_file = str(tmp_path / 'gestao_recebimentos.db')
+    shutil.copy(AMOSTRA, db_file)
+    foto, foto_b64 = _foto_base64()
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE recebimentos SET foto_evidencia = ? WHERE id_recebimento = 1", (foto_b64,))
+    conn.commit()
+    conn.close()
+    return db_file, foto
+
+def test_base_legada_migra_sem_perder_dados(tmp_path, monkeypatch):
+    monkeypatch.delenv('RECEBIMENTO_ANALYTICS', raising=False)
+    monkeypatch.chdir(tmp_path)
+    db_file, foto = _amostra_legada(tmp_path)
+    with sqlite3.connect(AMOSTRA) as origem:
+        recebimentos = origem.execute("SELECT id_recebimento, codigo_produto, quantidade_recebida FROM recebimentos ORDER BY 1").fetchall()
+        codigos = origem.execute("SELECT COUNT(DISTINCT codigo_produto) FROM produtos").fetchone()[0]
+    app = carregar_app(db_file)
+
+    app.init_db()
+
+    with app.get_db_connection() as conn:
+        assert app.get_schema_version(conn) == app.MIGRATIONS[-1][0]
+        assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+        assert any(row[5] for row in conn.execute("PRAGMA table_info(produtos)"))
+        assert conn.execute("SELECT COUNT(*) FROM produtos").fetchone()[0] == codigos
+        assert conn.execute("SELECT id_recebimento, codigo_produto, quantidade_recebida FROM recebimentos ORDER BY 1").fetchall() == recebimentos
+        assert conn.execute("SELECT COUNT(*) FROM recebimentos WHERE ts_recebimento IS NULL").fetchone()[0] == 0
+        assert conn.execute("SELECT ts_recebimento FROM recebimentos WHERE id_recebimento = 1").fetchone()[0] == '2025-09-05 09:14'
+        assert conn.execute("SELECT COUNT(*) FROM auditorias WHERE ts_auditoria IS NULL").fetchone()[0] == 0
+        # Foto legada sai do base64 para a tabela fotos
+        foto_hash, foto_evidencia = conn.execute(
+            "SELECT foto_hash, foto_evidencia FROM recebimentos WHERE id_recebimento = 1").fetchone()
+        assert foto_evidencia is None
+        assert conn.execute("SELECT conteudo FROM fotos WHERE hash = ?", (foto_hash,)).fetchone()[0] == foto
+        # Resumos montados a partir das linhas existentes
+        assert conn.execute("SELECT SUM(qtd_recebimentos) FROM recebimentos_totais").fetchone()[0] == len(recebimentos)
+        assert conn.execute("SELECT SUM(qtd_recebimentos) FROM recebimentos_diarios").fetchone()[0] == len(recebimentos)
+        assert conn.execute("SELECT COUNT(*) FROM usuarios").fetchone()[0] == 3
+        assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'recebimentos'").fetchone()[0] == recebimentos[-1][0]
+        # Já migrada: nenhuma migração roda de novo
+        assert app.run_migrations(conn) == []
+
+    app.save_reception(recebimento('27'))
+    relatorio = app.get_recebimentos_relatorio()
+    assert relatorio['id_recebimento'].tolist() == [row[0] for row in recebimentos] + [recebimentos[-1][0] + 1]
+    assert '27' in [p['codigo_produto'] for p in app.search_products('abacate')]
@@ -0,0 +1,57 @@
+import pandas as pd
+
+from conftest import auditoria, recebimento
+
+def _tipos(df):
+    return {coluna: str(tipo) for coluna, tipo in df.dtypes.items()}
+
+def test_relatorio_lido_com_o_esquema_da_tabela(app):
+    app.save_receptions([recebimento(str(i), conferente=f'conf{i % 2}') for i in range(20)])
+
+    tipos = _tipos(app.get_recebimentos_relatorio())
+
+    assert tipos['id_recebimento'] == 'int64'
+    assert tipos['quantidade_recebida'] == 'float64'
+    assert tipos['codigo_produto'] == 'string'
+    assert tipos['conferente'] == tipos['condicao_produto'] == 'category'
+
+def test_read_sql_tipado_em_resultado_vazio_e_sem_tipos(app, monkeypatch):
+    query = "SELECT id_recebimento, codigo_produto, conferente FROM recebimentos"
+    with app.get_db_connection() as conn:
+        vazio = app.read_sql_tipado(query, conn, tabelas=('recebimentos',))
+        assert _tipos(vazio) == {'id_recebimento': 'int64', 'codigo_produto': 'string', 'conferente': 'category'}
+        assert vazio['codigo_produto'].dtype.storage == 'pyarrow'
+
+        monkeypatch.setattr(app, 'TIPOS_COMPACTOS', False)
+        app.save_reception(recebimento('1'))
+        assert _tipos(app.read_sql_tipado(query, conn, tabelas=('recebimentos',)))['conferente'] != 'category'
+
+def test_concat_une_categorias_sem_voltar_a_objetos(app):
+    partes = [app.tipar(pd.DataFrame({'id_auditoria': [1], 'status_divergencia': ['Aberta']}), 'auditorias'),
+              app.tipar(pd.DataFrame({'id_auditoria': [2], 'status_divergencia': ['Solucionada']}), 'auditorias')]
+
+    junto = app.concat_frames(partes)
+
+    assert _tipos(junto)['status_divergencia'] == 'category'
+    assert junto['status_divergencia'].tolist() == ['Aberta', 'Solucionada']
+
+def test_delta_mantem_os_tipos_com_categoria_nova(app):
+    app.save_audits([auditoria(str(i)) for i in range(3)])
+    tipos = _tipos(app.get_auditorias_historico())
+    primeiro = int(app.get_auditorias_historico()['id_auditoria'].iloc[0])
+
+    app.update_status_divergencia(primeiro, 'Em tratamento')
+    app.save_audit(auditoria('9', status='Solucionada'))
+    historico = app.get_auditorias_historico()
+
+    assert _tipos(historico) == tipos
+    assert historico['status_divergencia'].tolist() == ['Em tratamento', 'Aberta', 'Aberta', 'Solucionada']
+
+def test_tipos_compactos_ocupam_menos_memoria(app, monkeypatch):
+    app.save_receptions([recebimento(str(i % 50), conferente=f'conf{i % 3}') for i in range(2000)])
+    query = "SELECT * FROM recebimentos"
+    with app.get_db_connection() as conn:
+        compacto = app.read_sql_tipado(query, conn, tabelas=('recebimentos',))
+        monkeypatch.setattr(app, 'TIPOS_COMPACTOS', False)
+        objetos = app.read_sql_tipado(query, conn, tabelas=('recebimentos',))
+    assert app._approx_size(compacto) < app._approx_size(objetos)